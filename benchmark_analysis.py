@@ -0,0 +1,58 @@
+import argparse
+import time
+
+import r2pipe
+
+from src.extractor import ANALYSIS_LEVELS, analyze_functions
+
+
+def getopt() -> argparse.Namespace:
+    """
+    Parses the command line arguments
+    :return: The parsed arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Compares speed and function recall of the analysis "
+                    "levels of the opcode encoded extraction.")
+    parser.add_argument("input", nargs="+", metavar="file",
+                        help="Binary file(s) used for the comparison.")
+    parser.add_argument("-l", "--levels", default=":".join(ANALYSIS_LEVELS),
+                        help="List of analysis levels separated by `:`. The "
+                             "last one is used as reference for the recall.")
+    return parser.parse_args()
+
+
+def benchmark(files, level: str) -> tuple:
+    """
+    Extracts the functions of some files with the given analysis level.
+    :param files: paths to the binary files
+    :param level: analysis level, one of ANALYSIS_LEVELS
+    :return: A tuple (elapsed, functions) with the seconds spent and a list
+    with the set of function addresses found in each file
+    """
+    elapsed = 0
+    found = []
+    for file in files:
+        start_time = time.perf_counter()
+        r2 = r2pipe.open(file, ["-2"])
+        rows = analyze_functions(r2, level)
+        r2.quit()
+        elapsed += time.perf_counter() - start_time
+        found.append({row[0] for row in rows})
+    return elapsed, found
+
+
+if __name__ == "__main__":
+    args = getopt()
+    levels = args.levels.split(":")
+    results = {level: benchmark(args.input, level) for level in levels}
+    reference = results[levels[-1]][1]
+    print(f"{'level':<10}{'files/s':>10}{'functions':>12}{'recall':>10}")
+    for level in levels:
+        elapsed, found = results[level]
+        functions = sum(len(x) for x in found)
+        expected = sum(len(x) for x in reference)
+        common = sum(len(x & y) for x, y in zip(found, reference))
+        recall = common / expected if expected > 0 else 1
+        print(f"{level:<10}{len(args.input) / elapsed:>10.2f}"
+              f"{functions:>12}{recall:>10.3f}")
@@ -0,0 +1,96 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from src.binaryds import BinaryDs
+from src.compressedds import BLOCK_EXAMPLES, CompressedDs, compress_dataset
+
+
+def getopt() -> argparse.Namespace:
+    """
+    Parses the command line arguments
+    :return: The parsed arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Compares size and read throughput of a binary dataset "
+                    "against its compressed variants.")
+    parser.add_argument("dataset", help="Path to a .bin dataset generated by "
+                                        "the preprocess action.")
+    parser.add_argument("-c", "--codecs", default="zlib:lzma:bz2",
+                        help="List of codecs separated by `:`. lz4 and zstd "
+                             "require additional packages.")
+    parser.add_argument("-k", "--block", default=BLOCK_EXAMPLES, type=int,
+                        help="Number of examples in each compressed block.")
+    parser.add_argument("-b", "--batchsize", default=256, type=int,
+                        help="Number of examples read at once.")
+    parser.add_argument("-n", "--batches", default=1000, type=int,
+                        help="Number of batches read at random positions.")
+    parser.add_argument("-w", "--workdir", default=None,
+                        help="Folder where the compressed datasets will be "
+                             "temporarily written.")
+    return parser.parse_args()
+
+
+def throughput(dataset, batch: int, starts: np.ndarray) -> float:
+    """
+    Reads a batch of examples starting from each given index and returns
+    the read throughput.
+    :param dataset: The opened dataset (BinaryDs or CompressedDs)
+    :param batch: number of examples for each read
+    :param starts: index of the first example of each read
+    :return: The throughput in MiB/s
+    """
+    record_size = dataset.label_size + dataset.get_features()
+    read = 0
+    start_time = time.perf_counter()
+    for start in starts:
+        amount = min(batch, dataset.get_examples_no() - start)
+        _, data = dataset.read_array(int(start), int(amount))
+        # same conversion of the DataGenerator, also forces reading the data
+        data.astype(np.int32)
+        read += amount
+    elapsed = time.perf_counter() - start_time
+    return read * record_size / elapsed / 1048576
+
+
+def benchmark(dataset, batch: int, batches: int, seed: int = 0) -> tuple:
+    """
+    Measures sequential and random read throughput of a dataset.
+    :param dataset: The opened dataset (BinaryDs or CompressedDs)
+    :param batch: number of examples for each read
+    :param batches: number of reads at random positions
+    :param seed: seed used to generate the random positions
+    :return: A tuple (sequential, random) with the throughput in MiB/s
+    """
+    examples = dataset.get_examples_no()
+    sequential = throughput(dataset, batch, np.arange(0, examples, batch))
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, max(1, examples - batch), size=batches)
+    return sequential, throughput(dataset, batch, starts)
+
+
+if __name__ == "__main__":
+    args = getopt()
+    raw_size = os.path.getsize(args.dataset)
+    print(f"{'format':<8}{'ratio':>8}{'write MiB/s':>14}{'seq MiB/s':>12}"
+          f"{'rand MiB/s':>12}")
+    with BinaryDs(args.dataset, read_only=True) as raw:
+        seq, rand = benchmark(raw, args.batchsize, args.batches)
+        print(f"{'raw':<8}{1:>8.2f}{'-':>14}{seq:>12.1f}{rand:>12.1f}")
+        with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+            for codec in args.codecs.split(":"):
+                path = os.path.join(workdir, codec + ".binz")
+                start_time = time.perf_counter()
+                compress_dataset(raw, path, codec, args.block)
+                elapsed = time.perf_counter() - start_time
+                ratio = raw_size / os.path.getsize(path)
+                write = raw_size / elapsed / 1048576
+                with CompressedDs(path, read_only=True) as compressed:
+                    seq, rand = benchmark(compressed, args.batchsize,
+                                          args.batches)
+                print(f"{codec:<8}{ratio:>8.2f}{write:>14.1f}{seq:>12.1f}"
+                      f"{rand:>12.1f}")
+                os.remove(path)
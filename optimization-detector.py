@@ -4,18 +4,21 @@ import multiprocessing
 import sys
 
 from src.evaluation import run_evaluation
-from src.extractor import run_extractor
+from src.extractor import ANALYSIS_LEVELS, R2_TIMEOUT, run_extractor
 from src.inference import run_inference
-from src.preprocess import run_preprocess
+from src.leakage import run_purge_leaks
+from src.preprocess import run_ingest, run_preprocess
 from src.summary import run_summary
 from src.train import run_train
+from src.upgrade import run_upgrade
 
 
 class FlagDetectionTrainer:
 
     def __init__(self):
-        actions = ["extract", "preprocess", "summary",
-                   "train", "tune", "evaluate", "infer"]
+        actions = ["extract", "preprocess", "ingest", "summary",
+                   "purge-leaks", "upgrade", "train", "tune", "evaluate",
+                   "infer"]
         actions_desc = functools.reduce(lambda a, b: a + "\n\t" + b, actions)
         parser = argparse.ArgumentParser(
             description="Train a compiler and optimization detector",
@@ -28,7 +31,7 @@ class FlagDetectionTrainer:
                             help="The action that should be performed.")
         args = parser.parse_args(sys.argv[1:2])
         # dispatch function with same name of the action
-        getattr(self, args.action)(sys.argv[2:])
+        getattr(self, args.action.replace("-", "_"))(sys.argv[2:])
 
     @staticmethod
     def extract(args):
@@ -47,14 +50,47 @@ class FlagDetectionTrainer:
                                  "extracted data.")
         parser.add_argument("-e", "--encoded", action="store_true",
                             help="Assumes opcode encoded analysis if set.")
-        parser.add_argument("-j", "--jobs", required=False,
+        parser.add_argument("-j", "--jobs", required=False, type=int,
                             default=multiprocessing.cpu_count(),
                             help="Specifies the number of concurrent jobs. "
                                  "Default to the number of CPUs in the "
                                  "system.")
+        parser.add_argument("-t", "--timeout", required=False, type=int,
+                            default=R2_TIMEOUT,
+                            help="Maximum number of seconds spent analyzing "
+                                 "a single file. Files exceeding it are "
+                                 "skipped and reported as timed out.")
+        parser.add_argument("-c", "--cache", required=False, default=None,
+                            help="Folder used to cache the extracted data. "
+                                 "Binaries already extracted with the same "
+                                 "content are not extracted again.")
+        parser.add_argument("--cache-size", required=False, type=int,
+                            default=0,
+                            help="Maximum size of the cache in MiB. The least "
+                                 "recently used data is removed when "
+                                 "exceeding it. Default to unlimited.")
+        parser.add_argument("-a", "--analysis", choices=ANALYSIS_LEVELS,
+                            default="aaa",
+                            help="Analysis used to find the functions with "
+                                 "--encoded: symbol table only, aa or aaa "
+                                 "(the default, slowest and most accurate). "
+                                 "Files exceeding the timeout are analyzed "
+                                 "again with the cheaper levels.")
+        parser.add_argument("--csv", action="store_true",
+                            help="Writes the functions extracted with "
+                                 "--encoded as .csv files instead of the "
+                                 "more compact .fns files.")
+        parser.add_argument("-r", "--retry", action="store_true",
+                            help="Extracts again the files that failed or "
+                                 "timed out in a previous run with the same "
+                                 "output folder. Files already extracted are "
+                                 "always skipped.")
         parsed_args = parser.parse_args(args)
         run_extractor(parsed_args.input, parsed_args.output_dir,
-                      parsed_args.encoded, parsed_args.jobs)
+                      parsed_args.encoded, parsed_args.jobs,
+                      parsed_args.timeout, parsed_args.cache,
+                      parsed_args.cache_size * 1048576, parsed_args.csv,
+                      parsed_args.analysis, parsed_args.retry)
 
     @staticmethod
     def preprocess(args):
@@ -85,6 +121,10 @@ class FlagDetectionTrainer:
         parser.add_argument("-b", "--balance", action="store_true",
                             help="Decides whether the amount of samples "
                                  "should be the same for every class or not.")
+        parser.add_argument("-q", "--quota", default=0, type=int,
+                            metavar="int",
+                            help="Maximum number of samples kept for every "
+                                 "class. Can be combined with --balance.")
         parser.add_argument("--incomplete", action="store_true",
                             help="Generates an incomplete dataset, "
                                  "effectively skipping deduplication, "
@@ -92,11 +132,119 @@ class FlagDetectionTrainer:
                                  "train/validation/test. This assumes that "
                                  "another preprocess will be called later "
                                  "without this flag enabled")
+        parser.add_argument("-j", "--jobs", required=False, type=int,
+                            default=multiprocessing.cpu_count(),
+                            help="Specifies the number of concurrent jobs "
+                                 "used for deduplication. Default to the "
+                                 "number of CPUs in the system.")
         parsed_args = parser.parse_args(args)
         run_preprocess(parsed_args.data_dir, parsed_args.category,
                        parsed_args.output_dir, parsed_args.encoded,
                        parsed_args.features, parsed_args.balance,
-                       parsed_args.seed, parsed_args.incomplete)
+                       parsed_args.seed, parsed_args.incomplete,
+                       parsed_args.jobs, parsed_args.quota)
+
+    @staticmethod
+    def ingest(args):
+        parser = argparse.ArgumentParser(
+            description="Extracts the data from binary files and adds it "
+                        "directly to the dataset, as extract followed by "
+                        "preprocess but without intermediate files.",
+            usage=f"{sys.argv[0]} ingest [optional arguments] "
+                  f"-c category file output_dir\n")
+        parser.add_argument("input",
+                            nargs="+",
+                            metavar="file",
+                            help="Binary file(s), or folders containing "
+                                 "them, for a single category.")
+        parser.add_argument("output_dir",
+                            help="Path to the folder that will contain the "
+                                 "preprocessed data. If an existing dataset is"
+                                 " found, it will be merged with this one.")
+        parser.add_argument("-e", "--encoded", action="store_true",
+                            help="Assumes opcode encoded analysis if set.")
+        parser.add_argument("-f", "--features", default=2048, type=int,
+                            help="Number of features used in the evaluation, "
+                                 "defaults to 2048.")
+        parser.add_argument("-c", "--category", required=True, metavar="int",
+                            help="A number representing the "
+                                 "category label for this data.", type=int)
+        parser.add_argument("-s", "--seed", default=None,
+                            help="Seed used for the shuffling process")
+        parser.add_argument("-b", "--balance", action="store_true",
+                            help="Decides whether the amount of samples "
+                                 "should be the same for every class or not.")
+        parser.add_argument("-q", "--quota", default=0, type=int,
+                            metavar="int",
+                            help="Maximum number of samples kept for every "
+                                 "class. Can be combined with --balance.")
+        parser.add_argument("--incomplete", action="store_true",
+                            help="Generates an incomplete dataset, as in the "
+                                 "preprocess action.")
+        parser.add_argument("-j", "--jobs", required=False, type=int,
+                            default=multiprocessing.cpu_count(),
+                            help="Specifies the number of concurrent jobs "
+                                 "used for extraction and deduplication. "
+                                 "Default to the number of CPUs in the "
+                                 "system.")
+        parser.add_argument("-t", "--timeout", required=False, type=int,
+                            default=R2_TIMEOUT,
+                            help="Maximum number of seconds spent analyzing "
+                                 "a single file. Files exceeding it are "
+                                 "skipped.")
+        parser.add_argument("-a", "--analysis", choices=ANALYSIS_LEVELS,
+                            default="aaa",
+                            help="Analysis used to find the functions with "
+                                 "--encoded: symbol table only, aa or aaa "
+                                 "(the default, slowest and most accurate). "
+                                 "Files exceeding the timeout are analyzed "
+                                 "again with the cheaper levels.")
+        parser.add_argument("-k", "--keep", required=False, default=None,
+                            metavar="dir",
+                            help="Folder where the extracted data is also "
+                                 "written, as done by the extract action.")
+        parsed_args = parser.parse_args(args)
+        run_ingest(parsed_args.input, parsed_args.category,
+                   parsed_args.output_dir, parsed_args.encoded,
+                   parsed_args.features, parsed_args.balance,
+                   parsed_args.seed, parsed_args.incomplete,
+                   parsed_args.jobs, parsed_args.quota, parsed_args.timeout,
+                   parsed_args.keep, parsed_args.analysis)
+
+    @staticmethod
+    def purge_leaks(args):
+        parser = argparse.ArgumentParser(
+            description="Finds the examples shared by the train, validation "
+                        "and test sets of a preprocessed dataset. With "
+                        "--remove, they are kept only in the test set (or in "
+                        "the validation set, if not in the test one).",
+            usage=f"{sys.argv[0]} purge-leaks [optional args] model_dir\n")
+        parser.add_argument("model_dir",
+                            help="Folder for the model containing the "
+                                 "files generated by the preprocess action.")
+        parser.add_argument("-r", "--remove", action="store_true",
+                            help="Removes the shared examples instead of "
+                                 "just reporting them.")
+        parser.add_argument("-j", "--jobs", required=False, type=int,
+                            default=multiprocessing.cpu_count(),
+                            help="Specifies the number of concurrent jobs "
+                                 "used for hashing. Default to the number of "
+                                 "CPUs in the system.")
+        parsed_args = parser.parse_args(args)
+        run_purge_leaks(parsed_args.model_dir, parsed_args.remove,
+                        parsed_args.jobs)
+
+    @staticmethod
+    def upgrade(args):
+        parser = argparse.ArgumentParser(
+            description="Converts in place the datasets of a preprocessed "
+                        "folder to the latest file format.",
+            usage=f"{sys.argv[0]} upgrade [-h] model_dir\n")
+        parser.add_argument("model_dir",
+                            help="Folder for the model containing the "
+                                 "files generated by the preprocess action.")
+        parsed_args = parser.parse_args(args)
+        run_upgrade(parsed_args.model_dir)
 
     @staticmethod
     def train(args):
@@ -105,8 +253,8 @@ class FlagDetectionTrainer:
                         "previously generated data.",
             usage=f"{sys.argv[0]} train [optional args] model_dir\n")
         parser.add_argument("data_dir",
-                            help="Folder for containing the test.bin and "
-                                 "train.bin generated by the preprocess "
+                            help="Folder containing the dataset.bin and "
+                                 "splits.json generated by the preprocess "
                                  "action. This train run will create a "
                                  "subfolder in this directory containing the "
                                  "trained model")
@@ -132,8 +280,9 @@ class FlagDetectionTrainer:
                         "matrix for a set number of features",
             usage=f"{sys.argv[0]} evaluate [optional args] data_dir\n")
         parser.add_argument("data_dir",
-                            help="Folder for the model containing the "
-                                 "test.bin generated by the preprocess action")
+                            help="Folder containing the dataset.bin and "
+                                 "splits.json generated by the preprocess "
+                                 "action")
         parser.add_argument("-m", "--model_path", default="",
                             help="Trained model. Defaults to "
                                  "data_dir/model.h5")
@@ -1,11 +1,33 @@
 import hashlib
+import json
+import math
+import mmap
 import os
 import random
-from typing import BinaryIO, Optional, List, Tuple
+import tempfile
+import threading
+from concurrent.futures.process import ProcessPoolExecutor
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional, List, \
+    Tuple
+
+import numpy as np
+from tqdm import tqdm
 
 HEADER_SIZE = 8
 MAGIC = 0x27
+HEADER_SIZE_V2 = 32
+MAGIC_V2 = 0x28
+FLAG_ENCODED = 0x80
 BLOCK_SIZE = 4194304
+SHUFFLE_MEMORY = 1073741824
+SHUFFLE_BUCKETS = 256  # temporary files open at once when shuffling
+COUNTS_SUFFIX = ".counts"
+FILES_SUFFIX = ".files"
+COALESCE_GAP = 65536
+PARALLEL_HASH_SIZE = 16777216  # bytes hashed before starting more processes
+# data type of each column that can be stored alongside the examples
+COLUMNS = {"group": "<u8", "hash": "<u8", "file": "<u4", "offset": "<u8",
+           "length": "<u4"}
 
 
 class BinaryDs:
@@ -13,13 +35,44 @@ class BinaryDs:
     Class used to contain a dataset in a binary form, where each example
     belongs to a given category.
 
-    File structure of the binary:
-    1 bytes -> magic
+    File structure of the binary (version 2, used for new datasets):
+    1 bytes -> magic (MAGIC_V2)
+    1 bytes -> flags: FLAG_ENCODED if data is opcode based, the other bits
+    are reserved
+    2 bytes -> reserved
+    2 bytes -> number of features for each example
+    2 bytes -> number of categories
+    8 bytes -> number of examples
+    16 bytes -> reserved
+    All the examples in the form {label(2 bytes)+data}
+
+    File structure of the binary (version 1, still readable and writable):
+    1 bytes -> magic (MAGIC)
     1 bit -> 0: data is opcode based, 1:data is raw based
     7 bit -> number of categories (max 127 ofc)
     2 bytes -> number of features for each example
     4 bytes -> number of examples
     All the examples in the form {label(1 byte)+data}
+    Version 1 datasets can be converted with the upgrade method.
+
+    The number of examples for each category is kept in a sidecar file with
+    the same name of the binary plus the .counts extension. This file contains
+    a sequence of 8 bytes little endian integers: the number of examples
+    followed by the amount of examples for each category. The sidecar is
+    rebuilt if missing or inconsistent with the binary.
+
+    Additional values can be associated to each example with columns. Each
+    column is a sidecar file with the name of the binary plus the name of the
+    column as extension, containing a value for each example (with the type
+    defined in COLUMNS), in the same order of the examples. Columns are kept
+    aligned with the examples by every operation of this class, and ignored
+    if inconsistent with the binary.
+
+    The `file`, `offset` and `length` columns record the provenance of each
+    example: the id of the file it was extracted from, its position in that
+    file and the length of the original data. The path of each file is kept
+    in a sidecar with the .files extension, containing a JSON list where the
+    file with id i is at position i-1 (0 is used for unknown files).
     """
 
     def __init__(self, path: str, read_only: bool = False,
@@ -35,7 +88,9 @@ class BinaryDs:
         (This has no effect on the dataset itself, but it is used as a double
         check to avoid mixing data from dataset encoded in different ways)
         """
-        self.magic: int = MAGIC
+        self.magic: int = MAGIC_V2
+        self.header_size: int = HEADER_SIZE_V2
+        self.label_size: int = 2  # bytes used for the label of each example
         self.encoded: bool = encoded
         self.modified: bool = False  # true if some write has been performed
         self.path: str = path
@@ -43,6 +98,10 @@ class BinaryDs:
         self.examples: int = 0
         self.ro: bool = read_only
         self.file: Optional[BinaryIO] = None
+        self.view: Optional[np.ndarray] = None  # mmap of the examples
+        self.counts: Optional[np.ndarray] = None  # examples for each category
+        self.files: Optional[List[str]] = None  # paths of the source files
+        self.lock: threading.Lock = threading.Lock()  # used if no os.pread
 
     def open(self):
         """
@@ -55,13 +114,14 @@ class BinaryDs:
                 raise PermissionError("Could not create file (Read only flag)")
             else:
                 self.file = open(self.path, "wb+")
+                self.file.write(bytes(self.header_size))
+                self.file.seek(0, os.SEEK_SET)
                 self.file.write(self.magic.to_bytes(1, byteorder="little"))
-                if self.encoded:
-                    self.file.write(b'\x80')
-                else:
-                    self.file.write(b'\x00')
+                flags = FLAG_ENCODED if self.encoded else 0
+                self.file.write(flags.to_bytes(1, byteorder="little"))
+                self.file.seek(4, os.SEEK_SET)
                 self.file.write(self.features.to_bytes(2, byteorder="little"))
-                self.file.write(self.examples.to_bytes(4, byteorder="little"))
+                self.__write_examples_no()
         elif self.ro and os.access(self.path, os.R_OK):
             self.file = open(self.path, "rb")
             self.__read_and_check_existing()
@@ -77,8 +137,15 @@ class BinaryDs:
         Closes an open dataset.
         """
         if self.file:
-            if self.modified:
+            if not self.ro and self.counts is not None:
                 self.__write_max_cats()
+                self.__write_counts()
+            if not self.ro and self.files is not None:
+                with open(self.path + FILES_SUFFIX, "w") as fp:
+                    json.dump(self.files, fp)
+            self.view = None
+            self.counts = None
+            self.files = None
             self.file.close()
             self.file = None
 
@@ -88,51 +155,96 @@ class BinaryDs:
     def __exit__(self, exc_type, exc_value, tb):
         self.close()
 
-    # determine the number of categories inside the dataset
-    # if the dataset contains an example for 0, and for 2, the categories will
-    # be 3 (even though 1 is missing)
-    def __calc_max_cat(self) -> int:
-        cats = 0
-        self.file.seek(HEADER_SIZE, os.SEEK_SET)
-        for i in range(self.examples):
-            data = self.file.read(self.features + 1)
-            cat = data[0]
-            if cat >= cats:
-                cats = cat + 1
-        return cats
+    # returns the number of examples for each category, loading it from the
+    # sidecar file or, if not existing or not consistent, from the dataset
+    def __get_counts(self) -> np.ndarray:
+        if self.counts is None:
+            counts_path = self.path + COUNTS_SUFFIX
+            if os.path.exists(counts_path):
+                stored = np.fromfile(counts_path, dtype="<u8").astype(np.int64)
+                if len(stored) > 0 and stored[0] == self.examples and \
+                        stored[1:].sum() == self.examples:
+                    self.counts = stored[1:]
+            if self.counts is None:
+                labels = self.get_array()["label"]
+                self.counts = np.bincount(labels).astype(np.int64)
+        return self.counts
+
+    # updates the amount of examples for each category, given the labels of
+    # the added or removed examples
+    def __update_counts(self, labels: np.ndarray, removed: bool = False):
+        counts = self.__get_counts()
+        found = np.bincount(labels, minlength=len(counts)).astype(np.int64)
+        if removed:
+            self.counts = counts - found
+        else:
+            found[:len(counts)] += counts
+            self.counts = found
+
+    # writes the amount of examples for each category in the sidecar file
+    def __write_counts(self):
+        stored = np.concatenate(([self.examples], self.__get_counts()))
+        stored.astype("<u8").tofile(self.path + COUNTS_SUFFIX)
 
     # read the max cat value inside the binary on disk
     def __read_max_cats(self) -> int:
-        self.file.seek(1, os.SEEK_SET)
-        data = int.from_bytes(self.file.read(1), byteorder="little")
-        return data & 0x7F
+        if self.magic == MAGIC:
+            data = int.from_bytes(self.__pread(1, 1), byteorder="little")
+            return data & 0x7F
+        else:
+            return int.from_bytes(self.__pread(2, 6), byteorder="little")
 
     def __read_encoding(self) -> bool:
-        self.file.seek(1, os.SEEK_SET)
-        data = int.from_bytes(self.file.read(1), byteorder="little")
-        return data & 0x80 > 0
+        data = int.from_bytes(self.__pread(1, 1), byteorder="little")
+        return data & FLAG_ENCODED > 0
 
     # writes the max cat value inside the binary on disk
     def __write_max_cats(self):
-        cats = self.__calc_max_cat()
-        self.file.seek(1, os.SEEK_SET)
-        data = (int(self.encoded) << 7) | (cats & 0x7F)
-        self.file.write(data.to_bytes(1, byteorder="little"))
+        cats = len(self.get_category_counts())
+        if self.magic == MAGIC:
+            self.file.seek(1, os.SEEK_SET)
+            data = (int(self.encoded) << 7) | (cats & 0x7F)
+            self.file.write(data.to_bytes(1, byteorder="little"))
+        else:
+            self.file.seek(6, os.SEEK_SET)
+            self.file.write(cats.to_bytes(2, byteorder="little"))
+        self.file.flush()
+
+    # writes the number of examples inside the binary on disk
+    def __write_examples_no(self):
+        if self.magic == MAGIC:
+            self.file.seek(4, os.SEEK_SET)
+            self.file.write(self.examples.to_bytes(4, byteorder="little"))
+        else:
+            self.file.seek(8, os.SEEK_SET)
+            self.file.write(self.examples.to_bytes(8, byteorder="little"))
 
     def __read_and_check_existing(self) -> None:
         # Reads the data from the existing dataset file
         # Checks for consistency with the expected encoding and feature size
         # If the file is open for reading, just update features and encoding
         self.file.seek(0, os.SEEK_SET)
-        if int.from_bytes(self.file.read(1), byteorder="little") != MAGIC:
+        header = self.file.read(HEADER_SIZE_V2)
+        if len(header) >= HEADER_SIZE and header[0] == MAGIC:
+            self.magic = MAGIC
+            self.header_size = HEADER_SIZE
+            self.label_size = 1
+            features = int.from_bytes(header[2:4], byteorder="little")
+            self.examples = int.from_bytes(header[4:8], byteorder="little")
+        elif len(header) == HEADER_SIZE_V2 and header[0] == MAGIC_V2:
+            if header[1] & ~FLAG_ENCODED:
+                self.file.close()
+                self.file = None
+                raise IOError(f"File {self.path} uses features not supported "
+                              f"by this version.")
+            features = int.from_bytes(header[4:6], byteorder="little")
+            self.examples = int.from_bytes(header[8:16], byteorder="little")
+        else:
             self.file.close()
             self.file = None
             raise IOError(f"File {self.path} was not created by this "
                           f"application.")
-        encoded = (int.from_bytes(self.file.read(1),
-                                  byteorder="little") & 0x80) > 0
-        features = int.from_bytes(self.file.read(2), byteorder="little")
-        self.examples = int.from_bytes(self.file.read(4), byteorder="little")
+        encoded = header[1] & FLAG_ENCODED > 0
         # consistency check
         if not self.ro and self.encoded != encoded:
             self.file.close()
@@ -163,7 +275,24 @@ class BinaryDs:
         category 2, this function will return 3 despite the category 1 being
         missing.
         """
-        return self.__read_max_cats()
+        if self.counts is None and not self.modified:
+            # header is up to date, avoid loading the counts
+            return self.__read_max_cats()
+        else:
+            return len(self.get_category_counts())
+
+    def get_category_counts(self) -> List[int]:
+        """
+        Returns the number of examples for each category contained in the
+        dataset. The returned list has a length equal to get_categories(),
+        so categories without examples are reported as 0.
+        """
+        counts = self.__get_counts()
+        nonzero = np.flatnonzero(counts)
+        if len(nonzero) == 0:
+            return []
+        else:
+            return counts[:nonzero[-1] + 1].tolist()
 
     def get_features(self) -> int:
         """
@@ -177,6 +306,53 @@ class BinaryDs:
         """
         return self.examples
 
+    def get_version(self) -> int:
+        """
+        Returns the version of the file format used by the dataset.
+        """
+        return 1 if self.magic == MAGIC else 2
+
+    def upgrade(self) -> None:
+        """
+        Converts in place a version 1 dataset to the version 2 format.
+        The records are moved starting from the last one, as each of them
+        is stored after its old position, and the header is written at the
+        end. Datasets already in version 2 have only their header rewritten.
+        The conversion can not be interrupted safely, so a copy of big
+        datasets should be kept until it is completed.
+        """
+        if self.ro:
+            raise PermissionError("Dataset opened in read only mode")
+        categories = len(self.get_category_counts())
+        if self.magic == MAGIC:
+            new_size = self.features + 2
+            block = max(1, int(BLOCK_SIZE / new_size))
+            self.view = None
+            self.file.truncate(HEADER_SIZE_V2 + new_size * self.examples)
+            end = self.examples
+            while end > 0:
+                index = max(0, end - block)
+                records = self.__read_records(index, end - index)
+                converted = np.zeros((len(records), new_size), dtype=np.uint8)
+                converted[:, 0] = records[:, 0]
+                converted[:, 2:] = records[:, 1:]
+                self.file.seek(HEADER_SIZE_V2 + new_size * index, os.SEEK_SET)
+                self.file.write(converted.tobytes())
+                end = index
+            self.file.flush()
+        self.magic = MAGIC_V2
+        self.header_size = HEADER_SIZE_V2
+        self.label_size = 2
+        header = bytearray(HEADER_SIZE_V2)
+        header[0] = MAGIC_V2
+        header[1] = FLAG_ENCODED if self.encoded else 0
+        header[4:6] = self.features.to_bytes(2, byteorder="little")
+        header[6:8] = categories.to_bytes(2, byteorder="little")
+        header[8:16] = self.examples.to_bytes(8, byteorder="little")
+        self.file.seek(0, os.SEEK_SET)
+        self.file.write(header)
+        self.file.flush()
+
     def write(self, data: List[Tuple[int, bytes]],
               update_categories: bool = False) -> None:
         """
@@ -190,14 +366,63 @@ class BinaryDs:
         for val in data:
             if len(val[1]) != self.features:
                 raise ValueError("The input example has a wrong length")
-        offset = HEADER_SIZE + (self.features + 1) * self.examples
-        self.examples += len(data)
-        self.file.seek(4, os.SEEK_SET)
-        self.file.write(self.examples.to_bytes(4, byteorder="little"))
+        labels = np.array([val[0] for val in data], dtype=np.int64)
+        joined = b"".join([val[1] for val in data])
+        values = np.frombuffer(joined, dtype=np.uint8)
+        self.write_array(labels, values.reshape(-1, self.features),
+                         update_categories)
+
+    def write_array(self, labels: np.ndarray, data: np.ndarray,
+                    update_categories: bool = False,
+                    columns: Optional[Dict[str, np.ndarray]] = None) -> None:
+        """
+        Writes a block of examples in the file, with a single write call.
+        Throws ValueError if the data has a different number of features
+        compared to the one passed in the constructor, or if the number of
+        labels and examples differ.
+        :param labels: A 1D array containing the category id of each example.
+        :param data: A 2D array of uint8, each row being an example.
+        :param update_categories: True if the max number of categories should
+        be updated. This will be done in any case when closing the file.
+        :param columns: Values of some columns for the written examples, with
+        the name of the column as key. Existing columns not in this dictionary
+        will contain zeroes for the written examples.
+        """
+        labels = np.asarray(labels)
+        data = np.asarray(data)
+        if data.ndim != 2 or data.shape[1] != self.features:
+            raise ValueError("The input example has a wrong length")
+        if labels.shape != (data.shape[0],):
+            raise ValueError("The number of labels and examples differ")
+        # the highest label must leave room for the number of categories
+        max_label = 0x7E if self.magic == MAGIC else 0xFFFE
+        if len(labels) > 0 and (labels.min() < 0 or labels.max() > max_label):
+            raise ValueError(f"Category ids must be in range [0, {max_label}]")
+        if self.magic == MAGIC and self.examples + len(labels) > 0xFFFFFFFF:
+            raise IOError("Too many examples for a version 1 dataset, it "
+                          "should be upgraded")
+        if columns is None:
+            columns = {}
+        for name, values in columns.items():
+            if name not in COLUMNS:
+                raise ValueError(f"Unknown column {name}")
+            if len(values) != len(labels):
+                raise ValueError("The number of values and examples differ")
+        record_size = self.label_size + self.features
+        records = np.empty((len(labels), record_size), dtype=np.uint8)
+        label_type = np.dtype("<u" + str(self.label_size))
+        records[:, :self.label_size] = labels.astype(label_type).view(
+            np.uint8).reshape(-1, self.label_size)
+        records[:, self.label_size:] = data
+        self.__update_counts(labels.astype(np.int64))
+        self.__append_columns(columns, len(labels))
+        offset = self.header_size + record_size * self.examples
+        self.examples += len(labels)
+        self.__write_examples_no()
         self.file.seek(offset, os.SEEK_SET)
-        for val in data:
-            self.file.write(val[0].to_bytes(1, byteorder="little"))
-            self.file.write(val[1])
+        self.file.write(records.tobytes())
+        self.file.flush()  # reads do not go through the file buffer
+        self.view = None
         self.modified = True
         if update_categories:
             self.__write_max_cats()
@@ -215,80 +440,449 @@ class BinaryDs:
         if index + amount > self.examples:
             raise IndexError
         else:
-            retval = []
-            offset = HEADER_SIZE + (self.features + 1) * index
-            self.file.seek(offset, os.SEEK_SET)
-            for i in range(0, amount):
-                cat = int.from_bytes(self.file.read(1), byteorder="little")
-                data = self.file.read(self.features)
-                retval.append((cat, data))
-            return retval
+            record_size = self.label_size + self.features
+            offset = self.header_size + record_size * index
+            data = self.__pread(record_size * amount, offset)
+            size = self.label_size
+            return [(int.from_bytes(data[i:i + size], byteorder="little"),
+                     data[i + size:i + record_size])
+                    for i in range(0, len(data), record_size)]
+
+    # reads from the file without using its offset, so it can be called
+    # concurrently from several threads
+    def __pread(self, size: int, offset: int) -> bytes:
+        return read_at(self.file, size, offset, self.lock)
+
+    def get_array(self) -> np.ndarray:
+        """
+        Returns the examples of the dataset as a read-only structured array
+        backed by a memory map of the file, without copying any data.
+        The array has one row for each example, with a `label` field (uint16,
+        or uint8 for version 1 datasets) and a `data` field (uint8 array of
+        features length).
+        The returned array is invalidated by any operation removing examples
+        from the dataset, and should not be accessed after that.
+        :return: A numpy structured array with shape (examples,)
+        """
+        # buffered writes must reach the file before being visible in the map
+        self.file.flush()
+        if self.view is None or len(self.view) != self.examples:
+            dtype = np.dtype([("label", "<u" + str(self.label_size)),
+                              ("data", np.uint8, (self.features,))])
+            if self.examples == 0:
+                self.view = np.empty(0, dtype=dtype)
+            else:
+                mapped = mmap.mmap(self.file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+                self.view = np.ndarray(shape=(self.examples,), dtype=dtype,
+                                       buffer=mapped,
+                                       offset=self.header_size)
+        return self.view
+
+    def read_array(self, index: int,
+                   amount: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Reads some examples from the dataset as numpy arrays, without copying
+        them. The returned arrays are read-only views over the memory mapped
+        file.
+        Raises IndexError if index+amount is higher than the number of
+        available examples.
+        :param index: The starting index of the examples to read (0-based)
+        :param amount: The number of examples that will be read
+        :return: A tuple (labels, data) where labels is an array with shape
+        (amount,) and data a uint8 matrix with shape (amount, features)
+        """
+        if index + amount > self.examples:
+            raise IndexError
+        else:
+            view = self.get_array()[index:index + amount]
+            return view["label"], view["data"]
+
+    def read_indices(self, indices: np.ndarray,
+                     gap: int = COALESCE_GAP) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Reads the examples at arbitrary positions of the dataset.
+        The indices are sorted, and indices close to each other are read with
+        a single contiguous read, so the throughput gets closer to the one of
+        a sequential read as more examples are requested. The file offset is
+        not used, so this method can be called concurrently from several
+        threads.
+        Raises IndexError if any index is outside the dataset.
+        :param indices: array with the index of every example to read, in any
+        order and possibly repeated
+        :param gap: maximum amount of unrequested bytes between two examples
+        that will be read anyway to avoid a separate read
+        :return: A tuple (labels, data), with the same shapes of read_array and
+        the examples in the same order of indices. The arrays are a copy of the
+        data
+        """
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        record_size = self.label_size + self.features
+        records = np.empty((len(indices), record_size), dtype=np.uint8)
+        if len(indices) > 0:
+            if indices.min() < 0 or indices.max() >= self.examples:
+                raise IndexError
+            order = np.argsort(indices, kind="stable")
+            ordered = indices[order]
+            # a new read starts after a long gap or when crossing a block, so
+            # a single read is never bigger than BLOCK_SIZE
+            block = ordered // max(1, BLOCK_SIZE // record_size)
+            breaks = np.flatnonzero(
+                (np.diff(ordered) > max(1, gap // record_size)) |
+                (np.diff(block) != 0)) + 1
+            starts = np.concatenate(([0], breaks))
+            ends = np.concatenate((breaks, [len(ordered)]))
+            for start, end in zip(starts, ends):
+                first = ordered[start]
+                amount = ordered[end - 1] - first + 1
+                read = self.__read_records(int(first), int(amount))
+                records[order[start:end]] = read[ordered[start:end] - first]
+        return self.__get_labels(records), records[:, self.label_size:]
+
+    def get_column(self, name: str) -> Optional[np.ndarray]:
+        """
+        Returns the values of a column, one for each example.
+        Raises ValueError if the column is not in COLUMNS.
+        :param name: The name of the column
+        :return: An array with the values of the column, or None if the column
+        does not exist or is not consistent with the dataset
+        """
+        if name not in COLUMNS:
+            raise ValueError(f"Unknown column {name}")
+        if name not in self.__get_columns():
+            return None
+        return np.fromfile(self.path + "." + name, dtype=COLUMNS[name])
+
+    def set_column(self, name: str, values: np.ndarray) -> None:
+        """
+        Replaces all the values of a column, creating it if not existing.
+        Raises ValueError if the column is not in COLUMNS or the number of
+        values differs from the number of examples.
+        :param name: The name of the column
+        :param values: An array with a value for each example
+        """
+        if self.ro:
+            raise PermissionError("Could not write column (Read only flag)")
+        if name not in COLUMNS:
+            raise ValueError(f"Unknown column {name}")
+        values = np.asarray(values, dtype=COLUMNS[name])
+        if values.shape != (self.examples,):
+            raise ValueError("The number of values and examples differ")
+        values.tofile(self.path + "." + name)
+
+    def get_files(self) -> List[str]:
+        """
+        Returns the paths of the files referenced by the `file` column. The
+        file with id i is at position i-1 of the list.
+        """
+        if self.files is None:
+            self.files = []
+            if os.path.exists(self.path + FILES_SUFFIX):
+                with open(self.path + FILES_SUFFIX, "r") as fp:
+                    self.files = json.load(fp)
+        return self.files
 
-    def shuffle(self, seed=None) -> None:
+    def add_files(self, paths: List[str]) -> np.ndarray:
+        """
+        Adds some files to the ones referenced by the `file` column, if not
+        already there. The list is written when closing the dataset.
+        :param paths: The paths of the files
+        :return: An array with the id of each file
+        """
+        if self.ro:
+            raise PermissionError("Could not add files (Read only flag)")
+        files = self.get_files()
+        ids = {path: i + 1 for i, path in enumerate(files)}
+        result = np.empty(len(paths), dtype=np.uint32)
+        for i, path in enumerate(paths):
+            if path not in ids:
+                files.append(path)
+                ids[path] = len(files)
+            result[i] = ids[path]
+        return result
+
+    # converts the file ids of another dataset to the ids of this one
+    def __map_files(self, other) -> np.ndarray:
+        return np.concatenate(([0], self.add_files(other.get_files())))
+
+    # returns the name of the columns consistent with the dataset
+    def __get_columns(self) -> List[str]:
+        names = []
+        for name, dtype in COLUMNS.items():
+            path = self.path + "." + name
+            size = self.examples * np.dtype(dtype).itemsize
+            if os.path.exists(path) and os.path.getsize(path) == size:
+                names.append(name)
+        return names
+
+    # appends the values of the given columns for `amount` new examples, must
+    # be called before updating the number of examples. Missing values of
+    # other columns are filled with zeroes
+    def __append_columns(self, columns: Dict[str, np.ndarray],
+                         amount: int) -> None:
+        existing = self.__get_columns()
+        for name in sorted(set(existing) | set(columns)):
+            dtype = np.dtype(COLUMNS[name])
+            if name in columns:
+                values = np.asarray(columns[name], dtype=dtype)
+            else:
+                values = np.zeros(amount, dtype=dtype)
+            if name in existing:
+                with open(self.path + "." + name, "ab") as fp:
+                    values.tofile(fp)
+            else:
+                with open(self.path + "." + name, "wb") as fp:
+                    np.zeros(self.examples, dtype=dtype).tofile(fp)
+                    values.tofile(fp)
+
+    # reads the values of some examples from the given columns
+    def __read_column_range(self, names: List[str], index: int,
+                            amount: int) -> Dict[str, np.ndarray]:
+        values = {}
+        for name in names:
+            dtype = np.dtype(COLUMNS[name])
+            with open(self.path + "." + name, "rb") as fp:
+                fp.seek(index * dtype.itemsize, os.SEEK_SET)
+                values[name] = np.fromfile(fp, dtype=dtype, count=amount)
+        return values
+
+    # overwrites the values of the given columns starting from index
+    def __write_column_range(self, values: Dict[str, np.ndarray],
+                             index: int) -> None:
+        for name, column in values.items():
+            dtype = np.dtype(COLUMNS[name])
+            with open(self.path + "." + name, "rb+") as fp:
+                fp.seek(index * dtype.itemsize, os.SEEK_SET)
+                np.asarray(column, dtype=dtype).tofile(fp)
+
+    # removes from every column the values of the examples marked as False in
+    # the keep mask, in place and one block at a time. Must be called before
+    # resizing the dataset
+    def __filter_columns(self, keep: np.ndarray) -> None:
+        for name in self.__get_columns():
+            block = int(BLOCK_SIZE / np.dtype(COLUMNS[name]).itemsize)
+            write_index = 0
+            for index in range(0, self.examples, block):
+                mask = keep[index:index + block]
+                if write_index == index and mask.all():
+                    write_index += len(mask)
+                    continue
+                values = self.__read_column_range([name], index, len(mask))
+                values[name] = values[name][mask]
+                self.__write_column_range(values, write_index)
+                write_index += len(values[name])
+
+    def shuffle(self, seed=None, memory: int = SHUFFLE_MEMORY,
+                progress: bool = False) -> None:
         """
         Shuffles in place the dataset.
+        If the dataset is bigger than the given memory budget, every example
+        is scattered into a random temporary bucket, placed in the same folder
+        of the dataset, then each bucket is shuffled in memory and written
+        back. Apart from the buckets creation, every I/O is sequential.
+        At most SHUFFLE_BUCKETS buckets are open at once: with bigger datasets
+        the buckets exceeding the budget are split again in the same way.
+        The values of the columns travel with their examples, and are
+        accounted in the memory budget.
         :param seed: Seed that will be used for the RNG
+        :param memory: Maximum amount of bytes of the dataset (including its
+        columns) that will be loaded in memory at once
+        :param progress: True if a progress bar reporting the throughput
+        should be shown
         """
-        random.seed(seed)
-        for j_index in range(self.examples)[::-1]:
-            k_index = int(random.random() * j_index)
-            if j_index != k_index:
-                offset_j = HEADER_SIZE + (self.features + 1) * j_index
-                self.file.seek(offset_j, os.SEEK_SET)
-                j = self.file.read(self.features + 1)
-                offset_k = HEADER_SIZE + (self.features + 1) * k_index
-                self.file.seek(offset_k, os.SEEK_SET)
-                k = self.file.read(self.features + 1)
-                self.file.seek(offset_k, os.SEEK_SET)
-                self.file.write(j)
-                self.file.seek(offset_j, os.SEEK_SET)
-                self.file.write(k)
-
-    def balance(self) -> None:
-        """
-        Balances the dataset. This method will use less memory and be more
-        efficient when the dataset is randomized.
-        """
-        cats = []
-        # use counting sort to record how many examples for each class
-        self.file.seek(HEADER_SIZE, os.SEEK_SET)
-        for i in range(self.examples):
-            data = self.file.read(self.features + 1)
-            cat = data[0]
-            while len(cats) <= cat:
-                cats.append(0)
-            cats[cat] += 1
-        if len(cats) == 0 or len(cats) == 1:
-            return  # no point in balancing when there's nothing
-        minval = min(cats)
-        cats = [x - minval for x in cats]
-        stored = []
-        # now: remove examples from the end and store them in memory until
-        # balance is reached, throwing away the unbalanced ones. Then write
-        # back the one in memory.
-        # this is n^2 under the assumption that categories are small
-        self.file.seek(0, os.SEEK_END)
-        while sum(cats) != 0:
-            self.file.seek(-self.features - 1, os.SEEK_CUR)
-            data = self.file.read(self.features + 1)
-            self.file.seek(-self.features - 1, os.SEEK_CUR)
-            if cats[data[0]] == 0:
-                # need this example for balance
-                stored.append((data[0], data[1:]))
+        # seeds accepted by the random module are more than the numpy ones
+        rng = np.random.default_rng(random.Random(seed).getrandbits(64))
+        record_size = self.label_size + self.features
+        names = self.__get_columns()
+        # the values of the columns are stored after each example
+        tracked = record_size + sum(np.dtype(COLUMNS[name]).itemsize
+                                    for name in names)
+        total = self.examples * tracked
+        bar = tqdm(total=total * 2, unit="B", unit_scale=True, ncols=60,
+                   disable=not progress)
+        # permuting a block of examples requires twice its size
+        if total * 2 <= memory:
+            records = self.__read_tracked(names, 0, self.examples)
+            bar.update(total)
+            records = records[rng.permutation(self.examples)]
+            self.__write_tracked(names, 0, records)
+            bar.update(total)
+        else:
+            folder = os.path.dirname(os.path.abspath(self.path))
+            block = max(1, int(BLOCK_SIZE / tracked))
+            blocks = (self.__read_tracked(names, index,
+                                          min(block, self.examples - index))
+                      for index in range(0, self.examples, block))
+            with tempfile.TemporaryDirectory(dir=folder) as tmpdir:
+                self.__shuffle_buckets(names, blocks, total, tracked, rng,
+                                       memory, tmpdir, 0, bar)
+        bar.close()
+
+    # scatters the blocks returned by __read_tracked into random temporary
+    # buckets, then writes the buckets shuffled starting from index. Returns
+    # the index after the last written example.
+    # At most SHUFFLE_BUCKETS files are open at once: if more buckets are
+    # needed, the ones bigger than the memory budget are shuffled again in the
+    # same way, each with its own buckets
+    def __shuffle_buckets(self, names: List[str], blocks: Iterable[np.ndarray],
+                          size: int, tracked: int, rng: np.random.Generator,
+                          memory: int, tmpdir: str, index: int,
+                          bar: tqdm) -> int:
+        # expected bucket size is a quarter of the budget, so there is some
+        # margin in case a bucket is bigger than the others
+        needed = int(math.ceil(size * 4 / memory))
+        buckets_no = min(needed, SHUFFLE_BUCKETS)
+        folder = tempfile.mkdtemp(dir=tmpdir)
+        paths = [os.path.join(folder, f"{i}.bin") for i in range(buckets_no)]
+        buckets = [open(path, "wb") for path in paths]
+        for records in blocks:
+            amount = records.shape[0]
+            keys = rng.integers(0, buckets_no, size=amount)
+            order = np.argsort(keys, kind="stable")
+            bounds = np.searchsorted(keys[order], np.arange(buckets_no + 1))
+            for bucket_id, bucket in enumerate(buckets):
+                start = bounds[bucket_id]
+                end = bounds[bucket_id + 1]
+                if start != end:
+                    bucket.write(records[order[start:end]].tobytes())
+            bar.update(amount * tracked)
+        for bucket in buckets:
+            bucket.close()
+        for path in paths:
+            bucket_size = os.path.getsize(path)
+            if needed > buckets_no and bucket_size * 2 > memory:
+                # this bucket is scattered once more
+                bar.total += bucket_size
+                bar.refresh()
+                index = self.__shuffle_buckets(names, read_blocks(path,
+                                                                  tracked),
+                                               bucket_size, tracked, rng,
+                                               memory, folder, index, bar)
             else:
-                cats[data[0]] -= 1  # throw example away
-            self.examples -= 1
-        self.write(stored)
+                with open(path, "rb") as fp:
+                    data = fp.read()
+                records = np.frombuffer(data, dtype=np.uint8)
+                records = records.reshape(-1, tracked)
+                amount = records.shape[0]
+                records = records[rng.permutation(amount)]
+                self.__write_tracked(names, index, records)
+                index += amount
+                bar.update(amount * tracked)
+            os.remove(path)
+        os.rmdir(folder)
+        return index
+
+    # reads some examples followed by the values of the given columns, as a
+    # matrix of uint8 with a row for each example
+    def __read_tracked(self, names: List[str], index: int,
+                       amount: int) -> np.ndarray:
+        records = self.__read_records(index, amount)
+        if len(names) == 0:
+            return records
+        values = self.__read_column_range(names, index, amount)
+        parts = [values[name].view(np.uint8).reshape(amount, -1)
+                 for name in names]
+        return np.hstack([records] + parts)
+
+    # writes a matrix returned by __read_tracked starting from index
+    def __write_tracked(self, names: List[str], index: int,
+                        records: np.ndarray) -> None:
+        record_size = self.label_size + self.features
+        self.__write_records(index, records[:, :record_size])
+        start = record_size
+        values = {}
+        for name in names:
+            dtype = np.dtype(COLUMNS[name])
+            end = start + dtype.itemsize
+            column = np.ascontiguousarray(records[:, start:end])
+            values[name] = column.view(dtype).reshape(-1)
+            start = end
+        self.__write_column_range(values, index)
+
+    # reads some examples as a matrix (amount, label_size+features) of uint8
+    def __read_records(self, index: int, amount: int) -> np.ndarray:
+        record_size = self.label_size + self.features
+        data = self.__pread(record_size * amount,
+                            self.header_size + record_size * index)
+        return np.frombuffer(data, dtype=np.uint8).reshape(-1, record_size)
+
+    # returns the labels of a matrix of examples read with __read_records
+    def __get_labels(self, records: np.ndarray) -> np.ndarray:
+        labels = np.ascontiguousarray(records[:, :self.label_size])
+        return labels.view("<u" + str(self.label_size)).reshape(-1)
+
+    # overwrites some examples starting from index with the given matrix
+    def __write_records(self, index: int, records: np.ndarray) -> None:
+        record_size = self.label_size + self.features
+        self.file.seek(self.header_size + record_size * index, os.SEEK_SET)
+        self.file.write(records.tobytes())
+        self.file.flush()  # reads do not go through the file buffer
+
+    def balance(self, quotas: Optional[List[int]] = None) -> None:
+        """
+        Balances the dataset, keeping only the first examples of each
+        category. This is done in place with a single sequential pass and
+        constant memory, and the order of the kept examples does not change.
+        :param quotas: Maximum number of examples kept for each category,
+        indexed by category id. Categories not in this list are not limited.
+        If None, every category is limited to the number of examples of the
+        least represented one.
+        """
+        cats = self.get_category_counts()
+        if quotas is None:
+            if len(cats) == 0 or len(cats) == 1:
+                return  # no point in balancing when there's nothing
+            quotas = [min(cats)] * len(cats)
+        counts = self.__get_counts()
+        limits = np.array(quotas[:len(counts)], dtype=np.int64)
+        kept = counts.copy()
+        kept[:len(limits)] = np.minimum(counts[:len(limits)], limits)
+        remaining = kept.copy()
+        keep = np.zeros(self.examples, dtype=bool)
+        block = max(1, int(BLOCK_SIZE / (self.label_size + self.features)))
+        write_index = 0
+        for index in range(0, self.examples, block):
+            if remaining.sum() == 0:
+                break  # everything after this point will be discarded
+            amount = min(block, self.examples - index)
+            records = self.__read_records(index, amount)
+            mask = np.zeros(amount, dtype=bool)
+            labels = self.__get_labels(records)
+            for cat in np.unique(labels):
+                positions = np.flatnonzero(labels == cat)
+                positions = positions[:remaining[cat]]
+                mask[positions] = True
+                remaining[cat] -= len(positions)
+            if write_index != index or not mask.all():
+                self.__write_records(write_index, records[mask])
+            write_index += int(np.count_nonzero(mask))
+            keep[index:index + amount] = mask
+        self.__filter_columns(keep)
+        self.__resize(write_index)
+        self.counts = kept
 
     def truncate(self, left=0) -> None:
         """
         Remove all examples from file
         """
-        feature_size = self.features + 1
-        self.file.truncate(HEADER_SIZE + feature_size * left)
-        self.file.seek(4, os.SEEK_SET)
+        if left == 0:
+            self.counts = np.zeros(0, dtype=np.int64)
+        elif left < self.examples:
+            self.__update_counts(self.get_array()["label"][left:],
+                                 removed=True)
+        self.__resize(left)
+
+    # changes the number of examples, discarding the ones after `left`,
+    # without updating the categories count
+    def __resize(self, left: int) -> None:
+        record_size = self.label_size + self.features
+        for name in self.__get_columns():
+            itemsize = np.dtype(COLUMNS[name]).itemsize
+            os.truncate(self.path + "." + name, itemsize * left)
+        self.view = None
+        self.file.truncate(self.header_size + record_size * left)
         self.examples = left
-        self.file.write(self.examples.to_bytes(4, byteorder="little"))
+        self.__write_examples_no()
 
     def merge(self, other) -> None:
         """
@@ -302,16 +896,18 @@ class BinaryDs:
                           "features")
         examples_no = other.examples
         if examples_no > 0:
-            features_size = self.features + 1
+            features_size = self.label_size + self.features
             amount = int(BLOCK_SIZE / features_size)
-            iterations = int(examples_no / amount)
-            for i in range(iterations):
-                read = other.read(i * amount, amount)
-                self.write(read)
-            remainder = examples_no % amount
-            if remainder > 0:
-                read = other.read(iterations, remainder)
-                self.write(read)
+            names = other.__get_columns()
+            if "file" in names:
+                mapping = self.__map_files(other)
+            for index in range(0, examples_no, amount):
+                end = min(index + amount, examples_no)
+                read = other.read_array(index, end - index)
+                values = other.__read_column_range(names, index, end - index)
+                if "file" in values:
+                    values["file"] = mapping[values["file"]]
+                self.write_array(*read, columns=values)
             # remove from other file and update elements amount
             other.truncate()
 
@@ -329,77 +925,260 @@ class BinaryDs:
 
         examples_no = int(self.examples * ratio)
         if examples_no > 0:
-            features_size = self.features + 1
+            features_size = self.label_size + self.features
             amount = int(BLOCK_SIZE / features_size)
-            iterations = int(examples_no / amount)
-            for _ in range(iterations):
-                read = self.read(self.examples - amount, amount)
-                other.write(read)
-                self.truncate(self.examples - amount)
-
-            remainder = examples_no % amount
-            if remainder > 0:
-                read = self.read(self.examples - remainder, remainder)
-                other.write(read)
-                self.truncate(self.examples - remainder)
-
-    def deduplicate(self) -> None:
-        """
-        Removes all duplicates from the current binary.
-        The order of data may change.
-        """
-        feature_size = self.features + 1
-        chunk_size = BLOCK_SIZE + feature_size  # around 4 MiB ;)
-        chunk_size = int(chunk_size - (chunk_size % feature_size))
-        chunk_elements = int(chunk_size / feature_size)
-        chunks_no = int(self.examples / chunk_elements)
-        hashes = set()
-        toremove = set()
-        chunk_index = 0
-        for _ in range(chunks_no):
-            self.__calculate_hashes_from_chunk(chunk_elements, chunk_index,
-                                               hashes, toremove)
-            chunk_index += 1
-        remainder = self.examples % chunk_elements
-        if remainder > 0:
-            self.__calculate_hashes_from_chunk(remainder, chunk_index,
-                                               hashes, toremove)
-        del hashes
-        # iterate every element from beginning to end
-        for i in range(self.examples-1):
-            # deal with updating of the self.examples variable
-            if i >= self.examples:
-                break
-            # if I have to remove current element
-            if i in toremove:
-                # pick an element from end, candidate for elimination
-                j = self.examples - 1
-                while j > i and j in toremove:
-                    self.examples -= 1
-                    j = self.examples - 1
-                # there is an actual replacement
-                if j != i:
-                    self.file.seek(HEADER_SIZE + feature_size * j, os.SEEK_SET)
-                    data = self.file.read(feature_size)
-                    self.file.seek(HEADER_SIZE + feature_size * i, os.SEEK_SET)
-                    self.file.write(data)
-                    self.examples = j
-                # there is no replacement, simply delete last entry
-                else:
-                    self.examples = i
-        # update examples
-        self.file.seek(4, os.SEEK_SET)
-        self.file.write(self.examples.to_bytes(4, byteorder="little"))
+            names = self.__get_columns()
+            if "file" in names:
+                mapping = other.__map_files(self)
+            left = self.examples - examples_no
+            while self.examples > left:
+                index = max(left, self.examples - amount)
+                read = self.read_array(index, self.examples - index)
+                values = self.__read_column_range(names, index,
+                                                  self.examples - index)
+                if "file" in values:
+                    values["file"] = mapping[values["file"]]
+                other.write_array(*read, columns=values)
+                self.truncate(index)
+
+    def deduplicate(self, hash_bytes: int = 8,
+                    jobs: Optional[int] = None) -> None:
+        """
+        Removes all duplicates from the current binary, keeping only the first
+        occurrence of each example. The order of data does not change.
+        Each example is represented by a fixed-width hash, and duplicates are
+        found by sorting these hashes in a numpy array. The memory required is
+        about 26 bytes for each example with 64 bits hashes (so 7.8 GB for 300
+        millions of examples) and 42 bytes with 128 bits hashes. The dataset
+        and its columns are then compacted in a single sequential pass, one
+        block at a time, so they do not add to this amount.
+        64 bits hashes are stored in the `hash` column, so only examples added
+        after the previous deduplication need to be hashed.
+        :param hash_bytes: size of each hash, either 8 or 16 bytes.
+        :param jobs: number of processes used to calculate the hashes.
+        Defaults to the number of CPUs in the system.
+        """
+        if hash_bytes == 8:
+            hashes = self.get_hashes(jobs).reshape(-1, 1)
+        else:
+            hashes = self.__calculate_hashes(hash_bytes, jobs,
+                                             [(0, self.examples)])
+        self.__compact(first_occurrences(hashes))
         self.__write_max_cats()
 
-    def __calculate_hashes_from_chunk(self, chunk_elements, chunk_index,
-                                      hashes, toremove):
-        # internal method used in the deduplicate function
-        data = self.read(chunk_index * chunk_elements, chunk_elements)
-        for count, elem in enumerate(data):
-            index = chunk_index * chunk_elements + count
-            cur_hash = hashlib.sha1(elem[1]).digest()
-            if cur_hash in hashes:
-                toremove.add(index)
+    def filter(self, keep: np.ndarray) -> None:
+        """
+        Removes the examples marked as False in a mask, in a single sequential
+        pass. The order of the remaining examples does not change.
+        Raises ValueError if the mask has a different length than the number
+        of examples.
+        :param keep: A boolean array with an element for each example, True if
+        the example should be kept
+        """
+        keep = np.asarray(keep, dtype=bool)
+        if keep.shape != (self.examples,):
+            raise ValueError("The mask has a different number of examples")
+        self.__compact(keep)
+        self.__write_max_cats()
+
+    def get_hashes(self, jobs: Optional[int] = None) -> np.ndarray:
+        """
+        Returns the 64 bits hash of the data of every example, the same used
+        by deduplicate and by hash_data.
+        Hashes are stored in the `hash` column: only examples without a
+        stored hash are hashed, and the column is updated if the dataset is
+        not read only.
+        :param jobs: number of processes used to calculate the hashes.
+        Defaults to the number of CPUs in the system.
+        :return: An array of uint64 with the hash of each example
+        """
+        hashes = self.get_column("hash")
+        if hashes is None:
+            hashes = np.zeros(self.examples, dtype=np.uint64)
+        # zero is used for examples written without a hash
+        missing = np.concatenate(([False], hashes == 0, [False]))
+        changes = np.flatnonzero(missing[1:] != missing[:-1])
+        if len(changes) > 0:
+            starts = changes[::2]
+            ends = changes[1::2]
+            ranges = list(zip(starts.tolist(), (ends - starts).tolist()))
+            computed = self.__calculate_hashes(8, jobs, ranges).reshape(-1)
+            hashes[np.flatnonzero(missing[1:-1])] = computed
+            if not self.ro:
+                self.set_column("hash", hashes)
+        return hashes
+
+    # calculates the hash of the examples in some ranges (index, amount), as
+    # a (examples, hash_bytes/8) matrix of uint64 in the order of the ranges.
+    # Every range is hashed in a single pass, with blocks of examples hashed
+    # in parallel when there are at least PARALLEL_HASH_SIZE bytes
+    def __calculate_hashes(self, hash_bytes: int, jobs: Optional[int],
+                           ranges: List[Tuple[int, int]]) -> np.ndarray:
+        if hash_bytes != 8 and hash_bytes != 16:
+            raise ValueError("Hashes must be 8 or 16 bytes long")
+        if jobs is None:
+            jobs = os.cpu_count()
+        total = sum(amount for _, amount in ranges)
+        record_size = self.label_size + self.features
+        block = max(1, int(BLOCK_SIZE / record_size))
+        indices = []
+        amounts = []
+        for index, amount in ranges:
+            end = index + amount
+            indices.extend(range(index, end, block))
+            amounts.extend(min(block, end - start)
+                           for start in range(index, end, block))
+        # workers read the file by themselves, so everything must be on disk
+        self.file.flush()
+        args = [[self.path] * len(indices), [self.features] * len(indices),
+                indices, amounts, [hash_bytes] * len(indices),
+                [self.header_size] * len(indices),
+                [self.label_size] * len(indices)]
+        # starting the processes costs more than hashing few examples
+        if jobs == 1 or len(indices) <= 1 or \
+                total * record_size < PARALLEL_HASH_SIZE:
+            digests = map(hash_examples, *args)
+            hashes = b"".join(digests)
+        else:
+            # many short ranges are sent to the workers in groups
+            chunksize = max(1, len(indices) // (jobs * 4))
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                digests = executor.map(hash_examples, *args,
+                                       chunksize=chunksize)
+                hashes = b"".join(digests)
+        hashes = np.frombuffer(hashes, dtype=np.uint64)
+        return hashes.reshape(total, hash_bytes // 8)
+
+    # removes every example marked as False in the keep mask, in a single
+    # sequential pass. The order of the remaining examples does not change
+    def __compact(self, keep: np.ndarray) -> None:
+        self.__filter_columns(keep)
+        block = max(1, int(BLOCK_SIZE / (self.label_size + self.features)))
+        write_index = 0
+        for index in range(0, self.examples, block):
+            amount = min(block, self.examples - index)
+            mask = keep[index:index + amount]
+            if write_index == index and mask.all():
+                # nothing removed yet, no need to move this block
+                write_index += amount
             else:
-                hashes.add(cur_hash)
+                records = self.__read_records(index, amount)
+                labels = self.__get_labels(records[~mask])
+                self.__update_counts(labels, removed=True)
+                records = records[mask]
+                self.__write_records(write_index, records)
+                write_index += records.shape[0]
+        self.__resize(write_index)
+
+
+def read_at(file: BinaryIO, size: int, offset: int,
+            lock: Optional[threading.Lock] = None) -> bytes:
+    """
+    Reads some bytes at the given position of a file, without using the
+    offset of the file, so several threads can read the same file
+    concurrently. Where os.pread is not available, the file is read with seek
+    and read while holding the given lock.
+    :param file: the opened file
+    :param size: number of bytes to read
+    :param offset: position of the first byte to read
+    :param lock: lock shared by every thread reading the file, used only if
+    os.pread is not available
+    :return: The bytes read, less than size only if the end of the file was
+    reached
+    """
+    if hasattr(os, "pread"):
+        parts = []
+        while size > 0:
+            data = os.pread(file.fileno(), size, offset)
+            if len(data) == 0:
+                break
+            parts.append(data)
+            size -= len(data)
+            offset += len(data)
+        return b"".join(parts)
+    elif lock is not None:
+        with lock:
+            file.seek(offset, os.SEEK_SET)
+            return file.read(size)
+    else:
+        file.seek(offset, os.SEEK_SET)
+        return file.read(size)
+
+
+def read_blocks(path: str, record_size: int) -> Iterator[np.ndarray]:
+    """
+    Reads a file of fixed size records one block at a time.
+    :param path: path to the file
+    :param record_size: size of each record, in bytes
+    :return: An iterator of matrices of uint8, with a row for each record
+    """
+    block = max(1, int(BLOCK_SIZE / record_size)) * record_size
+    with open(path, "rb") as fp:
+        while True:
+            data = fp.read(block)
+            if len(data) == 0:
+                break
+            records = np.frombuffer(data, dtype=np.uint8)
+            yield records.reshape(-1, record_size)
+
+
+def hash_examples(path: str, features: int, index: int, amount: int,
+                  hash_bytes: int, header_size: int = HEADER_SIZE_V2,
+                  label_size: int = 2) -> bytes:
+    """
+    Calculates the hash of the data of some examples of a binary dataset.
+    The file is read with positional reads, so several processes or threads
+    can hash different parts of the same dataset concurrently.
+    :param path: path to the binary dataset
+    :param features: number of features of each example
+    :param index: The starting index of the examples to hash (0-based)
+    :param amount: The number of examples that will be hashed
+    :param hash_bytes: size of each hash, in bytes
+    :param header_size: size of the header of the dataset
+    :param label_size: size of the label of each example
+    :return: The concatenation of the hashes of every example
+    """
+    record_size = label_size + features
+    with open(path, "rb") as fp:
+        data = read_at(fp, record_size * amount,
+                       header_size + record_size * index)
+    data = memoryview(data)
+    return b"".join(hashlib.blake2b(data[offset + label_size:
+                                         offset + record_size],
+                                    digest_size=hash_bytes).digest()
+                    for offset in range(0, len(data), record_size))
+
+
+def hash_data(data: np.ndarray) -> np.ndarray:
+    """
+    Calculates the 64 bits hash of some examples not yet written in a dataset,
+    the same returned by BinaryDs.get_hashes.
+    :param data: A 2D array of uint8, each row being an example
+    :return: An array of uint64 with the hash of each row
+    """
+    data = np.ascontiguousarray(data, dtype=np.uint8)
+    digests = b"".join(hashlib.blake2b(row, digest_size=8).digest()
+                       for row in data)
+    return np.frombuffer(digests, dtype=np.uint64).copy()
+
+
+def first_occurrences(hashes: np.ndarray) -> np.ndarray:
+    """
+    Finds the first occurrence of every value in a list of hashes.
+    :param hashes: A (n, k) matrix of uint64, where each row is a hash of k*64
+    bits
+    :return: A boolean array of length n, True for the first occurrence of
+    each hash and False for the subsequent ones
+    """
+    keep = np.ones(hashes.shape[0], dtype=bool)
+    if hashes.shape[0] > 1:
+        # both sorts are stable, so the first occurrence is the first one
+        if hashes.shape[1] == 1:
+            order = np.argsort(hashes[:, 0], kind="stable")
+        else:
+            order = np.lexsort(hashes.T[::-1])
+        ordered = hashes[order]
+        duplicated = np.all(ordered[1:] == ordered[:-1], axis=1)
+        del ordered
+        keep[order[1:][duplicated]] = False
+    return keep
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import shutil
+from typing import List, Tuple
+
+HASH_BLOCK = 1048576
+
+
+class ExtractionCache:
+    """
+    Directory containing the result of previous extractions, addressed by
+    the content of the extracted binary. Identical binaries found in
+    different paths (e.g. the same library shipped by several
+    distributions) are extracted only once.
+    Entries are stored in subfolders named after the first two characters of
+    their key. Entries are hard linked into the output folder when possible,
+    and copied otherwise, so extracted files must be removed instead of
+    overwritten (see extractor.remove_output). The modification time of an
+    entry is updated each time it is used, so the least recently used entries
+    can be removed when the cache exceeds its maximum size.
+    """
+
+    def __init__(self, directory: str, max_size: int = 0) -> None:
+        """
+        Constructor
+
+        :param directory: folder containing the cache, created if not
+        existing
+        :param max_size: maximum size of the cache in bytes, 0 for unlimited
+        """
+        self.directory: str = directory
+        self.max_size: int = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, file: str, mode: str) -> str:
+        """
+        Returns the key of the extraction of a file.
+        :param file: path to the binary that will be extracted
+        :param mode: string identifying the type of extraction and the version
+        of the extractor, so results are not reused when they change
+        :return: An hexadecimal string with the hash of content and mode
+        """
+        hasher = hashlib.blake2b(digest_size=20)
+        hasher.update(mode.encode("utf-8") + b"\x00")
+        with open(file, "rb") as fp:
+            for block in iter(lambda: fp.read(HASH_BLOCK), b""):
+                hasher.update(block)
+        return hasher.hexdigest()
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def fetch(self, key: str, out_file: str) -> bool:
+        """
+        Puts the cached result with the given key in out_file, if existing.
+        :param key: key of the extraction, as returned by key()
+        :param out_file: path where the result will be written
+        :return: True if the result was found in the cache
+        """
+        path = self.__path(key)
+        if not os.path.exists(path):
+            return False
+        if os.path.exists(out_file):
+            os.remove(out_file)
+        try:
+            os.link(path, out_file)
+        except OSError:  # different filesystem or links not supported
+            shutil.copyfile(path, out_file)
+        try:
+            os.utime(path)
+        except OSError:  # removed in the meantime by another process
+            pass
+        return True
+
+    def store(self, key: str, out_file: str) -> None:
+        """
+        Adds the result of an extraction to the cache.
+        :param key: key of the extraction, as returned by key()
+        :param out_file: path of the extracted result
+        """
+        path = self.__path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + "." + str(os.getpid()) + ".tmp"
+        try:
+            os.link(out_file, tmp_path)
+        except OSError:
+            shutil.copyfile(out_file, tmp_path)
+        os.replace(tmp_path, path)
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """
+        Returns every entry of the cache, as tuples (last use time, size,
+        path), ordered from the least recently used.
+        """
+        found = []
+        for folder in os.listdir(self.directory):
+            folder = os.path.join(self.directory, folder)
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(folder, name)
+                stat = os.stat(path)
+                found.append((stat.st_mtime, stat.st_size, path))
+        return sorted(found)
+
+    def evict(self) -> int:
+        """
+        Removes the least recently used entries until the size of the cache is
+        lower than its maximum size.
+        :return: The number of removed entries
+        """
+        if self.max_size <= 0:
+            return 0
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,414 @@
+import bz2
+import lzma
+import os
+import threading
+import zlib
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .binaryds import BinaryDs, read_at
+
+try:
+    import lz4.frame as lz4
+except ImportError:  # optional dependency
+    lz4 = None
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+HEADER_SIZE = 24
+MAGIC = 0x2A
+BLOCK_EXAMPLES = 1024
+CODECS = {"zlib": 1, "lzma": 2, "bz2": 3, "lz4": 4, "zstd": 5}
+
+
+def compress_block(codec: str, data: bytes) -> bytes:
+    """
+    Compresses a block of data with the given codec.
+    :param codec: one of the names contained in CODECS
+    :param data: the data that will be compressed
+    :return: the compressed data
+    """
+    if codec == "zlib":
+        return zlib.compress(data, 6)
+    elif codec == "lzma":
+        return lzma.compress(data)
+    elif codec == "bz2":
+        return bz2.compress(data)
+    elif codec == "lz4" and lz4 is not None:
+        return lz4.compress(data)
+    elif codec == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor().compress(data)
+    elif codec in CODECS:
+        raise ImportError(f"The {codec} codec requires an additional "
+                          f"package")
+    else:
+        raise ValueError(f"Unknown codec {codec}")
+
+
+def decompress_block(codec: str, data: bytes) -> bytes:
+    """
+    Decompresses a block of data compressed with compress_block.
+    :param codec: one of the names contained in CODECS
+    :param data: the compressed data
+    :return: the original data
+    """
+    if codec == "zlib":
+        return zlib.decompress(data)
+    elif codec == "lzma":
+        return lzma.decompress(data)
+    elif codec == "bz2":
+        return bz2.decompress(data)
+    elif codec == "lz4" and lz4 is not None:
+        return lz4.decompress(data)
+    elif codec == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif codec in CODECS:
+        raise ImportError(f"The {codec} codec requires an additional "
+                          f"package")
+    else:
+        raise ValueError(f"Unknown codec {codec}")
+
+
+class CompressedDs:
+    """
+    Compressed variant of the BinaryDs. The examples are grouped in blocks
+    with a fixed number of examples, and each block is compressed
+    independently. An index with the offset of each block allows random
+    access to the examples by decompressing only the blocks containing them.
+
+    File structure of the binary:
+    1 bytes -> magic
+    1 bit -> 1: data is opcode based, 0: data is raw based (as FLAG_ENCODED
+    of BinaryDs)
+    7 bit -> codec id (see CODECS)
+    2 bytes -> number of features for each example
+    4 bytes -> number of examples in each block
+    8 bytes -> number of examples
+    8 bytes -> offset of the index
+    All the compressed blocks, each one containing examples in the form
+    {label(2 bytes)+data}
+    The index, in the form:
+    8 bytes -> number of blocks (n)
+    8 bytes -> number of categories (c)
+    (n+1)*8 bytes -> offset of each block, plus the end of the last one
+    c*8 bytes -> number of examples for each category
+
+    The index is written when the dataset is closed, so a dataset not closed
+    properly can not be opened again. Examples can be appended, but
+    only reading is efficient when the last block is not full.
+
+    This format is not supported by open_split, so it can not be used for
+    training or evaluation: it is meant to measure, with
+    benchmark_compression.py, how much a dataset can be compressed and the
+    cost in read throughput.
+    """
+
+    def __init__(self, path: str, read_only: bool = False,
+                 features: int = 2048, encoded: bool = True,
+                 codec: str = "zlib",
+                 block_examples: int = BLOCK_EXAMPLES) -> None:
+        """
+        Constructor
+
+        :param path: path to the compressed dataset
+        :param read_only: True if the dataset will be open in read only mode
+        :param features: number of features that will be used for each example
+        :param encoded: true if the contained data will be opcode based, false
+        if it will be a raw dump.
+        :param codec: codec used to compress the blocks, one of the names in
+        CODECS. lz4 and zstd require additional packages.
+        :param block_examples: number of examples in each compressed block
+        """
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec}")
+        self.path: str = path
+        self.ro: bool = read_only
+        self.features: int = features
+        self.encoded: bool = encoded
+        self.codec: str = codec
+        self.block_examples: int = block_examples
+        self.label_size: int = 2  # bytes used for the label of each example
+        self.examples: int = 0
+        self.offsets: List[int] = [HEADER_SIZE]
+        self.counts: np.ndarray = np.zeros(0, dtype=np.int64)
+        self.pending: bytearray = bytearray()  # examples not yet compressed
+        self.cache: Dict[int, np.ndarray] = {}  # last decompressed block
+        self.file: Optional[BinaryIO] = None
+        self.lock: threading.Lock = threading.Lock()  # used if no os.pread
+
+    def open(self):
+        """
+        Opens a compressed dataset for editing. Creates it if not existing iff
+        read_only was set to False in the constructor.
+        :return: The opened dataset
+        """
+        if not os.path.exists(self.path):
+            if self.ro:
+                raise PermissionError("Could not create file (Read only flag)")
+            else:
+                self.file = open(self.path, "wb+")
+                self.__write_header()
+        elif self.ro and os.access(self.path, os.R_OK):
+            self.file = open(self.path, "rb")
+            self.__read_existing()
+        elif not self.ro and os.access(self.path, os.W_OK):
+            self.file = open(self.path, "rb+")
+            self.__read_existing()
+            # the last block and the index will be written again when closing
+            if self.examples % self.block_examples != 0:
+                last = self.__get_block(len(self.offsets) - 2)
+                self.pending = bytearray(last.tobytes())
+                self.offsets.pop()
+            self.cache = {}
+            self.file.truncate(self.offsets[-1])
+        else:
+            raise PermissionError()
+        return self
+
+    def close(self) -> None:
+        """
+        Closes an open dataset, compressing the remaining examples and writing
+        the index.
+        """
+        if self.file:
+            if not self.ro:
+                self.__flush(final=True)
+                self.__write_index()
+            self.file.close()
+            self.file = None
+            self.cache = {}
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __write_header(self) -> None:
+        self.file.seek(0, os.SEEK_SET)
+        self.file.write(MAGIC.to_bytes(1, byteorder="little"))
+        flags = (int(self.encoded) << 7) | CODECS[self.codec]
+        self.file.write(flags.to_bytes(1, byteorder="little"))
+        self.file.write(self.features.to_bytes(2, byteorder="little"))
+        self.file.write(self.block_examples.to_bytes(4, byteorder="little"))
+        self.file.write(self.examples.to_bytes(8, byteorder="little"))
+        self.file.write(self.offsets[-1].to_bytes(8, byteorder="little"))
+
+    def __read_existing(self) -> None:
+        # Reads header and index from the existing dataset file
+        # Checks for consistency with the expected encoding and feature size
+        self.file.seek(0, os.SEEK_SET)
+        header = self.file.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE or header[0] != MAGIC:
+            self.file.close()
+            self.file = None
+            raise IOError(f"File {self.path} was not created by this "
+                          f"application.")
+        encoded = header[1] & 0x80 > 0
+        codec_id = header[1] & 0x7F
+        features = int.from_bytes(header[2:4], byteorder="little")
+        if not self.ro and (encoded != self.encoded or
+                            features != self.features):
+            self.file.close()
+            self.file = None
+            raise IOError("The existing file has a different encoding type "
+                          "or number of features")
+        self.encoded = encoded
+        self.features = features
+        self.codec = [k for k, v in CODECS.items() if v == codec_id][0]
+        self.block_examples = int.from_bytes(header[4:8], byteorder="little")
+        self.examples = int.from_bytes(header[8:16], byteorder="little")
+        index_offset = int.from_bytes(header[16:24], byteorder="little")
+        self.file.seek(index_offset, os.SEEK_SET)
+        sizes = np.frombuffer(self.file.read(16), dtype="<u8")
+        index = np.frombuffer(self.file.read(int(sizes.sum() + 1) * 8),
+                              dtype="<u8")
+        self.offsets = index[:sizes[0] + 1].tolist()
+        self.counts = index[sizes[0] + 1:].astype(np.int64)
+
+    def __write_index(self) -> None:
+        index_offset = self.offsets[-1]
+        self.file.seek(index_offset, os.SEEK_SET)
+        sizes = [len(self.offsets) - 1, len(self.counts)]
+        index = np.concatenate((sizes, self.offsets, self.counts))
+        self.file.write(index.astype("<u8").tobytes())
+        self.file.truncate()
+        self.__write_header()
+
+    # compresses the pending examples, the last block is compressed even if
+    # not full only if final is True
+    def __flush(self, final: bool = False) -> None:
+        block_size = self.block_examples * (self.label_size + self.features)
+        while len(self.pending) >= block_size or \
+                (final and len(self.pending) > 0):
+            compressed = compress_block(self.codec,
+                                        bytes(self.pending[:block_size]))
+            self.file.seek(self.offsets[-1], os.SEEK_SET)
+            self.file.write(compressed)
+            self.file.flush()
+            self.offsets.append(self.offsets[-1] + len(compressed))
+            del self.pending[:block_size]
+
+    # returns a block of examples as a (examples, label_size+features) matrix
+    def __get_block(self, block_id: int) -> np.ndarray:
+        if block_id == len(self.offsets) - 1:
+            data = bytes(self.pending)
+        elif block_id in self.cache:
+            return self.cache[block_id]
+        else:
+            # positional read, so concurrent readers do not share an offset
+            start = self.offsets[block_id]
+            compressed = read_at(self.file, self.offsets[block_id + 1] - start,
+                                 start, self.lock)
+            data = decompress_block(self.codec, compressed)
+        block = np.frombuffer(data, dtype=np.uint8)
+        block = block.reshape(-1, self.label_size + self.features)
+        if block_id != len(self.offsets) - 1:
+            self.cache = {block_id: block}
+        return block
+
+    def is_encoded(self) -> bool:
+        """
+        Returns the type of encoding used on the file.
+        """
+        return self.encoded
+
+    def get_features(self) -> int:
+        """
+        Returns the number of features used in the dataset.
+        """
+        return self.features
+
+    def get_examples_no(self) -> int:
+        """
+        Returns the number of examples contained in the dataset.
+        """
+        return self.examples
+
+    def get_category_counts(self) -> List[int]:
+        """
+        Returns the number of examples for each category contained in the
+        dataset. Categories without examples are reported as 0.
+        """
+        nonzero = np.flatnonzero(self.counts)
+        if len(nonzero) == 0:
+            return []
+        else:
+            return self.counts[:nonzero[-1] + 1].tolist()
+
+    def get_categories(self) -> int:
+        """
+        Returns the number of categories used in the dataset.
+        """
+        return len(self.get_category_counts())
+
+    def write_array(self, labels: np.ndarray, data: np.ndarray) -> None:
+        """
+        Appends a block of examples to the dataset.
+        Throws ValueError if the examples have a different length compared to
+        the one passed in the constructor.
+        :param labels: array with the category id of each example
+        :param data: uint8 matrix with shape (examples, features)
+        """
+        labels = np.asarray(labels)
+        data = np.asarray(data)
+        if data.ndim != 2 or data.shape[1] != self.features or \
+                labels.shape != (data.shape[0],):
+            raise ValueError("The input example has a wrong length")
+        if len(labels) > 0 and (labels.min() < 0 or labels.max() > 0xFFFE):
+            raise ValueError("Category ids must be in range [0, 65534]")
+        records = np.empty((data.shape[0], self.label_size + self.features),
+                           dtype=np.uint8)
+        records[:, :self.label_size] = labels.astype("<u2").view(
+            np.uint8).reshape(-1, self.label_size)
+        records[:, self.label_size:] = data
+        self.pending.extend(records.tobytes())
+        found = np.bincount(labels.astype(np.int64),
+                            minlength=len(self.counts))
+        found[:len(self.counts)] += self.counts
+        self.counts = found.astype(np.int64)
+        self.examples += data.shape[0]
+        self.__flush()
+
+    def write(self, data: List[Tuple[int, bytes]]) -> None:
+        """
+        Writes a list of examples in the file.
+        Throws ValueError if the tuple has a different length compared to the
+        one passed in the constructor.
+        :param data: A tuple (category id, data) that will be written.
+        """
+        for val in data:
+            if len(val[1]) != self.features:
+                raise ValueError("The input example has a wrong length")
+        labels = np.array([val[0] for val in data], dtype=np.int64)
+        matrix = np.frombuffer(b"".join(val[1] for val in data),
+                               dtype=np.uint8)
+        self.write_array(labels, matrix.reshape(-1, self.features))
+
+    def read_array(self, index: int,
+                   amount: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Reads some examples from the dataset as numpy arrays.
+        Raises IndexError if index+amount is higher than the number of
+        available examples.
+        :param index: The starting index of the examples to read (0-based)
+        :param amount: The number of examples that will be read
+        :return: A tuple (labels, data) where labels is a uint16 array with
+        shape (amount,) and data a uint8 matrix with shape (amount, features)
+        """
+        if index + amount > self.examples:
+            raise IndexError
+        parts = []
+        while amount > 0:
+            block_id = index // self.block_examples
+            local = index - block_id * self.block_examples
+            block = self.__get_block(block_id)
+            cur = min(amount, block.shape[0] - local)
+            parts.append(block[local:local + cur])
+            index += cur
+            amount -= cur
+        if len(parts) == 1:
+            records = parts[0]
+        elif len(parts) == 0:
+            records = np.empty((0, self.label_size + self.features),
+                               dtype=np.uint8)
+        else:
+            records = np.concatenate(parts)
+        labels = np.ascontiguousarray(records[:, :self.label_size])
+        return labels.view("<u2").reshape(-1), records[:, self.label_size:]
+
+    def read(self, index: int, amount: int = 1) -> List[Tuple[int, bytes]]:
+        """
+        Reads some examples from the dataset.
+        Raises IndexError if index+amount is higher than the number of
+        available examples.
+        :param index: The starting index of the examples to read (0-based)
+        :param amount: The number of examples that will be read
+        :return: A list of tuples (category id, data), each tuple being an
+        example
+        """
+        labels, data = self.read_array(index, amount)
+        return [(int(label), row.tobytes())
+                for label, row in zip(labels, data)]
+
+
+def compress_dataset(source: BinaryDs, path: str, codec: str = "zlib",
+                     block_examples: int = BLOCK_EXAMPLES) -> None:
+    """
+    Creates a compressed copy of a binary dataset.
+    :param source: the opened binary dataset that will be compressed
+    :param path: path of the compressed dataset that will be created
+    :param codec: codec used to compress the blocks, one of the names in
+    CODECS
+    :param block_examples: number of examples in each compressed block
+    """
+    with CompressedDs(path, features=source.get_features(),
+                      encoded=source.is_encoded(), codec=codec,
+                      block_examples=block_examples) as dest:
+        examples = source.get_examples_no()
+        for index in range(0, examples, block_examples):
+            amount = min(block_examples, examples - index)
+            dest.write_array(*source.read_array(index, amount))
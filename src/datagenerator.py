@@ -1,25 +1,44 @@
-from typing import List, Tuple
+from typing import List, Optional, Union
 
 import numpy as np
 from tensorflow import keras
-from tensorflow.keras.preprocessing import sequence
 
 from src.binaryds import BinaryDs
+from src.datasetview import BinaryDsView
 
 LN100 = 2 * np.log(10)
 
 
 class DataGenerator(keras.utils.Sequence):
 
-    def __init__(self, dataset: BinaryDs, batch_size: int,
+    def __init__(self, dataset: Union[BinaryDs, BinaryDsView],
+                 batch_size: int,
                  predict: bool = False,
-                 fake_pad: bool = False, pad_len: int = 0):
-        self.dataset: BinaryDs = dataset
+                 fake_pad: bool = False, pad_len: int = 0,
+                 random_examples: bool = False):
+        """
+        Constructor
+
+        :param dataset: the dataset (or view) providing the examples
+        :param batch_size: number of examples in each batch
+        :param predict: True if only the data, without labels, should be
+        generated, in the order of the dataset
+        :param fake_pad: True if part of the examples should be randomly
+        removed (only for raw data)
+        :param pad_len: if not 0, amount of features kept in each example
+        :param random_examples: True if each batch should be composed of
+        examples drawn randomly from the whole dataset, with a new
+        permutation every epoch. Otherwise batches contain contiguous
+        examples, and only the order of the batches changes
+        """
+        self.dataset: Union[BinaryDs, BinaryDsView] = dataset
         self.batch_size = batch_size
         self.indices: List[int] = []
         self.fake_pad = fake_pad
         self.pad_len = pad_len
         self.predict = predict
+        self.random_examples = random_examples and not predict
+        self.permutation: Optional[np.ndarray] = None
         self.len = 0
         self.remainder = 0
         self.__init_len()
@@ -44,38 +63,48 @@ class DataGenerator(keras.utils.Sequence):
             amount = self.remainder
         else:
             amount = self.batch_size
-        data = self.dataset.read(real_index * self.batch_size, amount)
-        return self.__generate_sequences(data)
+        start = real_index * self.batch_size
+        if self.random_examples:
+            batch = self.permutation[start:start + amount]
+            labels, data = self.dataset.read_indices(batch)
+        else:
+            labels, data = self.dataset.read_array(start, amount)
+        return self.__generate_sequences(labels, data)
 
     def on_epoch_end(self):
         self.indices = np.arange(self.len)
-        if not self.predict:
+        if self.random_examples:
+            examples = self.dataset.get_examples_no()
+            self.permutation = np.random.permutation(examples)
+        elif not self.predict:
             np.random.shuffle(self.indices)
 
-    def __generate_sequences(self, data: List[Tuple[int, bytes]]):
+    def __generate_sequences(self, y: np.ndarray, x: np.ndarray):
         """
         Generates the pairs (X, y) that will be used during the training.
         More specifically generates y and shuffle X.
         If fake_pad is true, randomly removes data from X. This is useful in case
         the training samples have always the same amount of features, but during
         inference this number may change.
-        :param data: binary dataset containing the samples
+        :param y: array containing the labels of the samples
+        :param x: matrix containing the samples, one for each row
         :return: (X, y) as np.arrays. X shape will be (samples, features),
         y will be (samples) or (samples, categories) depending if binary or
         multiclass classification
         """
         cats = self.dataset.get_categories()
-        y, x = zip(*data)
+        features = self.dataset.get_features()
         if cats > 2:
             y = keras.utils.to_categorical(y, num_classes=cats)
         else:
-            y = [[y] for y in y]
-        # keras does not like bytearrays, so int list then
+            y = y.astype(np.int64).reshape(-1, 1)
+        # this copy is needed anyway: the input is a read-only view of the file
+        x = x.astype(np.int32)
         # cut a portion of example so network learns to deal with padding
         if not self.dataset.is_encoded() and self.fake_pad:
             # amount of removed data randomly decided
             if self.pad_len == 0:
-                limit = self.dataset.features - 32
+                limit = features - 32
                 # 99% values should be between 0 and limit
                 elambda = LN100 / limit
                 beta = 1 / elambda
@@ -83,38 +112,17 @@ class DataGenerator(keras.utils.Sequence):
                 # clamping destroys the distribution, not a big deal
                 cut = np.array(np.floor(np.clip(d, 0, limit)),
                                dtype=np.int32)
-                x = [list(sample)[:-cut[idx]] for idx, sample in enumerate(x)]
+                x = cut_and_pad(x, cut)
             # amount of removed data is a fixed value
-            elif self.dataset.features != self.pad_len:
-                cut = np.full(len(x), self.dataset.features - self.pad_len)
-                x = [list(sample)[:-cut[idx]] for idx, sample in enumerate(x)]
-            else:
-                x = [list(sample) for sample in x]
+            elif features > self.pad_len:
+                cut = np.full(len(x), features - self.pad_len)
+                x = cut_and_pad(x, cut)
         # keep only encoded examples of `pad_len` length
         elif self.dataset.is_encoded() and self.pad_len != 0:
-            new_x = []
-            for sample in x:
-                padded = 0
-                for byte in sample:
-                    if byte != 0x00:
-                        break
-                    else:
-                        padded += 1
-                if self.dataset.get_features() - padded <= self.pad_len:
-                    # shorter than requested, keep intact
-                    new_x.append(sample)
-                else:
-                    # longer than requested, cut it to the requested len
-                    new_x.append(sample[-self.pad_len:])
-            x = [list(sample) for sample in new_x]
-        # keep everything without removing data
-        else:
-            x = [list(sample) for sample in x]
-        x = np.array(x)
-        x = sequence.pad_sequences(x, maxlen=self.dataset.features,
-                                   padding="pre", truncating="pre",
-                                   value=0, dtype="int32")
-        y = np.array(y)
+            # examples are already pre-padded: the ones shorter than pad_len
+            # have only zeroes in this area, the longer ones are cut
+            if features > self.pad_len:
+                x[:, :features - self.pad_len] = 0
         assert len(x) == len(y), \
             "Something went wrong... different X and y len"
         if self.predict:
@@ -125,3 +133,17 @@ class DataGenerator(keras.utils.Sequence):
             x = x[indices]
             y = y[indices]
             return x, y
+
+
+def cut_and_pad(x: np.ndarray, cut: np.ndarray) -> np.ndarray:
+    """
+    Removes the last `cut` values from each row of a matrix and pre-pads the
+    row with zeroes, so the shape of the matrix does not change.
+    :param x: matrix containing the samples, one for each row
+    :param cut: array containing the amount of values removed from each row
+    :return: a new matrix with the same shape of x
+    """
+    columns = np.arange(x.shape[1]) - cut.reshape(-1, 1)
+    padded = np.take_along_axis(x, np.maximum(columns, 0), axis=1)
+    padded[columns < 0] = 0
+    return padded
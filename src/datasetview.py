@@ -0,0 +1,349 @@
+import json
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .binaryds import BinaryDs
+
+DATASET_FILE = "dataset.bin"
+SPLITS_FILE = "splits.json"
+SPLITS = ["train", "validate", "test"]
+
+
+class BinaryDsView:
+    """
+    Read only view of a subset of a BinaryDs, without copying its examples.
+    The subset is either a contiguous range of examples or an array of
+    indices, in any order. A view offers the same read interface of the
+    BinaryDs, so it can be used in place of a dataset during training and
+    evaluation.
+    """
+
+    def __init__(self, base: BinaryDs, start: int = 0,
+                 end: Optional[int] = None,
+                 indices: Optional[np.ndarray] = None,
+                 owned: bool = False,
+                 counts: Optional[List[int]] = None) -> None:
+        """
+        Constructor
+
+        :param base: the opened dataset containing the examples
+        :param start: index of the first example of the view (ignored if
+        indices is given)
+        :param end: index after the last example of the view. Defaults to the
+        end of the base dataset (ignored if indices is given)
+        :param indices: array with the index in the base dataset of each
+        example of the view
+        :param owned: True if the base dataset should be closed when closing
+        the view
+        :param counts: number of examples for each category in the view, if
+        known. Otherwise it is calculated by reading the labels of the view
+        """
+        self.base: BinaryDs = base
+        self.indices: Optional[np.ndarray] = indices
+        if indices is None:
+            if end is None:
+                end = base.get_examples_no()
+            if start < 0 or start > end or end > base.get_examples_no():
+                raise IndexError
+        elif len(indices) > 0 and (indices.min() < 0 or
+                                   indices.max() >= base.get_examples_no()):
+            raise IndexError
+        self.start: int = start
+        self.end: int = end
+        self.owned: bool = owned
+        self.counts: Optional[List[int]] = counts
+
+    def close(self) -> None:
+        """
+        Closes the view, and the base dataset if owned by the view.
+        """
+        if self.owned:
+            self.base.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def is_encoded(self) -> bool:
+        """
+        Returns true if the base dataset is opcode encoded
+        """
+        return self.base.is_encoded()
+
+    def get_categories(self) -> int:
+        """
+        Returns the number of categories of the base dataset. This may be
+        higher than the categories found in the view, but it is the same for
+        every view of the same dataset.
+        """
+        return self.base.get_categories()
+
+    def get_category_counts(self) -> List[int]:
+        """
+        Returns the number of examples for each category in the view, up to
+        the highest category found in the view.
+        """
+        if self.counts is None:
+            if self.indices is None:
+                labels, _ = self.base.read_array(self.start,
+                                                 self.end - self.start)
+            else:
+                labels = self.base.get_array()["label"][self.indices]
+            self.counts = np.bincount(labels).tolist()
+        return self.counts
+
+    def get_features(self) -> int:
+        """
+        Returns the number of features of the base dataset
+        """
+        return self.base.get_features()
+
+    def get_examples_no(self) -> int:
+        """
+        Returns the number of examples contained in the view
+        """
+        if self.indices is None:
+            return self.end - self.start
+        else:
+            return len(self.indices)
+
+    def read_array(self, index: int,
+                   amount: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Reads some examples from the view as numpy arrays.
+        Raises IndexError if index+amount is higher than the number of
+        available examples.
+        :param index: The starting index of the examples to read (0-based)
+        :param amount: The number of examples that will be read
+        :return: A tuple (labels, data), as in BinaryDs.read_array. If the view
+        is based on an array of indices, the result is a copy
+        """
+        if index < 0 or index + amount > self.get_examples_no():
+            raise IndexError
+        if self.indices is None:
+            return self.base.read_array(self.start + index, amount)
+        else:
+            return self.base.read_indices(self.indices[index:index + amount])
+
+    def read_indices(self,
+                     indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Reads the examples at arbitrary positions of the view, coalescing the
+        reads as in BinaryDs.read_indices.
+        Raises IndexError if any index is outside the view.
+        :param indices: array with the index of every example to read
+        :return: A tuple (labels, data) with the examples in the same order
+        of indices
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) > 0 and (indices.min() < 0 or
+                                 indices.max() >= self.get_examples_no()):
+            raise IndexError
+        if self.indices is None:
+            return self.base.read_indices(indices + self.start)
+        else:
+            return self.base.read_indices(self.indices[indices])
+
+    def get_indices(self) -> np.ndarray:
+        """
+        Returns the index in the base dataset of every example of the view
+        """
+        if self.indices is None:
+            return np.arange(self.start, self.end, dtype=np.int64)
+        else:
+            return np.asarray(self.indices, dtype=np.int64)
+
+    def get_hashes(self, jobs: Optional[int] = None) -> np.ndarray:
+        """
+        Returns the 64 bits hash of every example of the view, as in
+        BinaryDs.get_hashes.
+        :param jobs: number of processes used to calculate the missing
+        hashes. Defaults to the number of CPUs in the system.
+        """
+        return self.base.get_hashes(jobs)[self.get_indices()]
+
+    def read(self, index: int, amount: int = 1) -> List[Tuple[int, bytes]]:
+        """
+        Reads some examples from the view.
+        Raises IndexError if index+amount is higher than the number of
+        available examples.
+        :param index: The starting index of the examples to read (0-based)
+        :param amount: The number of examples that will be read
+        :return: A list of tuples (category id, data), each tuple being an
+        example
+        """
+        labels, data = self.read_array(index, amount)
+        return [(int(label), example.tobytes())
+                for label, example in zip(labels, data)]
+
+
+def write_splits(data_dir: str, splits: Dict[str, object],
+                 counts: Optional[Dict[str, List[int]]] = None) -> None:
+    """
+    Writes the definition of the train, validation and test sets of the
+    dataset contained in a directory.
+    :param data_dir: directory containing the dataset.bin file
+    :param splits: dictionary with the name of each split as key, and either
+    a tuple (start, end) with the range of examples or an array of indices as
+    value. Arrays of indices are stored as .npy files in the same directory
+    :param counts: dictionary with the name of each split as key and the
+    number of examples for each category as value, as returned by
+    split_category_counts. Stored in the definition, so the views do not need
+    to read their labels to count them
+    """
+    definition = {"dataset": DATASET_FILE, "splits": {}}
+    for name, split in splits.items():
+        if isinstance(split, tuple):
+            definition["splits"][name] = {"start": int(split[0]),
+                                          "end": int(split[1])}
+        else:
+            indices_file = name + ".npy"
+            np.save(os.path.join(data_dir, indices_file),
+                    np.asarray(split, dtype=np.int64))
+            definition["splits"][name] = {"indices": indices_file}
+        if counts is not None and name in counts:
+            definition["splits"][name]["counts"] = [int(x)
+                                                    for x in counts[name]]
+    tmp_path = os.path.join(data_dir, SPLITS_FILE + ".tmp")
+    with open(tmp_path, "w") as fp:
+        json.dump(definition, fp, indent=2)
+    os.replace(tmp_path, os.path.join(data_dir, SPLITS_FILE))
+
+
+def split_category_counts(labels: np.ndarray,
+                          splits: Dict[str, object]) -> Dict[str, List[int]]:
+    """
+    Counts the examples of each category in the splits of a dataset.
+    :param labels: array with the label of every example of the dataset
+    :param splits: dictionary with the splits, as given to write_splits
+    :return: A dictionary with the name of each split as key and the number
+    of examples for each category as value, up to the highest category found
+    in the split
+    """
+    counts = {}
+    for name, split in splits.items():
+        if isinstance(split, tuple):
+            current = labels[split[0]:split[1]]
+        else:
+            current = labels[np.asarray(split, dtype=np.int64)]
+        counts[name] = np.bincount(current).tolist()
+    return counts
+
+
+def split_exists(data_dir: str, name: str) -> bool:
+    """
+    Returns true if the given split can be opened with open_split.
+    :param data_dir: directory containing the dataset
+    :param name: name of the split, one of "train", "validate" or "test"
+    """
+    splits_path = os.path.join(data_dir, SPLITS_FILE)
+    if os.path.exists(splits_path):
+        with open(splits_path, "r") as fp:
+            return name in json.load(fp)["splits"]
+    return os.path.exists(os.path.join(data_dir, name + ".bin"))
+
+
+def open_split(data_dir: str, name: str) -> BinaryDsView:
+    """
+    Opens in read only mode a split of the dataset contained in a directory.
+    Directories generated by older versions, with a separate .bin file for
+    each split, are also supported.
+    :param data_dir: directory containing the dataset
+    :param name: name of the split, one of "train", "validate" or "test"
+    :return: The opened view. Closing it will close also the underlying
+    dataset
+    """
+    splits_path = os.path.join(data_dir, SPLITS_FILE)
+    if not os.path.exists(splits_path):
+        path = os.path.join(data_dir, name + ".bin")
+        return BinaryDsView(BinaryDs(path, read_only=True).open(), owned=True)
+    with open(splits_path, "r") as fp:
+        definition = json.load(fp)
+    split = definition["splits"][name]
+    path = os.path.join(data_dir, definition["dataset"])
+    base = BinaryDs(path, read_only=True).open()
+    counts = split.get("counts")
+    try:
+        if "indices" in split:
+            indices_path = os.path.join(data_dir, split["indices"])
+            indices = np.load(indices_path, mmap_mode="r")
+            return BinaryDsView(base, indices=indices, owned=True,
+                                counts=counts)
+        else:
+            return BinaryDsView(base, split["start"], split["end"], owned=True,
+                                counts=counts)
+    except IndexError:
+        base.close()
+        raise IOError(f"Split {name} is not consistent with the dataset")
+
+
+def mix_hash(values: np.ndarray, seed: int) -> np.ndarray:
+    """
+    Scrambles an array of 64 bit values with the splitmix64 finalizer, so the
+    same values and seed always give the same result.
+    :param values: array of uint64 values
+    :param seed: 64 bit integer combined with the values
+    :return: an array of uint64 with the scrambled values
+    """
+    with np.errstate(over="ignore"):
+        z = np.asarray(values, dtype=np.uint64) + \
+            np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def stratified_split(labels: np.ndarray, groups: np.ndarray,
+                     ratios: List[float], seed=None) -> List[np.ndarray]:
+    """
+    Assigns every example to a split, so that examples belonging to the same
+    group are always in the same split, and each category is distributed
+    among the splits according to the given ratios.
+    Each group is associated to its most frequent category, then the groups
+    of each category are ordered by a hash of their key and assigned to the
+    splits in this order, until the ratio of each split is reached. Everything
+    is done with a fixed amount of passes over the arrays.
+    :param labels: array with the category id of each example
+    :param groups: array with the group key (uint64) of each example
+    :param ratios: fraction of the examples assigned to each split
+    :param seed: Seed used to decide the order of the groups
+    :return: A list with an array of indices for each split, sorted, so the
+    examples are read in the order of the dataset
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    if len(labels) == 0:
+        return [np.zeros(0, dtype=np.int64) for _ in ratios]
+    keys, inverse = np.unique(np.asarray(groups, dtype=np.uint64),
+                              return_inverse=True)
+    inverse = inverse.reshape(-1)
+    cats = int(labels.max()) + 1
+    # examples of each (group, category) pair present, sorted by group: a
+    # dense groups x categories table could not fit in memory when every
+    # example is its own group
+    pairs, counts = np.unique(inverse * cats + labels, return_counts=True)
+    pair_groups = pairs // cats
+    starts = np.flatnonzero(np.diff(pair_groups, prepend=-1))
+    sizes = np.add.reduceat(counts, starts)
+    # most frequent category of each group, the lowest one on ties
+    first = np.lexsort((-counts, pair_groups))[starts]
+    dominant = pairs[first] % cats
+    # seeds accepted by the random module are more than the numpy ones
+    mixed = mix_hash(keys, random.Random(seed).getrandbits(64))
+    order = np.lexsort((mixed, dominant))
+    ordered_sizes = sizes[order]
+    ordered_cats = dominant[order]
+    totals = np.bincount(ordered_cats, weights=ordered_sizes, minlength=cats)
+    # examples of the same category before each group, plus half the group
+    before = np.cumsum(ordered_sizes) - ordered_sizes
+    before -= (np.cumsum(totals) - totals)[ordered_cats].astype(np.int64)
+    position = (before + ordered_sizes / 2) / totals[ordered_cats]
+    bounds = np.cumsum(ratios)[:-1] / np.sum(ratios)
+    assigned = np.empty(len(keys), dtype=np.int64)
+    assigned[order] = np.searchsorted(bounds, position, side="right")
+    assigned = assigned[inverse]
+    return [np.flatnonzero(assigned == i) for i in range(len(ratios))]
@@ -5,7 +5,7 @@ import numpy as np
 import tensorflow as tf
 from tensorflow.python.keras.models import load_model
 
-from src.binaryds import BinaryDs
+from src.datasetview import open_split, split_exists
 from src.datagenerator import DataGenerator
 
 
@@ -17,8 +17,8 @@ def run_evaluation(data_dir: str, model_path: str, file: str,
     The evaluation will be normally run by evaluating inputs with only 1
     feature, then 2 features, then 3 and so on up to the maximum number of
     features. The increment in features is not linear.
-    :param data_dir: string pointing to the folder containing the test.bin
-    file (generated with the run_preprocess function)
+    :param data_dir: string pointing to the folder containing the test set
+    (generated with the run_preprocess function)
     :param model_path: string pointing to the .h5 keras model of the network.
     If empty will default to data_dir/model.h5
     :param file: string pointing to the file that will contain the evaluation (
@@ -38,26 +38,25 @@ def run_evaluation(data_dir: str, model_path: str, file: str,
     assert os.path.exists(model_path), f"Model {model_path} does not exists!"
     output_dir = os.path.abspath(os.path.join(file, os.pardir))
     assert os.access(output_dir, os.W_OK), "Output folder is not writable"
-    test_bin = os.path.join(data_dir, "test.bin")
-    assert os.path.exists(test_bin), "Test dataset does not exists!"
+    assert split_exists(data_dir, "test"), "Test dataset does not exists!"
     if fixed == 0:
-        evaluate_incremental(bs, file, model_path, test_bin)
+        evaluate_incremental(bs, file, model_path, data_dir)
     else:
-        evaluate_confusion(bs, file, fixed, model_path, test_bin)
+        evaluate_confusion(bs, file, fixed, model_path, data_dir)
 
 
 def evaluate_incremental(bs: int, file: str, model_path: str,
-                         test_bin) -> None:
+                         data_dir: str) -> None:
     """
     Evaluates the accuracy incrementally (first only 1 feature, then 3, then 5)
     :param bs: batch size
     :param file: file where to write the accuracy (.csv)
     :param model_path: string pointing to the .h5 keras model of the network.
     If empty will default to data_dir/model.h5
-    :param test_bin: path to the test dataset that will be used
+    :param data_dir: path to the folder containing the test set
     """
     cut = 1
-    test = BinaryDs(test_bin, read_only=True).open()
+    test = open_split(data_dir, "test")
     model = load_model(model_path)
     features = test.get_features()
     with open(file, "w") as f:
@@ -96,18 +95,16 @@ def get_expected(bs: int, test):
     remainder = total % bs
     result = []
     for batch in range(iterations):
-        data = test.read(batch * bs, bs)
-        y, _ = zip(*data)
-        result.extend(y)
+        y, _ = test.read_array(batch * bs, bs)
+        result.append(y)
     if remainder != 0:
-        data = test.read(iterations * bs, remainder)
-        y, _ = zip(*data)
-        result.extend(y)
-    return np.array(result, dtype=np.int8)
+        y, _ = test.read_array(iterations * bs, remainder)
+        result.append(y)
+    return np.concatenate(result).astype(np.int32)
 
 
 def evaluate_confusion(bs: int, file: str, fixed: int, model_path: str,
-                       test_bin) -> None:
+                       data_dir: str) -> None:
     """
     Evaluates the confusion matrix for a given number of features
     :param bs: batch size
@@ -115,9 +112,9 @@ def evaluate_confusion(bs: int, file: str, fixed: int, model_path: str,
     :param fixed: number of features to be considered
     :param model_path: string pointing to the .h5 keras model of the network.
     If empty will default to data_dir/model.h5
-    :param test_bin: path to the test dataset that will be used
+    :param data_dir: path to the folder containing the test set
     """
-    test = BinaryDs(test_bin, read_only=True).open()
+    test = open_split(data_dir, "test")
     binary = test.get_categories() <= 2
     model = load_model(model_path)
     generator = DataGenerator(test, bs, fake_pad=True, pad_len=fixed,
@@ -125,7 +122,7 @@ def evaluate_confusion(bs: int, file: str, fixed: int, model_path: str,
     expected = get_expected(bs, test)
     predicted = model.predict(generator, verbose=1)
     if binary:
-        predicted = np.round(predicted).flatten().astype(np.int8)
+        predicted = np.round(predicted).flatten().astype(np.int32)
     else:
         predicted = np.argmax(predicted, axis=1)
     matrix = np.array(tf.math.confusion_matrix(expected, predicted))
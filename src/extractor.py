@@ -1,12 +1,35 @@
 import csv
+import json
+import multiprocessing
 import os
-from concurrent.futures import as_completed
-from concurrent.futures.process import ProcessPoolExecutor
-from typing import List
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool, \
+    ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
 
+import numpy as np
 import r2pipe as r2pipe
 from tqdm import tqdm
 
+from .cache import ExtractionCache
+from .functionstore import STORE_EXTENSION, write_function_store
+from .manifest import MANIFEST_FILE, ExtractionManifest
+from .sections import read_text_section
+
+# increase when the extracted data changes, to invalidate cached results
+EXTRACTOR_VERSION = 1
+R2_TIMEOUT = 600  # seconds allowed to analyze a single file
+R2_MAX_FILES = 256  # files analyzed by a session before restarting it
+QUEUE_PER_JOB = 4  # files extracted in advance by each job when streaming
+# analysis levels of the opcode encoded extraction, from the cheapest. With
+# symbols the functions are taken from the symbol table without analysis
+ANALYSIS_LEVELS = ["symbols", "aa", "aaa"]
+DISASM_BATCH = 256  # functions disassembled with a single r2 command
+DISASM_SEPARATOR = "--- end of function ---"
+WATCHDOG_INTERVAL = 5  # seconds between checks for stuck workers
+
 invalid_opcodes_table = [False, False, False, False, False, False, True, True,
                          False, False, False, False, False, False, True, False,
                          False, False, False, False, False, False, True, True,
@@ -44,18 +67,40 @@ invalid_opcodes_table = [False, False, False, False, False, False, True, True,
 
 
 def run_extractor(input_files: List[str], outdir: str, openc: bool,
-                  jobs: int) -> None:
+                  jobs: int, timeout: int = R2_TIMEOUT,
+                  cache_dir: Optional[str] = None,
+                  cache_size: int = 0, csv_output: bool = False,
+                  level: str = "aaa", retry: bool = False) -> None:
     """
     Extracts the data from binary files, either as a list of function
     opcodes or just the raw .text section.
+    The outcome of each file is recorded in a manifest in the output folder
+    (see ExtractionManifest): running again the extraction with the same
+    output folder skips the files already extracted. Files whose extraction
+    takes too long are stopped, replacing the stuck workers, and reported as
+    timed out.
     :param input_files: A list of string, each string representing a path to a
     binary file.
     :param outdir: The directory where the extracted data should be written.
-    The same filename of the input_files will be used, with a .txt appended
-    in case of opcode encoded analysis or .bin otherwise.
+    The same filename of the input_files will be used, with a .fns (or .csv)
+    appended in case of opcode encoded analysis or .bin otherwise.
     :param openc: true if opcode encoded analysis is requested. This particular
     type of analysis uses the output of disassembly instead of plain raw bytes.
     :param jobs: maximum number of jobs that will be spawned concurrently
+    :param timeout: maximum number of seconds spent analyzing a single file in
+    opcode encoded analysis. Files exceeding it are skipped.
+    :param cache_dir: folder where the extracted data is cached, so binaries
+    with the same content are extracted only once. None to disable caching
+    :param cache_size: maximum size of the cache in bytes, the least recently
+    used results are removed when exceeding it. 0 for unlimited
+    :param csv_output: true if the functions extracted by the opcode encoded
+    analysis should be written as .csv files instead of the more compact
+    function store
+    :param level: analysis level used to find the functions in opcode encoded
+    analysis, one of ANALYSIS_LEVELS. If the analysis of a file exceeds the
+    timeout, the cheaper levels are tried
+    :param retry: true if the files that failed or timed out in a previous
+    run with the same output folder should be extracted again
     """
     if os.path.exists(outdir):
         if os.path.isdir(outdir):
@@ -69,21 +114,238 @@ def run_extractor(input_files: List[str], outdir: str, openc: bool,
         raise IOError(f"The folder {outdir} does not exist")
 
     if openc:
-        extension = ".csv"
-        f = extract_function_to_file
+        extension = ".csv" if csv_output else STORE_EXTENSION
+        f = extract_function_pooled
+        mode = f"encoded{extension}-{level}-{EXTRACTOR_VERSION}"
     else:
         extension = ".bin"
         f = extract_dot_text_to_file
+        mode = f"raw-{EXTRACTOR_VERSION}"
+    cache = None
+    if cache_dir is not None:
+        cache = ExtractionCache(cache_dir, cache_size)
+    manifest = ExtractionManifest(os.path.join(outdir, MANIFEST_FILE), mode)
+    todo = [x for x in input_files
+            if not manifest.is_completed(x, failures=not retry)]
+    args = []
+    for file in todo:
+        arg = {'file': file, 'out_file': os.path.join(
+            outdir, os.path.basename(file) + extension)}
+        if openc:
+            arg["timeout"] = timeout
+            arg["level"] = level
+        args.append(arg)
+    # r2 is given a timeout for each level, and the file is retried once
+    limit = timeout * (len(ANALYSIS_LEVELS) + 2)
+
+    progress = tqdm(total=len(args), ncols=60)
+    start_time = time.perf_counter()
+    statuses = {"done": 0, "empty": 0, "failed": 0, "timeout": 0}
+    hits = 0
+    pending = iter(args)
+    running = {}  # future -> (arguments, submission time)
+    # files running when the pool broke: one of them crashed the worker, so
+    # they are extracted again one at a time to find which one
+    suspects = []
+    crashes = {}  # number of times a file broke the pool while running alone
+    isolated = False  # true if a suspect is running
+    workers = multiprocessing.SimpleQueue()  # pids of the started workers
+    executor = __start_pool(jobs, workers)
+    try:
+        while True:
+            if len(running) == 0:
+                isolated = False
+            # each job has at most one file, so it starts when submitted
+            while len(running) < jobs and not isolated:
+                if len(suspects) > 0:
+                    if len(running) > 0:
+                        break
+                    arg = suspects.pop(0)
+                    isolated = True
+                else:
+                    arg = next(pending, None)
+                    if arg is None:
+                        break
+                future = executor.submit(extract_task, f, arg, cache, mode,
+                                         0 if openc else timeout)
+                running[future] = (arg, time.monotonic())
+            if len(running) == 0:
+                break
+            done, _ = wait(running, timeout=WATCHDOG_INTERVAL,
+                           return_when=FIRST_COMPLETED)
+            broken = []
+            for future in done:
+                arg, _ = running.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    broken.append(arg)
+                    continue
+                manifest.record(arg["file"], output=arg["out_file"], **result)
+                statuses[result["status"]] += 1
+                hits += int(result.get("cached", False))
+                progress.update(1)
+            now = time.monotonic()
+            stuck = [future for future, (_, start) in running.items()
+                     if now - start > limit]
+            if len(broken) == 0 and len(stuck) == 0:
+                continue
+            # the pool can not recover: kill it, and restart the other files
+            alone = len(broken) + len(running) == 1
+            for future in stuck:
+                arg, start = running.pop(future)
+                manifest.record(arg["file"], "timeout", arg["out_file"],
+                                time=now - start)
+                statuses["timeout"] += 1
+                progress.update(1)
+            restart = [arg for arg, _ in running.values()]
+            running = {}
+            __kill_pool(executor, workers)
+            executor = __start_pool(jobs, workers)
+            if len(broken) > 0 and alone:
+                # the crash is certainly caused by this file
+                arg = broken[0]
+                crashes[arg["file"]] = crashes.get(arg["file"], 0) + 1
+                if crashes[arg["file"]] >= 2:
+                    manifest.record(arg["file"], "failed", arg["out_file"],
+                                    error="the worker process crashed")
+                    statuses["failed"] += 1
+                    progress.update(1)
+                else:
+                    suspects.insert(0, arg)
+            elif len(broken) > 0:
+                suspects.extend(broken + restart)
+                restart = []
+            for arg in restart:
+                future = executor.submit(extract_task, f, arg, cache, mode,
+                                         0 if openc else timeout)
+                running[future] = (arg, time.monotonic())
+    finally:
+        executor.shutdown(wait=False)
+    progress.close()
+    elapsed = time.perf_counter() - start_time
+    extracted = statuses["done"] + statuses["empty"]
+    print(f"Extracted {extracted} files in {elapsed:.1f}s "
+          f"({len(args) / max(elapsed, 1e-9):.2f} files/s), "
+          f"{statuses['empty']} without data, {statuses['failed']} failed, "
+          f"{statuses['timeout']} timed out, "
+          f"{len(input_files) - len(args)} skipped (already in the "
+          f"manifest)")
+    for record in manifest.failures():
+        error = record.get("error")
+        print(f"{record['status']}: {record['file']}" +
+              (f" ({error})" if error else ""))
+    if cache is not None:
+        evicted = cache.evict()
+        print(f"Cache hits: {hits}, misses: {len(args) - hits}, "
+              f"evicted: {evicted}")
+
 
-    progress = tqdm(total=len(input_files), ncols=60)
-    with ProcessPoolExecutor(max_workers=jobs) as executor:
-        basenames = [(file, os.path.basename(file)) for file in input_files]
-        args = [{'file': name[0],
-                 'out_file': os.path.join(outdir, name[1] + extension)} for
-                name in basenames]
-        fut = {executor.submit(f, **arg) for arg in args}
-        for _ in as_completed(fut, timeout=86400):
-            progress.update(1)
+# creates a pool whose workers send their pid to the given queue
+def __start_pool(jobs: int,
+                 workers: multiprocessing.SimpleQueue) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=jobs, initializer=__register_worker,
+                               initargs=(workers,))
+
+
+def __register_worker(workers: multiprocessing.SimpleQueue) -> None:
+    workers.put(os.getpid())
+
+
+# terminates the processes of a pool created with __start_pool, even if busy
+def __kill_pool(executor: ProcessPoolExecutor,
+                workers: multiprocessing.SimpleQueue) -> None:
+    # there is no public interface to stop running tasks: the workers are
+    # the children of this process that registered their pid. Children
+    # already exited are not listed, so a reused pid is never killed
+    pids = set()
+    while not workers.empty():
+        pids.add(workers.get())
+    for process in multiprocessing.active_children():
+        if process.pid in pids:
+            process.terminate()
+    executor.shutdown(wait=False)
+
+
+def extract_task(function: Callable, arg: dict,
+                 cache: Optional[ExtractionCache], mode: str,
+                 timeout: int = 0) -> dict:
+    """
+    Extracts a file inside a worker of run_extractor, catching any error so
+    the outcome can be recorded in the manifest.
+    :param function: extraction function, like extract_dot_text_to_file
+    :param arg: arguments for the extraction function
+    :param cache: cache containing the previous results, or None
+    :param mode: type of extraction, used as part of the cache key
+    :param timeout: if greater than 0, maximum number of seconds allowed for
+    the extraction. Functions with their own timeout should use 0
+    :return: A dictionary with the `status` of the extraction (as in
+    ExtractionManifest), the `time` spent, the `error` if failed and
+    `cached` if the result was found in the cache
+    """
+    start_time = time.perf_counter()
+    result = {}
+    previous = signal.signal(signal.SIGALRM, __on_timeout)
+    signal.alarm(timeout)
+    try:
+        if cache is not None:
+            result["cached"] = extract_cached(function, cache, mode, **arg)
+        else:
+            function(**arg)
+        if os.path.exists(arg["out_file"]):
+            result["status"] = "done"
+        else:
+            result["status"] = "empty"
+    except TimeoutError:
+        result["status"] = "timeout"
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = repr(e)
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, previous)
+    result["time"] = time.perf_counter() - start_time
+    return result
+
+
+def extract_cached(function: Callable, cache: ExtractionCache, mode: str,
+                   file: str, out_file: str, **kwargs) -> bool:
+    """
+    Extracts a file with the given function, reusing the result of a
+    previous extraction of a file with the same content if found in the
+    cache. The result is not cached if the function returns False, as done
+    by extract_function_pooled when it fell back to a cheaper analysis.
+    :param function: extraction function, like extract_dot_text_to_file
+    :param cache: cache containing the previous results
+    :param mode: type of extraction, used as part of the cache key
+    :param file: path to the input file
+    :param out_file: The file where the result will be saved
+    :param kwargs: additional arguments for the extraction function
+    :return: True if the result was found in the cache
+    """
+    key = cache.key(file, mode)
+    if cache.fetch(key, out_file):
+        return True
+    # a previous result must not be mistaken for the new one
+    remove_output(out_file)
+    if function(file=file, out_file=out_file, **kwargs) is not False and \
+            os.path.exists(out_file):
+        cache.store(key, out_file)
+    return False
+
+
+def remove_output(out_file: str) -> None:
+    """
+    Removes the result of a previous extraction, if existing. Every function
+    writing an extracted file calls this first, instead of overwriting it:
+    the file may be a hard link to an entry of an ExtractionCache, that would
+    be modified as well.
+    :param out_file: The file where the result will be saved
+    """
+    try:
+        os.remove(out_file)
+    except FileNotFoundError:
+        pass
 
 
 def dot_text_name(r2: r2pipe) -> str:
@@ -106,10 +368,17 @@ def dot_text_name(r2: r2pipe) -> str:
 def extract_dot_text_to_file(file: str, out_file: str) -> None:
     """
     Extracts the raw .text section from a binary file and saves it to another
-    file.
+    file. The section is read directly from the file if the format is
+    supported by read_text_section, otherwise r2 is used.
     :param file: path to the input file.
     :param out_file: The file where the dump will be saved.
     """
+    remove_output(out_file)
+    data = read_text_section(file)
+    if data is not None:
+        with open(out_file, "wb") as fp:
+            fp.write(data)
+        return
     r2 = r2pipe.open(file, ["-2"])
     sections = r2.cmdj("iSj")
     expected_name = dot_text_name(r2)
@@ -131,10 +400,14 @@ def extract_dot_text_to_file(file: str, out_file: str) -> None:
 def extract_dot_text(file: str) -> List[bytes]:
     """
     Extracts and returns the raw .text section from a binary file.
+    The section is read directly from the file if the format is supported by
+    read_text_section, otherwise r2 is used.
     :param file: path to the input file.
     :return A bytearray containing the extracted data as a sequence of bytes.
     """
-    data = None
+    data = read_text_section(file)
+    if data is not None:
+        return list(data)
     r2 = r2pipe.open(file, ["-2"])
     sections = r2.cmdj("iSj")
     expected_name = dot_text_name(r2)
@@ -182,44 +455,423 @@ def get_opcode(bytes: bytearray) -> bytearray:
     return bytearray([0xFF, 0xFF])
 
 
-def extract_function_to_file(file: str, out_file: str) -> None:
+def get_opcodes(data: bytes, offsets: np.ndarray) -> bytes:
+    """
+    Extracts the opcode from several statements at once, with the same rules
+    of get_opcode.
+    :param data: the concatenation of the bytes of every statement
+    :param offsets: array with the position in data of the first byte of each
+    statement, in increasing order
+    :return: the concatenation of the opcodes of every statement
+    """
+    values = np.frombuffer(data, dtype=np.uint8)
+    starts = np.asarray(offsets, dtype=np.int64)
+    if len(values) == 0:
+        return b"\xff\xff" * len(starts)
+    ends = np.append(starts[1:], len(values))
+    invalid = np.array(invalid_opcodes_table, dtype=bool)
+    f23 = (values == 0xF2) | (values == 0xF3)
+    # the first byte that is neither a prefix nor 0xF2/0xF3 decides the
+    # opcode. The sentinel at the end is used for statements without it
+    deciding = np.append(np.flatnonzero((values == 0x0F) |
+                                        (~invalid[values] & ~f23)),
+                         len(values))
+    first = deciding[np.searchsorted(deciding, starts)]
+    found = first < ends
+    first = first.clip(max=len(values) - 1)
+    is_0f = found & (values[first] == 0x0F)
+    single = found & ~is_0f
+    # 0x0F is followed by the second byte of the opcode, if any
+    two_bytes = is_0f & (first + 1 < ends)
+    # the last 0xF2/0xF3 before the deciding byte replaces it, if any
+    f23_positions = np.append(-1, np.flatnonzero(f23))
+    previous = f23_positions[np.searchsorted(f23_positions, first) - 1]
+    opcode = np.where(previous >= starts, values[previous], values[first])
+    sizes = np.where(single, 1, 2)
+    positions = np.cumsum(sizes) - sizes
+    result = np.full(int(sizes.sum()), 0xFF, dtype=np.uint8)
+    result[positions[single]] = opcode[single]
+    result[positions[two_bytes]] = 0x0F
+    result[positions[two_bytes] + 1] = values[first[two_bytes] + 1]
+    return result.tobytes()
+
+
+def extract_function_to_file(file: str, out_file: str,
+                             level: str = "aaa") -> None:
     """
-    Opens a file and extract every function opcodes. Saves the result in a .csv
-    The output .csv contains a function for each row with the following fields:
+    Opens a file and extract every function opcodes. Saves the result in a
+    function store (see write_function_store) or, if the name of the output
+    file ends with .csv, in a .csv.
+    The output contains a function for each row with the following fields:
     - virtual address offset (decimal) of the current function in the binary
     - function name
     - function length (in bytes)
     - function bytes
     - function bytes without prefixes or suffixes
+    In the .csv the last two fields are written as hexadecimal strings.
     :param file: The input binary file
-    :param out_file: The output csv containing the extracted data
+    :param out_file: The output file containing the extracted data
+    :param level: analysis level used to find the functions, one of
+    ANALYSIS_LEVELS
     """
     r2 = r2pipe.open(file, ["-2"])
-    r2.cmd("aaa")
+    rows = analyze_functions(r2, level)
+    r2.quit()
+    write_functions(rows, out_file)
+
+
+def analyze_functions(r2: r2pipe, level: str = "aaa") -> List[list]:
+    """
+    Analyzes the file opened in a r2 session and extracts every function
+    opcodes.
+    With the `aa` and `aaa` levels the functions are found by the r2 command
+    with the same name (`aaa` being the slowest and most accurate), and
+    disassembled following their basic blocks. With `symbols` the functions
+    are the ones listed in the symbol table, disassembled linearly.
+    :param r2: Opened r2pipe, with the file to analyze already loaded
+    :param level: analysis level, one of ANALYSIS_LEVELS
+    :return: A list with a row for each function, with the fields described
+    in extract_function_to_file, the last two as bytes
+    """
+    if level not in ANALYSIS_LEVELS:
+        raise ValueError(f"Unknown analysis level {level}")
     imports = r2.cmdj("iij")
-    import_set = {imp["plt"] for imp in imports}
-    functions = r2.cmdj("aflj")
+    import_set = {imp["plt"] for imp in imports} if imports else set()
+    if level == "symbols":
+        functions = {}
+        for symbol in r2.cmdj("isj") or []:
+            if symbol.get("type") == "FUNC" and symbol.get("size", 0) > 0:
+                name = symbol.get("flagname", symbol["name"])
+                functions.setdefault(symbol["vaddr"], {
+                    "offset": symbol["vaddr"], "name": name,
+                    "size": symbol["size"]})
+        functions = list(functions.values())
+    else:
+        r2.cmd(level)
+        functions = r2.cmdj("aflj")
+    if functions is None:  # some files contain 0 functions
+        functions = []
+    functions = [x for x in functions if x["offset"] not in import_set]
     rows = []
-    if functions is not None:  # some files contain 0 functions
-        for function in functions:
-            if function["offset"] not in import_set:
-                r2.cmd(f"s {function['offset']}")
-                func = r2.cmdj("pdrj")
-                opcodes = bytearray()
-                raw_opcodes = []
-                for stmt in func:
-                    if "bytes" in stmt:  # invalid opcodes do not have "bytes"
-                        opcodes_arr = get_opcode(
-                            bytearray.fromhex(stmt["bytes"]))
-                        opcodes.extend(opcodes_arr)
-                        raw_opcodes.append(stmt["bytes"])
-                rows.append(
-                    [function["offset"], function["name"], function["size"],
-                     ''.join(x for x in raw_opcodes),
-                     ''.join(format(x, '02x') for x in opcodes)])
+    for index in range(0, len(functions), DISASM_BATCH):
+        batch = functions[index:index + DISASM_BATCH]
+        if level == "symbols":
+            commands = [f"pDj {x['size']} @ {x['offset']}" for x in batch]
+        else:
+            commands = [f"pdrj @ {x['offset']}" for x in batch]
+        for function, func in zip(batch, disassemble(r2, commands)):
+            # invalid opcodes do not have "bytes"
+            raw_opcodes = [stmt["bytes"] for stmt in func
+                           if "bytes" in stmt]
+            raw = bytes.fromhex(''.join(raw_opcodes))
+            lengths = [len(x) // 2 for x in raw_opcodes]
+            offsets = np.cumsum([0] + lengths[:-1])
+            rows.append(
+                [function["offset"], function["name"], function["size"],
+                 raw, get_opcodes(raw, offsets)])
+    return rows
+
+
+def disassemble(r2: r2pipe, commands: List[str]) -> List[list]:
+    """
+    Runs several r2 commands returning JSON lists with a single round trip.
+    The output of each command is followed by DISASM_SEPARATOR, so commands
+    with no output can be recognized.
+    :param r2: Opened r2pipe
+    :param commands: the commands to run
+    :return: A list with the decoded output of each command, empty if the
+    command had no output
+    """
+    separator = f";?e {DISASM_SEPARATOR};"
+    output = r2.cmd(separator.join(commands) + separator[:-1])
+    parts = output.split(DISASM_SEPARATOR)
+    return [json.loads(part) if part.strip() else []
+            for part in parts[:len(commands)]]
+
+
+def write_functions(rows: List[list], out_file: str) -> None:
+    """
+    Writes the functions extracted by analyze_functions in a function store
+    or, if the name of the output file ends with .csv, in a .csv file.
+    :param rows: The rows returned by analyze_functions
+    :param out_file: The output file containing the extracted data
+    """
+    remove_output(out_file)
+    if os.path.splitext(out_file)[1] != ".csv":
+        write_function_store(rows, out_file)
+        return
     with open(out_file, "w") as fp:
         writer = csv.writer(fp, delimiter=",", quotechar='"',
                             quoting=csv.QUOTE_NONNUMERIC)
         writer.writerow(["offset", "name", "size", "raw", "opcodes"])
-        writer.writerows(rows)
-    return
+        writer.writerows([row[:3] + [row[3].hex(), row[4].hex()]
+                          for row in rows])
+
+
+class R2Session:
+    """
+    Long lived r2 process, reused to analyze several files one after the
+    other. Each file is opened with `o` after closing the previous one with
+    `o--`, so the cost of starting r2 is paid only once.
+    The process is restarted after R2_MAX_FILES files, to limit the memory
+    retained by r2 between analyses.
+    """
+
+    def __init__(self) -> None:
+        """
+        Constructor. The r2 process is started lazily.
+        """
+        self.r2: Optional[r2pipe.open] = None
+        self.analyzed: int = 0  # files analyzed by the current process
+
+    def is_alive(self) -> bool:
+        """
+        Returns true if the r2 process is running and answering commands.
+        """
+        if self.r2 is None or self.r2.process.poll() is not None:
+            return False
+        try:
+            return len(self.r2.cmd("?V").strip()) > 0
+        except Exception:
+            return False
+
+    def kill(self) -> None:
+        """
+        Terminates the r2 process, without waiting for pending commands.
+        """
+        if self.r2 is not None:
+            try:
+                self.r2.process.kill()
+                self.r2.process.wait()
+            except OSError:
+                pass
+            self.r2 = None
+
+    def open(self, file: str) -> r2pipe:
+        """
+        Opens a file in the session, restarting r2 if not healthy.
+        Raises IOError if r2 could not open the file.
+        :param file: path to the file
+        :return: The r2pipe with the file loaded
+        """
+        if self.analyzed >= R2_MAX_FILES or not self.is_alive():
+            self.kill()
+            self.r2 = r2pipe.open("--", ["-2"])
+            self.analyzed = 0
+        self.r2.cmd("o--")
+        escaped = file.replace("\\", "\\\\").replace('"', '\\"')
+        self.r2.cmd(f'o "{escaped}"')
+        info = self.r2.cmdj("ij")
+        if not info or "bin" not in info:
+            raise IOError(f"r2 could not open {file}")
+        self.analyzed += 1
+        return self.r2
+
+
+# session of the current worker process, created on its first file
+__session: Optional[R2Session] = None
+
+
+# raised in the worker when the analysis of a file takes too long
+def __on_timeout(signum, frame):
+    raise TimeoutError
+
+
+def extract_function_pooled(file: str, out_file: str,
+                            timeout: int = R2_TIMEOUT,
+                            level: str = "aaa") -> bool:
+    """
+    Same as extract_function_to_file, but the file is analyzed with the r2
+    session of the current process, which is started only once and reused
+    across calls. The session is restarted if r2 crashes or if the analysis
+    takes more than timeout seconds, and a file whose analysis crashed is
+    retried once with a fresh session. If the analysis takes more than
+    timeout seconds, the file is analyzed again with the cheaper levels.
+    :param file: The input binary file
+    :param out_file: The output csv containing the extracted data
+    :param timeout: maximum number of seconds spent analyzing the file with
+    each level
+    :param level: analysis level used to find the functions, one of
+    ANALYSIS_LEVELS
+    :return: True if the file was analyzed with the requested level, False
+    if a cheaper level was used (so the result is not cached). Errors are
+    raised as in analyze_pooled
+    """
+    rows, used = analyze_pooled(file, timeout, level)
+    write_functions(rows, out_file)
+    return used == level
+
+
+def analyze_pooled(file: str, timeout: int = R2_TIMEOUT,
+                   level: str = "aaa") -> Tuple[List[list], str]:
+    """
+    Analyzes a file with the r2 session of the current process, as described
+    in extract_function_pooled.
+    :param file: The input binary file
+    :param timeout: maximum number of seconds spent analyzing the file with
+    each level
+    :param level: analysis level used to find the functions, one of
+    ANALYSIS_LEVELS
+    :return: A tuple (rows, level) with the rows returned by
+    analyze_functions and the level actually used. Raises TimeoutError if
+    the analysis exceeded the timeout with every level, or the error of the
+    second crash of r2
+    """
+    global __session
+    if __session is None:
+        __session = R2Session()
+    # from the requested level to the cheapest one
+    levels = ANALYSIS_LEVELS[ANALYSIS_LEVELS.index(level)::-1]
+    crashed = False
+    previous = signal.signal(signal.SIGALRM, __on_timeout)
+    try:
+        while True:
+            signal.alarm(timeout)
+            try:
+                return (analyze_functions(__session.open(file), levels[0]),
+                        levels[0])
+            except TimeoutError:
+                __session.kill()
+                levels = levels[1:]
+                if len(levels) == 0:
+                    raise
+            except Exception:
+                __session.kill()
+                if crashed:
+                    raise
+                crashed = True
+            finally:
+                signal.alarm(0)
+    finally:
+        signal.signal(signal.SIGALRM, previous)
+
+
+def extract_elements(file: str, openc: bool, timeout: int = R2_TIMEOUT,
+                     out_file: Optional[str] = None,
+                     level: str = "aaa") -> List[Tuple[bytes, int]]:
+    """
+    Extracts the data of a binary file and returns it without writing it,
+    unless out_file is given.
+    Files that can not be extracted, or whose extraction exceeds the timeout,
+    are reported and skipped.
+    :param file: The input binary file
+    :param openc: true if opcode encoded analysis is requested
+    :param timeout: maximum number of seconds spent analyzing the file
+    :param out_file: if not None, the extracted data is also written to this
+    file, in the same format of run_extractor
+    :param level: analysis level used in opcode encoded analysis, one of
+    ANALYSIS_LEVELS
+    :return: A list of tuples (data, address): the opcodes and the address of
+    each function in opcode encoded analysis, or the .text section and 0
+    otherwise. The list is empty if nothing was extracted
+    """
+    if openc:
+        try:
+            rows, _ = analyze_pooled(file, timeout, level)
+        except Exception as e:  # skipped, as done by run_extractor
+            tqdm.write(f"Skipping {file}: {e!r}")
+            return []
+        if out_file is not None:
+            write_functions(rows, out_file)
+        return [(row[4], int(row[0])) for row in rows]
+    else:
+        previous = signal.signal(signal.SIGALRM, __on_timeout)
+        signal.alarm(timeout)
+        try:
+            data = read_text_section(file)
+            if data is None:
+                extracted = extract_dot_text(file)
+                if extracted is None:
+                    return []
+                data = bytes(extracted)
+        except Exception as e:
+            tqdm.write(f"Skipping {file}: {e!r}")
+            return []
+        finally:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, previous)
+        if out_file is not None:
+            remove_output(out_file)
+            with open(out_file, "wb") as fp:
+                fp.write(data)
+        return [(data, 0)]
+
+
+def stream_elements(input_files: List[str], openc: bool, jobs: int,
+                    timeout: int = R2_TIMEOUT,
+                    keep_dir: Optional[str] = None,
+                    level: str = "aaa") -> \
+        Iterator[Tuple[str, List[Tuple[bytes, int]]]]:
+    """
+    Extracts the data of several binary files in parallel, returning it as
+    soon as each file is completed instead of writing it to disk.
+    At most QUEUE_PER_JOB files for each job are extracted in advance, so
+    the memory used is bounded even if the consumer is slower than the
+    extraction.
+    If a worker process dies (e.g. killed when out of memory), the pool is
+    replaced and the files that were in it are extracted again one at a
+    time. A file crashing its worker while alone is reported and skipped.
+    :param input_files: A list of paths to binary files
+    :param openc: true if opcode encoded analysis is requested
+    :param jobs: maximum number of jobs that will be spawned concurrently
+    :param timeout: maximum number of seconds spent analyzing a single file
+    :param keep_dir: if not None, the extracted data is also written in this
+    folder, with the same names used by run_extractor
+    :param level: analysis level used in opcode encoded analysis, one of
+    ANALYSIS_LEVELS
+    :return: An iterator of tuples (file, elements), where elements is the
+    list returned by extract_elements for that file (empty if skipped), in
+    completion order
+    """
+    extension = STORE_EXTENSION if openc else ".bin"
+    pending = iter(input_files)
+    running = {}
+    # files in the pool when it broke: one of them crashed the worker, so
+    # they are extracted again one at a time to find which one
+    suspects = []
+    executor = ProcessPoolExecutor(max_workers=jobs)
+    try:
+        while True:
+            if len(suspects) > 0:
+                files = suspects[:1] if len(running) == 0 else []
+                del suspects[:len(files)]
+            else:
+                files = pending
+            for file in files:
+                out_file = None
+                if keep_dir is not None:
+                    out_file = os.path.join(keep_dir, os.path.basename(file) +
+                                            extension)
+                future = executor.submit(extract_elements, file, openc,
+                                         timeout, out_file, level)
+                running[future] = file
+                if len(running) >= jobs * QUEUE_PER_JOB:
+                    break
+            if len(running) == 0:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            broken = []
+            for future in done:
+                file = running.pop(future)
+                try:
+                    elements = future.result()
+                except BrokenProcessPool:
+                    broken.append(file)
+                    continue
+                yield file, elements
+            if len(broken) == 0:
+                continue
+            # the pool can not recover, every other file fails as well
+            broken.extend(running.values())
+            running = {}
+            executor.shutdown(wait=False)
+            executor = ProcessPoolExecutor(max_workers=jobs)
+            if len(broken) == 1:
+                # the crash is certainly caused by this file
+                tqdm.write(f"Skipping {broken[0]}: the worker process "
+                           f"crashed")
+                yield broken[0], []
+            else:
+                suspects.extend(broken)
+    finally:
+        executor.shutdown()
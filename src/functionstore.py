@@ -0,0 +1,70 @@
+import mmap
+from typing import List
+
+import numpy as np
+
+STORE_EXTENSION = ".fns"
+STORE_MAGIC = b"\x27FNS"
+STORE_HEADER_SIZE = 8
+# metadata of each function, followed by the length of its variable fields
+STORE_INDEX = np.dtype([("offset", "<u8"), ("size", "<u8"), ("name", "<u4"),
+                        ("raw", "<u4"), ("opcodes", "<u4")])
+
+
+def write_function_store(rows: List[list], path: str) -> None:
+    """
+    Writes the functions extracted from a binary in a compact binary file.
+
+    File structure:
+    4 bytes -> magic (STORE_MAGIC)
+    4 bytes -> number of functions
+    An index with a record for each function, as in STORE_INDEX: virtual
+    address, size, and the length of name, raw bytes and opcodes
+    For each function, the utf-8 name, the raw bytes and the opcodes
+
+    :param rows: list with a row for each function, containing virtual
+    address, name, size, raw bytes and opcodes (both as bytes)
+    :param path: path of the output file
+    """
+    index = np.zeros(len(rows), dtype=STORE_INDEX)
+    blobs = []
+    for i, (offset, name, size, raw, opcodes) in enumerate(rows):
+        name = name.encode("utf-8")
+        index[i] = (offset, size, len(name), len(raw), len(opcodes))
+        blobs.extend((name, raw, opcodes))
+    with open(path, "wb") as fp:
+        fp.write(STORE_MAGIC)
+        fp.write(len(rows).to_bytes(4, byteorder="little"))
+        fp.write(index.tobytes())
+        fp.write(b"".join(blobs))
+
+
+def read_function_store(path: str) -> List[list]:
+    """
+    Reads the functions written by write_function_store.
+    Raises IOError if the file is not a function store.
+    :param path: path of the file
+    :return: A list with a row for each function, in the same form given to
+    write_function_store
+    """
+    with open(path, "rb") as fp:
+        if fp.read(4) != STORE_MAGIC:
+            raise IOError(f"File {path} is not a function store")
+        functions = int.from_bytes(fp.read(4), byteorder="little")
+        if functions == 0:
+            return []
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            index = np.frombuffer(data, dtype=STORE_INDEX, count=functions,
+                                  offset=STORE_HEADER_SIZE).copy()
+            lengths = np.stack((index["name"], index["raw"],
+                                index["opcodes"]), axis=1).reshape(-1)
+            ends = np.cumsum(lengths, dtype=np.int64) + STORE_HEADER_SIZE + \
+                STORE_INDEX.itemsize * functions
+            if ends[-1] > len(data):
+                raise IOError(f"File {path} is truncated")
+            ends = ends.tolist()
+            starts = [ends[0] - int(lengths[0])] + ends[:-1]
+            fields = [data[start:end] for start, end in zip(starts, ends)]
+    return [[int(meta["offset"]), fields[3 * i].decode("utf-8"),
+             int(meta["size"]), fields[3 * i + 1], fields[3 * i + 2]]
+            for i, meta in enumerate(index)]
@@ -0,0 +1,117 @@
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from .binaryds import BinaryDs
+from .datasetview import SPLITS, SPLITS_FILE, open_split, split_exists, \
+    write_splits
+
+
+def run_purge_leaks(data_dir: str, remove: bool, jobs: int) -> None:
+    """
+    Finds the examples contained in more than one split of the dataset
+    (train, validate, test) and optionally removes them.
+    An example found in several splits is kept only in the one with higher
+    priority: test, then validate, then train.
+    :param data_dir: Path to the folder containing the preprocessed dataset
+    :param remove: True if the leaked examples should be removed, False if
+    they should only be reported
+    :param jobs: number of processes used to hash the examples without a
+    stored hash. The calculated hashes are stored in the dataset, if
+    writable
+    """
+    assert os.path.exists(data_dir), "Model directory does not exists!"
+    names = [name for name in reversed(SPLITS)
+             if split_exists(data_dir, name)]
+    hashes = {}
+    computed = {}  # hashes of each dataset file, shared by its splits
+    for name in names:
+        with open_split(data_dir, name) as split:
+            path = split.base.path
+            indices = split.get_indices()
+        if path not in computed:
+            computed[path] = __get_hashes(path, jobs)
+        hashes[name] = computed[path][indices]
+    leaks = find_leaks([hashes[name] for name in names])
+    for name, leaked in zip(names, leaks):
+        print(f"Examples of {name} found in other splits: "
+              f"{np.count_nonzero(leaked)}")
+    if remove and any(np.any(leaked) for leaked in leaks):
+        print("Removing... ", end="", flush=True)
+        remove_leaks(data_dir, dict(zip(names, leaks)))
+        print("OK", flush=True)
+
+
+# returns the hash of every example of a dataset, storing the missing ones
+# in its hash column if the file is writable
+def __get_hashes(path: str, jobs: int) -> np.ndarray:
+    with BinaryDs(path, read_only=True) as dataset:
+        if not os.access(path, os.W_OK):
+            return dataset.get_hashes(jobs)
+        features = dataset.get_features()
+        encoded = dataset.is_encoded()
+    with BinaryDs(path, features=features, encoded=encoded) as dataset:
+        return dataset.get_hashes(jobs)
+
+
+def find_leaks(hashes: List[np.ndarray]) -> List[np.ndarray]:
+    """
+    Finds the examples already contained in a previous set.
+    Only a sorted copy of the unique hashes of the previous sets is kept in
+    memory, and the hashes of each set are checked against it.
+    :param hashes: list with the array of hashes (uint64) of each set, in
+    order of priority
+    :return: a list with a boolean array for each set, True for the examples
+    found in any of the previous sets
+    """
+    leaks = []
+    seen = np.zeros(0, dtype=np.uint64)
+    for current in hashes:
+        if len(seen) > 0:
+            positions = np.searchsorted(seen, current).clip(max=len(seen) - 1)
+            leaks.append(seen[positions] == current)
+        else:
+            leaks.append(np.zeros(len(current), dtype=bool))
+        seen = np.union1d(seen, current)
+    return leaks
+
+
+def remove_leaks(data_dir: str, leaks: Dict[str, np.ndarray]) -> None:
+    """
+    Removes the leaked examples from the splits. If the splits are views of a
+    single dataset only their definition is changed, otherwise the examples
+    are removed from each file.
+    :param data_dir: Path to the folder containing the preprocessed dataset
+    :param leaks: dictionary with the name of each split as key and a
+    boolean array with the examples to remove as value
+    """
+    if os.path.exists(os.path.join(data_dir, SPLITS_FILE)):
+        splits = {}
+        counts = {}
+        for name in SPLITS:
+            if split_exists(data_dir, name):
+                with open_split(data_dir, name) as split:
+                    splits[name] = split.get_indices()
+                    counts[name] = np.array(split.get_category_counts(),
+                                            dtype=np.int64)
+                    if name in leaks:
+                        # only the labels of the removed examples are read
+                        removed = np.flatnonzero(leaks[name])
+                        labels, _ = split.read_indices(removed)
+                        counts[name] -= np.bincount(
+                            labels, minlength=len(counts[name]))
+                if name in leaks:
+                    splits[name] = splits[name][~leaks[name]]
+                counts[name] = np.trim_zeros(counts[name], "b").tolist()
+        write_splits(data_dir, splits, counts)
+    else:
+        for name, leaked in leaks.items():
+            if np.any(leaked):
+                path = os.path.join(data_dir, name + ".bin")
+                with BinaryDs(path, read_only=True) as dataset:
+                    features = dataset.get_features()
+                    encoded = dataset.is_encoded()
+                with BinaryDs(path, features=features,
+                              encoded=encoded) as dataset:
+                    dataset.filter(~leaked)
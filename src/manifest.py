@@ -0,0 +1,99 @@
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+MANIFEST_FILE = "extraction.manifest"
+COMPLETED = ["done", "empty"]  # no need to extract these files again
+
+
+class ExtractionManifest:
+    """
+    Record of the outcome of the extraction of each input file, kept in the
+    output folder so an interrupted extraction can be resumed.
+    The manifest is a text file with a JSON object for each line, appended
+    as soon as a file is processed, so it is never rewritten and an
+    interruption loses at most the last line. Each object contains the path
+    of the input file, its size and modification time (so modified files are
+    extracted again), the type of extraction, the path of the output file and
+    the status of the extraction: `done`, `empty` (the file contained nothing
+    to extract), `failed` or `timeout`. When a file appears more than once the
+    last line is the valid one.
+    Extractions of different types can share the same manifest, as only the
+    records of the type given in the constructor are considered.
+    """
+
+    def __init__(self, path: str, mode: str = "") -> None:
+        """
+        Constructor. Loads the existing manifest, if any.
+
+        :param path: path to the manifest file
+        :param mode: string identifying the type of extraction, including
+        output format and analysis level
+        """
+        self.path: str = path
+        self.mode: str = mode
+        self.records: Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, "r") as fp:
+                for line in fp:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:  # last line cut by an interruption
+                        continue
+                    if record.get("mode", "") == mode:
+                        self.records[record["file"]] = record
+
+    def is_completed(self, file: str, failures: bool = False) -> bool:
+        """
+        Returns true if the file was already extracted, not modified after its
+        extraction, and its output still exists.
+        :param file: path to the input file
+        :param failures: true if files that failed or timed out are considered
+        completed as well
+        """
+        record = self.records.get(os.path.abspath(file))
+        if record is None:
+            return False
+        if not failures and record["status"] not in COMPLETED:
+            return False
+        output = record.get("output")
+        if record["status"] == "done" and output is not None and \
+                not os.path.exists(output):
+            return False
+        return (record["size"], record["mtime"]) == self.__stat(file)
+
+    def record(self, file: str, status: str, output: Optional[str] = None,
+               **info) -> None:
+        """
+        Appends the outcome of the extraction of a file to the manifest.
+        :param file: path to the input file
+        :param status: one of `done`, `empty`, `failed` or `timeout`
+        :param output: path to the output file, if any
+        :param info: additional values stored in the record, like the error
+        message or the time spent
+        """
+        size, mtime = self.__stat(file)
+        record = {"file": os.path.abspath(file), "size": size,
+                  "mtime": mtime, "mode": self.mode, "status": status}
+        if output is not None:
+            record["output"] = os.path.abspath(output)
+        record.update(info)
+        self.records[record["file"]] = record
+        with open(self.path, "a") as fp:
+            fp.write(json.dumps(record) + "\n")
+
+    # size and modification time of a file, None if not existing
+    @staticmethod
+    def __stat(file: str) -> Tuple[Optional[int], Optional[float]]:
+        try:
+            stat = os.stat(file)
+        except OSError:
+            return None, None
+        return stat.st_size, stat.st_mtime
+
+    def failures(self) -> List[dict]:
+        """
+        Returns the records of the files that could not be extracted.
+        """
+        return [record for record in self.records.values()
+                if record["status"] not in COMPLETED]
@@ -1,42 +1,119 @@
 import csv
+import hashlib
 import os
 import sys
-from typing import List
+from typing import Dict, Iterable, List, Optional, Tuple
 
+import numpy as np
 from termcolor import colored
 from tqdm import tqdm
 
-from .binaryds import BinaryDs
+from .binaryds import BinaryDs, COUNTS_SUFFIX, first_occurrences, hash_data
+from .datasetview import DATASET_FILE, SPLITS, split_category_counts, \
+    stratified_split, write_splits
+from .extractor import R2_TIMEOUT, stream_elements
+from .functionstore import STORE_EXTENSION, read_function_store
 
 MINIMUM_FEATURES: int = 32
+SPLIT_RATIOS: List[float] = [0.5, 0.25, 0.25]
 csv.field_size_limit(sys.maxsize)
 
 
 def run_preprocess(input_dir: List[str], category: int, output_dir: str,
                    openc: bool, features: int, balanced: bool,
-                   seed: int, incomplete: bool) -> None:
+                   seed: int, incomplete: bool, jobs: int,
+                   quota: int = 0) -> None:
     """
     Performs the preprocessing by adding a category and writes (or updates) the
-    binary file containing the dataset on disk
+    binary file containing the dataset on disk. The training, validation and
+    testing sets are not copied into separate files, but written as arrays of
+    indices of the dataset, listed in the splits.json file. Examples coming
+    from files with the same name are always in the same set, and every
+    category is split with the same proportions
     :param input_dir The folder where the examples for a single category can be
      found
     :param category: The id of the category that will be written
-    :param output_dir: Path to the folder where the train.bin and test.bin
-    can be found (or will be created).
+    :param output_dir: Path to the folder where the dataset.bin and
+    splits.json can be found (or will be created).
     :param openc: True if this method has a function opcode encoding
     :param features: How many features (i.e. The number of bytes for each
     example)
     :param balanced: True if the produced dataset should have the same
     amount of training/testing/validate samples for each category
-    :param seed: The seed that will be used for shuffling
+    :param seed: The seed that will be used for shuffling and splitting
     :param incomplete: True if the dataset won't be splitted, deduplicated
      or shuffled
+    :param jobs: maximum number of processes used for deduplication
+    :param quota: if greater than 0, maximum number of examples kept for
+    each category. If balanced is also True, the least represented category
+    further limits this amount
     """
     assert (os.path.exists(output_dir))
-    train, validate, test = __load_all_into_train(output_dir, features, openc)
+    train = __load_dataset(output_dir, features, openc)
     print("Reading and adding new files... ", flush=True)
     files = gather_files(input_dir, openc)
-    read_and_add(train, files, category)
+    read_and_add(train, files, category, jobs)
+    __finalize(train, output_dir, balanced, seed, incomplete, jobs, quota)
+
+
+def run_ingest(input_files: List[str], category: int, output_dir: str,
+               openc: bool, features: int, balanced: bool, seed: int,
+               incomplete: bool, jobs: int, quota: int = 0,
+               timeout: int = R2_TIMEOUT,
+               keep_dir: Optional[str] = None, level: str = "aaa") -> None:
+    """
+    Same as running the extraction followed by the preprocessing, but the
+    extracted data is added to the dataset while the binaries are still
+    being extracted, without writing intermediate files.
+    :param input_files: A list of paths to the binary files (or folders
+    containing them) for a single category
+    :param category: The id of the category that will be written
+    :param output_dir: Path to the folder where the dataset.bin and
+    splits.json can be found (or will be created).
+    :param openc: True if opcode encoded analysis is requested
+    :param features: How many features (i.e. The number of bytes for each
+    example)
+    :param balanced: True if the produced dataset should have the same
+    amount of training/testing/validate samples for each category
+    :param seed: The seed that will be used for shuffling and splitting
+    :param incomplete: True if the dataset won't be splitted, deduplicated
+     or shuffled
+    :param jobs: maximum number of processes used for extraction and
+    deduplication
+    :param quota: if greater than 0, maximum number of examples kept for
+    each category, as in run_preprocess
+    :param timeout: maximum number of seconds spent analyzing a single file.
+    Files exceeding it, or that can not be extracted, are skipped
+    :param keep_dir: if not None, the extracted data is also written in this
+    folder, as done by the extract action
+    :param level: analysis level used in opcode encoded analysis, as in
+    run_extractor
+    """
+    assert (os.path.exists(output_dir))
+    if keep_dir is not None:
+        assert (os.path.isdir(keep_dir))
+    files = []
+    for path in input_files:
+        if os.path.isdir(path):
+            for root, _, found in os.walk(path):
+                files.extend(os.path.join(root, name) for name in found)
+        else:
+            files.append(path)
+    train = __load_dataset(output_dir, features, openc)
+    print("Extracting and adding new files... ", flush=True)
+    extension = ".csv" if openc else ".bin"
+    stream = stream_elements(files, openc, jobs, timeout, keep_dir, level)
+    # group as the file written by the extract action, to match preprocess
+    elements = ((file, group_key(file + extension), data)
+                for file, data in tqdm(stream, total=len(files), ncols=60))
+    add_elements(train, elements, category, jobs)
+    __finalize(train, output_dir, balanced, seed, incomplete, jobs, quota)
+
+
+def __finalize(train: BinaryDs, output_dir: str, balanced: bool, seed: int,
+               incomplete: bool, jobs: int, quota: int) -> None:
+    # Deduplicates, shuffles, balances and splits the dataset after adding
+    # the new examples, then closes it
     if incomplete:
         print("Deduplicating... ", end="", flush=True)
         print(colored("SKIP", "white", attrs=['bold']), flush=True)
@@ -46,47 +123,103 @@ def run_preprocess(input_dir: List[str], category: int, output_dir: str,
         print(colored("SKIP", "white", attrs=['bold']), flush=True)
         print("Splitting... ", end="", flush=True)
         print(colored("SKIP", "white", attrs=['bold']), flush=True)
+        examples = train.get_examples_no()
+        splits = {"train": (0, examples), "validate": (examples, examples),
+                  "test": (examples, examples)}
+        counts = {"train": train.get_category_counts(), "validate": [],
+                  "test": []}
     else:
         print("Deduplicating... ", end="", flush=True)
-        train.deduplicate()
-        print(colored("OK", "green", attrs=['bold']), flush=True)
-        print("Shuffling... ", end="", flush=True)
-        train.shuffle(seed)
+        train.deduplicate(jobs=jobs)
         print(colored("OK", "green", attrs=['bold']), flush=True)
+        # balancing keeps the first examples, so they must be shuffled first
+        if balanced or quota > 0:
+            print("Shuffling... ", flush=True)
+            train.shuffle(seed, progress=True)
+        else:
+            print("Shuffling... ", end="", flush=True)
+            print(colored("SKIP", "white", attrs=['bold']), flush=True)
         print("Balancing... ", end="", flush=True)
-        if balanced:
+        if balanced and quota <= 0:
             train.balance()
             print(colored("OK", "green", attrs=['bold']), flush=True)
+        elif quota > 0:
+            cats = train.get_category_counts()
+            if balanced and len(cats) > 0:
+                quota = min(quota, min(cats))
+            train.balance([quota] * len(cats))
+            print(colored("OK", "green", attrs=['bold']), flush=True)
         else:
             print(colored("SKIP", "white", attrs=['bold']), flush=True)
         print("Splitting... ", end="", flush=True)
-        train.split(validate, 0.5)
-        validate.split(test, 0.5)
+        splits = split_dataset(train, seed)
+        counts = split_category_counts(train.get_array()["label"], splits)
         print(colored("OK", "green", attrs=['bold']), flush=True)
     print("Finalizing... ", end="", flush=True)
     train.close()
-    validate.close()
-    test.close()
+    write_splits(output_dir, splits, counts)
     print(colored("OK", "green", attrs=['bold']), flush=True)
 
 
-def __load_all_into_train(output_dir: str, features: int,
-                          openc: bool) -> (BinaryDs, BinaryDs, BinaryDs):
-    # Load all the files into the train dataset
+def __load_dataset(output_dir: str, features: int, openc: bool) -> BinaryDs:
+    # Opens the dataset. Datasets created by older versions, with a separate
+    # file for each split, are merged into a single file (only once)
     print("Loading old dataset... ", end="", flush=True)
-    path_train = os.path.join(output_dir, "train.bin")
-    path_val = os.path.join(output_dir, "validate.bin")
-    path_test = os.path.join(output_dir, "test.bin")
-    train = BinaryDs(path_train, features=features, encoded=openc).open()
-    test = BinaryDs(path_test, features=features, encoded=openc).open()
-    validate = BinaryDs(path_val, features=features, encoded=openc).open()
-    train.merge(test)
-    train.merge(validate)
+    path = os.path.join(output_dir, DATASET_FILE)
+    dataset = BinaryDs(path, features=features, encoded=openc).open()
+    for name in SPLITS:
+        legacy_path = os.path.join(output_dir, name + ".bin")
+        if os.path.exists(legacy_path):
+            with BinaryDs(legacy_path, features=features,
+                          encoded=openc) as legacy:
+                dataset.merge(legacy)
+            os.remove(legacy_path)
+            if os.path.exists(legacy_path + COUNTS_SUFFIX):
+                os.remove(legacy_path + COUNTS_SUFFIX)
     print(colored("OK", "green", attrs=['bold']), flush=True)
-    return train, validate, test
+    return dataset
 
 
-def read_and_add(dataset: BinaryDs, files: List[str], category: int) -> None:
+def split_dataset(dataset: BinaryDs, seed) -> Dict[str, np.ndarray]:
+    """
+    Splits a dataset in training, validation and testing sets, according to
+    SPLIT_RATIOS, without leaking examples of the same group between sets.
+    Examples without a group (added by older versions) are considered as
+    groups by themselves.
+    :param dataset: The dataset that will be split
+    :param seed: The seed that will be used to assign the groups
+    :return: A dictionary with the name of each set as key and the array of
+    indices of its examples as value
+    """
+    labels = dataset.get_array()["label"]
+    groups = dataset.get_column("group")
+    if groups is None:
+        groups = np.zeros(len(labels), dtype=np.uint64)
+    missing = np.flatnonzero(groups == 0)
+    groups[missing] = missing
+    indices = stratified_split(labels, groups, SPLIT_RATIOS, seed)
+    return dict(zip(SPLITS, indices))
+
+
+def group_key(path: str) -> int:
+    """
+    Returns the group of the examples extracted from a file. Files with the
+    same name, for example the same program compiled with different flags,
+    are in the same group. Function stores are in the same group of the .csv
+    with the same name.
+    :param path: path to the file
+    :return: an unsigned 64 bit integer, never 0
+    """
+    name, ext = os.path.splitext(os.path.basename(path))
+    if ext == STORE_EXTENSION:
+        ext = ".csv"
+    name = (name + ext).encode("utf-8")
+    digest = hashlib.blake2b(name, digest_size=8).digest()
+    return int.from_bytes(digest, byteorder="little") or 1
+
+
+def read_and_add(dataset: BinaryDs, files: List[str], category: int,
+                 jobs: Optional[int] = None) -> None:
     """
     Reads the raw files add them directly to the dataset as examples.
     Functions/data with more bytes than the number of features will be split
@@ -94,53 +227,158 @@ def read_and_add(dataset: BinaryDs, files: List[str], category: int) -> None:
     If opcode encoding was chosen, chunks with less than MINIMUM_FEATURES bytes
     (default 32) will be discarded, otherwise chunks with an amount of bytes
     different than the number of features will be discarded.
+    Chunks already contained in the dataset, or repeated in the files, are
+    discarded before being written. The hashes of the examples already in
+    the dataset are read from its `hash` column, so only new chunks are
+    hashed.
+    The provenance of each chunk is written in the `file`, `offset` and
+    `length` columns of the dataset: the offset is the position of the chunk
+    in the file for raw data, and the address of the function for opcode
+    encoded data, while the length is the one of the whole file or function.
     :param files: List of paths to every file that will be processed.
     :param dataset: dataset where the examples will be added.
     :param category: The category for the current examples.
+    :param jobs: maximum number of processes used to hash the examples of the
+    dataset that have not been hashed yet
+    """
+    elements = ((cur_file, group_key(cur_file),
+                 read_extracted(cur_file, dataset.is_encoded()))
+                for cur_file in tqdm(files, ncols=60))
+    add_elements(dataset, elements, category, jobs)
+
+
+def read_extracted(path: str, openc: bool) -> List[Tuple[bytes, int]]:
+    """
+    Reads a file written by the extract action.
+    :param path: path to the .fns, .csv or .bin file
+    :param openc: True if the file contains opcode encoded data
+    :return: A list of tuples (data, address), one for each function for
+    opcode encoded data, or a single one with the whole file and 0 otherwise
+    """
+    data = list()
+    if openc and os.path.splitext(path)[1] == STORE_EXTENSION:
+        for row in read_function_store(path):
+            data.append((row[4], row[0]))
+    elif openc:
+        with open(path, 'r') as f:
+            reader = csv.DictReader(f, delimiter=",", quotechar='"',
+                                    quoting=csv.QUOTE_NONNUMERIC)
+            for row in reader:
+                raw_data = row["opcodes"]
+                encoded_data = bytes.fromhex(raw_data)
+                data.append((encoded_data, int(row["offset"])))
+    else:
+        with open(path, 'rb') as f:
+            data.append((f.read(), 0))
+    return data
+
+
+def add_elements(dataset: BinaryDs,
+                 elements: Iterable[Tuple[str, int, List[Tuple[bytes, int]]]],
+                 category: int, jobs: Optional[int] = None) -> None:
+    """
+    Adds to the dataset the data extracted from some files, as described in
+    read_and_add. The data is consumed as it is produced, so it can come from
+    files on disk or directly from the extraction.
+    :param dataset: dataset where the examples will be added.
+    :param elements: iterable of tuples (path, group, data) where path is the
+    source file, group is its group key and data a list of tuples
+    (data, address) as returned by read_extracted
+    :param category: The category for the current examples.
+    :param jobs: maximum number of processes used to hash the examples of the
+    dataset that have not been hashed yet
     """
+    features = dataset.get_features()
+    openc = dataset.is_encoded()
+    # sorted arrays with the hashes of the examples in the dataset
+    known = [np.sort(dataset.get_hashes(jobs))]
     buffer = []
-    for cur_file in tqdm(files, ncols=60):
-        data = list()
-        features = dataset.get_features()
-        openc = dataset.is_encoded()
-        if openc:
-            with open(cur_file, 'r') as f:
-                reader = csv.DictReader(f, delimiter=",", quotechar='"',
-                                        quoting=csv.QUOTE_NONNUMERIC)
-                for row in reader:
-                    raw_data = row["opcodes"]
-                    encoded_data = bytes.fromhex(raw_data)
-                    data.append(encoded_data)
-        else:
-            with open(cur_file, 'rb') as f:
-                data.append(f.read())
-        # split in chunks of "features" length
-        chunked = []
-        for el in data:
-            chunks = [el[j:j + features] for j in range(0, len(el), features)]
-            chunked.extend(chunks)
-        if openc:
-            # prepad remaining elements and drop ones that are too short
-            padded = []
-            for element in chunked:
-                cur_len = len(element)
-                if cur_len >= MINIMUM_FEATURES:
-                    missing = features - cur_len
-                    padded.append(bytes(missing) + element)
-            chunked = padded
-        else:
-            # drop elements different from feature size
-            chunked = list(filter(lambda l: len(l) == features, chunked))
-        # append category and add to dataset
-        chunked = [(category, x) for x in chunked]
-        buffer.extend(chunked)
-        if len(buffer) > int(4194304 / (features + 1)):
+    columns = {"group": [], "file": [], "offset": [], "length": []}
+    buffered = 0
+    for cur_file, group, data in elements:
+        file_id = dataset.add_files([cur_file])[0]
+        for el, address in data:
+            chunks = split_chunks(el, features, openc)
+            amount = len(chunks)
+            buffer.append(chunks)
+            columns["group"].append(np.full(amount, group, dtype=np.uint64))
+            columns["file"].append(np.full(amount, file_id, dtype=np.uint32))
+            if openc:
+                offsets = np.full(amount, address, dtype=np.uint64)
+            else:
+                offsets = np.arange(amount, dtype=np.uint64) * features
+            columns["offset"].append(offsets)
+            columns["length"].append(np.full(amount, len(el),
+                                             dtype=np.uint32))
+            buffered += amount
+        if buffered > int(4194304 / (features + 1)):
             # write only when a certain size is reached
-            dataset.write(buffer)
+            write_chunks(dataset, buffer, category, columns, known)
             buffer = []
-    if len(buffer) > 0:
+            columns = {name: [] for name in columns}
+            buffered = 0
+    if buffered > 0:
         # write remaining
-        dataset.write(buffer)
+        write_chunks(dataset, buffer, category, columns, known)
+
+
+def split_chunks(data: bytes, features: int, openc: bool) -> np.ndarray:
+    """
+    Splits a function/file into chunks of features length.
+    If opcode encoding was chosen, the last chunk is pre-padded with zeroes
+    and chunks with less than MINIMUM_FEATURES bytes are discarded. Otherwise
+    the last chunk is discarded if shorter than features.
+    :param data: The bytes that will be split.
+    :param features: The length of each chunk.
+    :param openc: True if the data is opcode based.
+    :return: A 2D array of uint8, each row being a chunk.
+    """
+    values = np.frombuffer(data, dtype=np.uint8)
+    full = len(values) // features
+    if openc and features < MINIMUM_FEATURES:
+        full = 0
+    chunks = values[:full * features].reshape(full, features)
+    remainder = len(values) - full * features
+    if openc and MINIMUM_FEATURES <= remainder < features:
+        last = np.zeros((1, features), dtype=np.uint8)
+        last[0, features - remainder:] = values[full * features:]
+        chunks = np.concatenate((chunks, last))
+    return chunks
+
+
+def write_chunks(dataset: BinaryDs, chunks: List[np.ndarray], category: int,
+                 columns: Dict[str, List[np.ndarray]],
+                 known: List[np.ndarray]) -> None:
+    """
+    Writes a list of chunks to the dataset, all with the same category,
+    skipping the duplicated ones.
+    :param dataset: dataset where the examples will be added.
+    :param chunks: list of 2D arrays, as returned by split_chunks.
+    :param category: The category for the current examples.
+    :param columns: dictionary with the name of some columns of the dataset
+    as key, and a list of arrays with the values for each chunk as value.
+    :param known: list of sorted arrays with the hashes of the examples
+    already in the dataset, updated by this function with the written ones.
+    Arrays of similar size are merged, so the list has at most log2(n)
+    arrays and each hash costs 8 bytes.
+    """
+    data = np.concatenate(chunks)
+    hashes = hash_data(data)
+    keep = first_occurrences(hashes.reshape(-1, 1))
+    for array in known:
+        if len(array) > 0:
+            positions = np.searchsorted(array, hashes).clip(max=len(array) - 1)
+            keep &= array[positions] != hashes
+    known.append(np.sort(hashes[keep]))
+    while len(known) > 1 and len(known[-2]) <= len(known[-1]):
+        last = known.pop()
+        known[-1] = np.sort(np.concatenate((known[-1], last)),
+                            kind="mergesort")
+    labels = np.full(np.count_nonzero(keep), category, dtype=np.uint16)
+    values = {name: np.concatenate(arrays)[keep]
+              for name, arrays in columns.items()}
+    values["hash"] = hashes[keep]
+    dataset.write_array(labels, data[keep], columns=values)
 
 
 def gather_files(paths: List[str], openc: bool) -> List[str]:
@@ -148,10 +386,10 @@ def gather_files(paths: List[str], openc: bool) -> List[str]:
     Finds all files contained in a directory and filter them based on their
     extensions.
     :param paths: Paths to the folder containing the files or to a single file
-    :param openc: True if opcode based encoding is requested (will parse .csv
-    files, .bin otherwise)
-    :return A list of paths to every file contained in the folder with .csv
-    or .bin extension (based on the function parameter)
+    :param openc: True if opcode based encoding is requested (will parse .fns
+    and .csv files, .bin otherwise)
+    :return A list of paths to every file contained in the folder with .fns,
+    .csv or .bin extension (based on the function parameter)
     """
     files = []
     for path in paths:
@@ -164,14 +402,15 @@ def gather_files(paths: List[str], openc: bool) -> List[str]:
         else:
             cur_files = [path]
         if openc:
-            ext = ".csv"
+            ext = [STORE_EXTENSION, ".csv"]
         else:
-            ext = ".bin"
+            ext = [".bin"]
         cur_files = list(
-            filter(lambda x: os.path.splitext(x)[1] == ext, cur_files))
+            filter(lambda x: os.path.splitext(x)[1] in ext, cur_files))
         if len(cur_files) == 0:
             raise FileNotFoundError(f"No files with the correct extension, "
-                                    "{ext} were found in the given folder")
+                                    f"{' or '.join(ext)} were found in the "
+                                    f"given folder")
         else:
             files.extend(cur_files)
     return files
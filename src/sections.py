@@ -0,0 +1,149 @@
+import mmap
+import struct
+from typing import Optional
+
+ELF_MAGIC = b"\x7fELF"
+PE_MAGIC = b"MZ"
+# magic of 32 and 64 bit Mach-O files, as read in little endian order
+MACHO_MAGIC = {b"\xce\xfa\xed\xfe": ("<", False),
+               b"\xcf\xfa\xed\xfe": ("<", True),
+               b"\xfe\xed\xfa\xce": (">", False),
+               b"\xfe\xed\xfa\xcf": (">", True)}
+LC_SEGMENT = 0x1
+LC_SEGMENT_64 = 0x19
+
+
+def read_text_section(file: str) -> Optional[bytes]:
+    """
+    Reads the raw .text section of an ELF (32 or 64 bit, any endianness), PE
+    or Mach-O file, without disassembling it.
+    The section is searched in the same way radare2 does, so the result is
+    the same of reading the section with r2.
+    :param file: path to the input file
+    :return: The content of the section, or None if the file format is not
+    supported, the section was not found or it is not entirely contained in
+    the file. In these cases the file should be analyzed with r2.
+    """
+    with open(file, "rb") as fp:
+        try:
+            data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty files can not be mapped
+            return None
+    with data:
+        try:
+            if data[:4] == ELF_MAGIC:
+                location = __elf_text(data)
+            elif data[:2] == PE_MAGIC:
+                location = __pe_text(data)
+            elif data[:4] in MACHO_MAGIC:
+                location = __macho_text(data)
+            else:
+                location = None
+        except struct.error:  # truncated or malformed headers
+            location = None
+        if location is None:
+            return None
+        offset, size = location
+        if offset + size > len(data):
+            return None
+        return data[offset:offset + size]
+
+
+# returns (offset, size) of the .text section of an ELF file
+def __elf_text(data: mmap.mmap) -> Optional[tuple]:
+    if data[4] == 1:
+        wide = False
+    elif data[4] == 2:
+        wide = True
+    else:
+        return None
+    if data[5] == 1:
+        order = "<"
+    elif data[5] == 2:
+        order = ">"
+    else:
+        return None
+    if wide:
+        shoff, = struct.unpack_from(order + "Q", data, 0x28)
+        entsize, shnum, shstrndx = struct.unpack_from(order + "HHH", data,
+                                                      0x3A)
+        section_format = order + "IIQQQQIIQQ"
+    else:
+        shoff, = struct.unpack_from(order + "I", data, 0x20)
+        entsize, shnum, shstrndx = struct.unpack_from(order + "HHH", data,
+                                                      0x2E)
+        section_format = order + "IIIIIIIIII"
+    if shoff == 0 or entsize < struct.calcsize(section_format):
+        return None
+    sections = []
+    first = struct.unpack_from(section_format, data, shoff)
+    # the real values are in the first section if they do not fit the header
+    if shnum == 0:
+        shnum = first[5]
+    if shstrndx == 0xFFFF:
+        shstrndx = first[6]
+    for index in range(shnum):
+        sections.append(struct.unpack_from(section_format, data,
+                                           shoff + index * entsize))
+    if shstrndx >= len(sections):
+        return None
+    names = sections[shstrndx][4]
+    for name, kind, _, _, offset, size, _, _, _, _ in sections:
+        end = data.find(b"\x00", names + name)
+        if end >= 0 and data[names + name:end] == b".text":
+            if kind == 8:  # SHT_NOBITS, no content in the file
+                return None
+            return offset, size
+    return None
+
+
+# returns (offset, size) of the .text section of a PE file
+def __pe_text(data: mmap.mmap) -> Optional[tuple]:
+    header, = struct.unpack_from("<I", data, 0x3C)
+    if data[header:header + 4] != b"PE\x00\x00":
+        return None
+    sections_no, = struct.unpack_from("<H", data, header + 6)
+    optional_size, = struct.unpack_from("<H", data, header + 20)
+    table = header + 24 + optional_size
+    for index in range(sections_no):
+        name, vsize, _, size, offset = struct.unpack_from(
+            "<8sIIII", data, table + index * 40)
+        if name.rstrip(b"\x00") == b".text":
+            # r2 pads the part not backed by the virtual size
+            if vsize < size:
+                return None
+            return offset, size
+    return None
+
+
+# returns (offset, size) of the __TEXT,__text section of a Mach-O file
+def __macho_text(data: mmap.mmap) -> Optional[tuple]:
+    order, wide = MACHO_MAGIC[data[:4]]
+    commands_no, = struct.unpack_from(order + "I", data, 16)
+    position = 32 if wide else 28
+    if wide:
+        segment_format = order + "II16sQQQQiiII"
+        section_format = order + "16s16sQQII"
+        section_size = 80
+    else:
+        segment_format = order + "II16sIIIIiiII"
+        section_format = order + "16s16sIIII"
+        section_size = 68
+    index = 0
+    for _ in range(commands_no):
+        cmd, cmd_size = struct.unpack_from(order + "II", data, position)
+        if cmd in (LC_SEGMENT, LC_SEGMENT_64):
+            sects = struct.unpack_from(segment_format, data, position)[9]
+            start = position + struct.calcsize(segment_format)
+            for i in range(sects):
+                sect, segment, _, size, offset, _ = struct.unpack_from(
+                    section_format, data, start + i * section_size)
+                if sect.rstrip(b"\x00") == b"__text" and \
+                        segment.rstrip(b"\x00") == b"__TEXT":
+                    # r2 names the section 0.__TEXT.__text only if first
+                    return (offset, size) if index == 0 else None
+                index += 1
+        if cmd_size == 0:
+            return None
+        position += cmd_size
+    return None
@@ -10,7 +10,7 @@ from tensorflow.keras.layers import Dense, Flatten, LeakyReLU
 from tensorflow.keras.models import load_model
 from tensorflow.keras.optimizers import Adam
 
-from .binaryds import BinaryDs
+from .datasetview import open_split, split_exists
 # name of the model on the disk
 from .datagenerator import DataGenerator
 
@@ -20,8 +20,8 @@ MODEL_NAME = "model.h5"
 def run_train(data_dir: str, seed: int, network: str, bs: int) -> None:
     """
     Trains the model
-    :param data_dir: string pointing to the folder containing the train.bin
-    and validation.bin files (generated with the run_preprocess function)
+    :param data_dir: string pointing to the folder containing the dataset.bin
+    and splits.json files (generated with the run_preprocess function)
     :param seed: seed that will be used for training
     :param network: either "dense", "lstm" or "cnn", to choose which
     function to train
@@ -30,12 +30,11 @@ def run_train(data_dir: str, seed: int, network: str, bs: int) -> None:
     if seed == 0:
         seed = int(time.time())
     assert os.path.exists(data_dir), "Model directory does not exists!"
-    train_bin = os.path.join(data_dir, "train.bin")
-    validate_bin = os.path.join(data_dir, "validate.bin")
-    assert os.path.exists(train_bin), "Train dataset does not exists!"
-    assert os.path.exists(validate_bin), "Validation dataset does not exists!"
-    train = BinaryDs(train_bin, read_only=True).open()
-    validate = BinaryDs(validate_bin, read_only=True).open()
+    assert split_exists(data_dir, "train"), "Train dataset does not exists!"
+    assert split_exists(data_dir, "validate"), \
+        "Validation dataset does not exists!"
+    train = open_split(data_dir, "train")
+    validate = open_split(data_dir, "validate")
     model_dir = os.path.join(data_dir, network)
     model_path = os.path.join(model_dir, MODEL_NAME)
     if os.path.exists(model_path):
@@ -71,7 +70,7 @@ def run_train(data_dir: str, seed: int, network: str, bs: int) -> None:
                                   min_delta=0.001,
                                   patience=3,
                                   mode="auto")
-    gen_train = DataGenerator(train, bs, fake_pad=True)
+    gen_train = DataGenerator(train, bs, fake_pad=True, random_examples=True)
     gen_val = DataGenerator(validate, bs, fake_pad=False)
     model.fit(gen_train,
               validation_data=gen_val,
@@ -0,0 +1,35 @@
+import os
+
+from .binaryds import BinaryDs
+from .datasetview import DATASET_FILE, SPLITS
+
+
+def run_upgrade(data_dir: str) -> None:
+    """
+    Converts in place every dataset of a preprocessed folder to the latest
+    version of the file format. Both the dataset.bin file and the separate
+    .bin file of each split generated by older versions are converted.
+    :param data_dir: Path to the folder containing the preprocessed dataset
+    """
+    assert os.path.exists(data_dir), "Model directory does not exists!"
+    names = [DATASET_FILE] + [name + ".bin" for name in SPLITS]
+    for name in names:
+        path = os.path.join(data_dir, name)
+        if os.path.exists(path):
+            upgrade_dataset(path)
+
+
+def upgrade_dataset(path: str) -> None:
+    """
+    Converts in place a single dataset to the latest version of the file
+    format, as in BinaryDs.upgrade.
+    :param path: Path to the .bin file of the dataset
+    """
+    with BinaryDs(path, read_only=True) as dataset:
+        features = dataset.get_features()
+        encoded = dataset.is_encoded()
+        version = dataset.get_version()
+    print(f"Upgrading {path} (version {version})... ", end="", flush=True)
+    with BinaryDs(path, features=features, encoded=encoded) as dataset:
+        dataset.upgrade()
+    print("OK", flush=True)
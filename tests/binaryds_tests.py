@@ -1,10 +1,12 @@
 import os
-import random
 import shutil
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase
 
-from src.binaryds import BinaryDs
+import numpy as np
+
+from src.binaryds import BinaryDs, PARALLEL_HASH_SIZE, hash_data
 
 PREFIX = "BCCFLT_"
 
@@ -90,6 +92,87 @@ class TestBinaryDs(TestCase):
             read = dataset.read(0, len(self.data_raw))
         self.assertEqual(read, self.data_raw)
 
+    # Write a file. Then read it as numpy arrays
+    def test_read_array(self):
+        file = os.path.join(self.tmpdir, "rw_array.bin")
+        with BinaryDs(file, features=14) as binary:
+            binary.write(self.data_raw2)
+        with BinaryDs(file, features=14, read_only=True) as dataset:
+            labels, data = dataset.read_array(2, 4)
+            self.assertEqual(labels.shape, (4,))
+            self.assertEqual(data.shape, (4, 14))
+            self.assertFalse(data.flags.writeable)
+            expected = self.data_raw2[2:6]
+            self.assertEqual(labels.tolist(), [x[0] for x in expected])
+            self.assertEqual([bytes(x) for x in data],
+                             [x[1] for x in expected])
+            with self.assertRaises(IndexError):
+                dataset.read_array(6, 4)
+
+    def test_write_array(self):
+        file = os.path.join(self.tmpdir, "write_array.bin")
+        labels = np.array([x[0] for x in self.data_raw2], dtype=np.uint8)
+        data = np.array([list(x[1]) for x in self.data_raw2], dtype=np.uint8)
+        with BinaryDs(file, features=14) as binary:
+            binary.write_array(labels[:3], data[:3])
+            binary.write(self.data_raw2[3:])
+            with self.assertRaises(ValueError):
+                binary.write_array(labels[:2], data[:3])
+            with self.assertRaises(ValueError):
+                binary.write_array(labels[:3], data[:3, :10])
+        with BinaryDs(file, features=14, read_only=True) as dataset:
+            self.assertEqual(dataset.read(0, 8), self.data_raw2)
+            self.assertEqual(dataset.get_category_counts(),
+                             np.bincount(labels).tolist())
+
+    # Gather examples in random order, with reads both coalesced and not
+    def test_read_indices(self):
+        file = os.path.join(self.tmpdir, "read_indices.bin")
+        data = [(i % 3, bytes([i % 256]) * 14) for i in range(500)]
+        with BinaryDs(file, features=14) as binary:
+            binary.write(data)
+        with BinaryDs(file, features=14, read_only=True) as dataset:
+            indices = np.random.default_rng(0).permutation(500)[:200]
+            indices = np.concatenate((indices, [3, 3, 499]))
+            for gap in [0, 150, 65536]:
+                labels, values = dataset.read_indices(indices, gap=gap)
+                self.assertEqual(labels.tolist(),
+                                 [data[i][0] for i in indices])
+                self.assertEqual([bytes(x) for x in values],
+                                 [data[i][1] for i in indices])
+            labels, values = dataset.read_indices([])
+            self.assertEqual(values.shape, (0, 14))
+            with self.assertRaises(IndexError):
+                dataset.read_indices([0, 500])
+
+    # Several threads reading at different positions of the same dataset
+    def test_concurrent_read(self):
+        file = os.path.join(self.tmpdir, "concurrent_read.bin")
+        data = [(i % 3, bytes([i % 256]) * 14) for i in range(200)]
+        with BinaryDs(file, features=14) as binary:
+            binary.write(data)
+        with BinaryDs(file, features=14, read_only=True) as dataset:
+            starts = [x % 190 for x in range(0, 2000, 7)]
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                reads = list(pool.map(lambda x: dataset.read(x, 10), starts))
+                cats = list(pool.map(lambda x: dataset.get_categories(),
+                                     starts))
+            for start, read in zip(starts, reads):
+                self.assertEqual(read, data[start:start + 10])
+            self.assertEqual(set(cats), {3})
+
+    # Assert the memory map follows the writes to the dataset
+    def test_read_array_after_write(self):
+        file = os.path.join(self.tmpdir, "rw_array_update.bin")
+        with BinaryDs(file, features=14) as binary:
+            binary.write(self.data_raw)
+            labels, _ = binary.read_array(0, 3)
+            self.assertEqual(labels.tolist(), [0, 1, 2])
+            binary.write(self.data_raw2)
+            labels, data = binary.read_array(3, 8)
+            self.assertEqual(labels.tolist(), [x[0] for x in self.data_raw2])
+            self.assertEqual(bytes(data[7]), self.data_raw2[7][1])
+
     # try to write into a read-only dataset
     def test_write_to_ro(self):
         file = os.path.join(self.tmpdir, "write_ro.bin")
@@ -115,8 +198,7 @@ class TestBinaryDs(TestCase):
     def test_shuffle(self):
         seed = 32000
         # assert that the order is the expected one
-        random.seed(seed)
-        expected_order = [4, 0, 1, 6, 3, 7, 5, 2]
+        expected_order = [1, 6, 5, 7, 0, 3, 2, 4]
         file = os.path.join(self.tmpdir, "shuffle.bin")
         with BinaryDs(file, features=14) as binary:
             binary.write(self.data_raw2)
@@ -126,6 +208,178 @@ class TestBinaryDs(TestCase):
         for res_idx, exp_idx in enumerate(expected_order):
             self.assertEqual(results[res_idx], self.data_raw2[exp_idx])
 
+    # Shuffle a file bigger than the memory budget, using temporary buckets
+    def test_shuffle_buckets(self):
+        data = [(i % 3, bytes([i % 256, i // 256]) * 7) for i in range(5000)]
+        file1 = os.path.join(self.tmpdir, "shuffle_buckets1.bin")
+        file2 = os.path.join(self.tmpdir, "shuffle_buckets2.bin")
+        with BinaryDs(file1, features=14) as binary:
+            binary.write(data)
+            binary.shuffle(seed=42, memory=4096)
+            results1 = binary.read(0, binary.examples)
+        with BinaryDs(file2, features=14) as binary:
+            binary.write(data)
+            binary.shuffle(seed=42, memory=4096)
+            results2 = binary.read(0, binary.examples)
+        self.assertNotEqual(results1, data)
+        self.assertEqual(sorted(results1), sorted(data))
+        self.assertEqual(results1, results2)
+        leftovers = [x for x in os.listdir(self.tmpdir)
+                     if os.path.isdir(os.path.join(self.tmpdir, x))]
+        self.assertEqual(leftovers, [])
+
+    # Shuffle a file needing more buckets than the files that can be opened
+    def test_shuffle_buckets_nested(self):
+        data = [(i % 3, bytes([i % 256, i // 256]) * 7) for i in range(5000)]
+        file = os.path.join(self.tmpdir, "shuffle_nested.bin")
+        with BinaryDs(file, features=14) as binary:
+            binary.write(data)
+            binary.set_column("group", np.arange(5000, dtype=np.uint64))
+            binary.shuffle(seed=42, memory=512)
+            results = binary.read(0, binary.examples)
+            groups = binary.get_column("group")
+        self.assertNotEqual(results, data)
+        self.assertEqual([data[x] for x in groups], results)
+        leftovers = [x for x in os.listdir(self.tmpdir)
+                     if os.path.isdir(os.path.join(self.tmpdir, x))]
+        self.assertEqual(leftovers, [])
+
+    # Hashes are stored, and only examples without a hash are hashed again
+    def test_hashes(self):
+        file = os.path.join(self.tmpdir, "hashes.bin")
+        values = np.array([list(x[1]) for x in self.data_raw2], dtype=np.uint8)
+        expected = hash_data(values)
+        with BinaryDs(file, features=14) as binary:
+            binary.write(self.data_raw2[:5])
+            self.assertEqual(binary.get_hashes().tolist(),
+                             expected[:5].tolist())
+            binary.write(self.data_raw2[5:])
+            self.assertEqual(binary.get_column("hash").tolist(),
+                             expected[:5].tolist() + [0] * 3)
+            self.assertEqual(binary.get_hashes(jobs=1).tolist(),
+                             expected.tolist())
+            binary.write(self.data_raw2)
+            binary.deduplicate()
+            self.assertEqual(binary.get_examples_no(),
+                             len(np.unique(expected)))
+            self.assertEqual(binary.get_column("hash").tolist(),
+                             binary.get_hashes().tolist())
+
+    # Columns stay aligned with the examples after every operation
+    def test_columns(self):
+        data = [(i % 3, bytes([i % 256, i // 256]) * 7) for i in range(3000)]
+        labels = np.array([x[0] for x in data])
+        values = np.array([list(x[1]) for x in data], dtype=np.uint8)
+        file1 = os.path.join(self.tmpdir, "columns1.bin")
+        file2 = os.path.join(self.tmpdir, "columns2.bin")
+
+        # the column value is the id (first two bytes) of the example
+        def check(dataset):
+            ids = [x[1][0] + 256 * x[1][1]
+                   for x in dataset.read(0, dataset.get_examples_no())]
+            self.assertEqual(dataset.get_column("group").tolist(), ids)
+
+        with BinaryDs(file1, features=14) as binary:
+            binary.write(data[:10])
+            self.assertIsNone(binary.get_column("group"))
+            binary.write_array(labels[10:], values[10:],
+                               columns={"group": np.arange(10, 3000)})
+            self.assertEqual(binary.get_column("group")[:10].tolist(),
+                             [0] * 10)
+            binary.set_column("group", np.arange(3000))
+            check(binary)
+            binary.write(data)
+            binary.deduplicate()
+            check(binary)
+            binary.shuffle(seed=1)
+            check(binary)
+            binary.shuffle(seed=2, memory=4096)
+            check(binary)
+            binary.balance([500, 400])
+            check(binary)
+            with BinaryDs(file2, features=14) as other:
+                binary.split(other, 0.5)
+                check(binary)
+                check(other)
+                binary.truncate(100)
+                check(binary)
+                binary.merge(other)
+                check(binary)
+                self.assertEqual(other.get_column("group").tolist(), [])
+            with self.assertRaises(ValueError):
+                binary.get_column("nonexisting")
+            with self.assertRaises(ValueError):
+                binary.set_column("group", [1, 2])
+
+    # File ids are converted when moving examples between datasets
+    def test_files(self):
+        file1 = os.path.join(self.tmpdir, "files1.bin")
+        file2 = os.path.join(self.tmpdir, "files2.bin")
+        labels = np.array([x[0] for x in self.data_raw2], dtype=np.uint8)
+        data = np.array([list(x[1]) for x in self.data_raw2], dtype=np.uint8)
+        with BinaryDs(file1, features=14) as binary:
+            ids = binary.add_files(["a", "b", "a"])
+            self.assertEqual(ids.tolist(), [1, 2, 1])
+            binary.write_array(labels, data,
+                               columns={"file": [1, 1, 2, 2, 1, 0, 2, 1]})
+        with BinaryDs(file2, features=14) as binary:
+            binary.add_files(["c", "b"])
+            binary.write_array(labels[:2], data[:2], columns={"file": [1, 2]})
+        with BinaryDs(file1, features=14) as binary1, \
+                BinaryDs(file2, features=14) as binary2:
+            self.assertEqual(binary1.get_files(), ["a", "b"])
+            binary1.merge(binary2)
+            self.assertEqual(binary1.get_files(), ["a", "b", "c"])
+            self.assertEqual(binary1.get_column("file").tolist(),
+                             [1, 1, 2, 2, 1, 0, 2, 1, 3, 2])
+            binary1.split(binary2, 0.5)
+            self.assertEqual(binary2.get_files(), ["c", "b", "a"])
+            self.assertEqual(binary2.get_column("file").tolist(),
+                             [0, 2, 3, 1, 2])
+
+    # version 1 files are still readable, writable and can be upgraded
+    def test_upgrade(self):
+        file = os.path.join(self.tmpdir, "upgrade.bin")
+        with open(file, "wb") as fp:
+            fp.write(bytes([0x27, 0x83, 14, 0, 3, 0, 0, 0]))
+            for label, data in self.data_raw:
+                fp.write(bytes([label]) + data)
+        with BinaryDs(file, features=14, read_only=True) as binary:
+            self.assertEqual(binary.get_version(), 1)
+            self.assertEqual(binary.get_categories(), 3)
+            self.assertEqual(binary.read(0, 3), self.data_raw)
+        with BinaryDs(file, features=14) as binary:
+            binary.write(self.data_raw2)
+            with self.assertRaises(ValueError):
+                binary.write([(127, self.data_raw[0][1])])
+        self.assertEqual(os.path.getsize(file), 8 + 15 * 11)
+        with BinaryDs(file, features=14) as binary:
+            binary.upgrade()
+            self.assertEqual(binary.get_version(), 2)
+            self.assertEqual(binary.read(0, 11),
+                             self.data_raw + self.data_raw2)
+        self.assertEqual(os.path.getsize(file), 32 + 16 * 11)
+        with BinaryDs(file, features=14, read_only=True) as binary:
+            self.assertEqual(binary.get_version(), 2)
+            self.assertEqual(binary.get_categories(), 3)
+            self.assertEqual(binary.get_examples_no(), 11)
+            self.assertEqual(binary.read(0, 11),
+                             self.data_raw + self.data_raw2)
+
+    def test_wide_labels(self):
+        file = os.path.join(self.tmpdir, "wide_labels.bin")
+        data = [(300, self.data_raw[0][1]), (2, self.data_raw[1][1]),
+                (65534, self.data_raw[2][1])]
+        with BinaryDs(file, features=14) as binary:
+            binary.write(data)
+            with self.assertRaises(ValueError):
+                binary.write([(65535, self.data_raw[0][1])])
+        with BinaryDs(file, features=14, read_only=True) as binary:
+            self.assertEqual(binary.get_categories(), 65535)
+            self.assertEqual(binary.read(0, 3), data)
+            labels, _ = binary.read_indices([2, 0])
+            self.assertEqual(labels.tolist(), [65534, 300])
+
     # Write a file and then balance it (in place)
     def test_balance(self):
         file = os.path.join(self.tmpdir, "balance.bin")
@@ -137,6 +391,21 @@ class TestBinaryDs(TestCase):
         expected = self.data_raw2[:5] + [self.data_raw2[6]]
         self.assertEqual(results, expected)
 
+    # Balance using a given amount of examples for each category
+    def test_balance_quotas(self):
+        file = os.path.join(self.tmpdir, "balance_quotas.bin")
+        with BinaryDs(file, features=14) as binary:
+            binary.write(self.data_raw2)
+            binary.balance([1, 5, 1])
+            self.assertEqual(binary.get_category_counts(), [1, 2, 1])
+            results = binary.read(0, binary.examples)
+        expected = self.data_raw2[:3] + [self.data_raw2[6]]
+        self.assertEqual(results, expected)
+        self.assertEqual(os.path.getsize(file), 32 + 16 * 4)
+        with BinaryDs(file, features=14) as binary:
+            binary.balance([0])
+            self.assertEqual(binary.read(0, binary.examples), expected[1:])
+
     # Asserts the correct number of features. file already open
     def test_get_encoding(self):
         file_raw = os.path.join(self.tmpdir, "encoding_raw.bin")
@@ -256,6 +525,48 @@ class TestBinaryDs(TestCase):
             data = dataset.read(0, 11)
             self.assertEqual(len(data), len(set(data)))
 
+    # deduplicate keeps the first occurrence and preserves the order
+    def test_deduplicate_order(self):
+        file = os.path.join(self.tmpdir, "deduplicate_order.bin")
+        data = self.data_raw2 + self.data_raw + self.data_raw2[::-1] + \
+            [self.data_raw[2], self.data_raw2[7]]
+        for hash_bytes in [8, 16]:
+            with BinaryDs(file, features=14) as dataset:
+                dataset.truncate()
+                dataset.write(data)
+                dataset.deduplicate(hash_bytes=hash_bytes)
+                self.assertEqual(dataset.get_examples_no(), 11)
+                self.assertEqual(dataset.read(0, 11),
+                                 self.data_raw2 + self.data_raw)
+            self.assertEqual(os.path.getsize(file), 32 + 16 * 11)
+        with BinaryDs(file, features=14) as dataset:
+            with self.assertRaises(ValueError):
+                dataset.deduplicate(hash_bytes=4)
+
+    # parallel deduplication gives the same result of the serial one
+    def test_deduplicate_parallel(self):
+        # large enough to be hashed by several processes
+        features = 4096
+        examples = 2 * PARALLEL_HASH_SIZE // features
+        rows = np.arange(examples)
+        labels = rows % 3
+        data = np.zeros((examples, features), dtype=np.uint8)
+        data[:, 0] = rows % 7
+        data[:, 1] = rows % 13
+        file1 = os.path.join(self.tmpdir, "deduplicate_serial.bin")
+        file2 = os.path.join(self.tmpdir, "deduplicate_parallel.bin")
+        with BinaryDs(file1, features=features) as dataset:
+            dataset.write_array(labels, data)
+            dataset.deduplicate(jobs=1)
+            serial = dataset.read_array(0, dataset.get_examples_no())
+        with BinaryDs(file2, features=features) as dataset:
+            dataset.write_array(labels, data)
+            dataset.deduplicate(jobs=3)
+            parallel = dataset.read_array(0, dataset.get_examples_no())
+        self.assertEqual(len(serial[0]), 7 * 13)
+        self.assertTrue(np.array_equal(serial[0], parallel[0]))
+        self.assertTrue(np.array_equal(serial[1], parallel[1]))
+
     def test_update_categories(self):
         file = os.path.join(self.tmpdir, "categories.bin")
         with BinaryDs(file, features=14) as dataset:
@@ -267,4 +578,47 @@ class TestBinaryDs(TestCase):
         with BinaryDs(file, features=14) as dataset:
             self.assertEqual(dataset.get_categories(), 3)
 
+    def test_category_counts(self):
+        file = os.path.join(self.tmpdir, "counts.bin")
+        with BinaryDs(file, features=14) as dataset:
+            self.assertEqual(dataset.get_category_counts(), [])
+            dataset.write(self.data_raw)
+            dataset.write(self.data_raw2)
+            self.assertEqual(dataset.get_category_counts(), [5, 3, 3])
+            dataset.truncate(left=7)
+            self.assertEqual(dataset.get_category_counts(), [3, 2, 2])
+        self.assertTrue(os.path.exists(file + ".counts"))
+        with BinaryDs(file, features=14, read_only=True) as dataset:
+            self.assertEqual(dataset.get_category_counts(), [3, 2, 2])
+            self.assertEqual(dataset.get_categories(), 3)
 
+    def test_category_counts_operations(self):
+        file1 = os.path.join(self.tmpdir, "counts_opA.bin")
+        file2 = os.path.join(self.tmpdir, "counts_opB.bin")
+        with BinaryDs(file1, features=14) as dataset1, \
+                BinaryDs(file2, features=14) as dataset2:
+            dataset1.write(self.data_raw2)
+            dataset1.write(self.data_raw2)
+            dataset1.deduplicate()
+            self.assertEqual(dataset1.get_category_counts(), [4, 2, 2])
+            dataset1.balance()
+            self.assertEqual(dataset1.get_category_counts(), [2, 2, 2])
+            dataset1.split(dataset2, 0.5)
+            self.assertEqual(dataset1.get_category_counts(), [1, 1, 1])
+            self.assertEqual(dataset2.get_category_counts(), [1, 1, 1])
+            dataset2.merge(dataset1)
+            self.assertEqual(dataset1.get_category_counts(), [])
+            self.assertEqual(dataset2.get_category_counts(), [2, 2, 2])
+
+    # the counts sidecar is rebuilt if not consistent with the dataset
+    def test_category_counts_stale(self):
+        file = os.path.join(self.tmpdir, "counts_stale.bin")
+        with BinaryDs(file, features=14) as dataset:
+            dataset.write(self.data_raw2)
+        os.remove(file + ".counts")
+        with BinaryDs(file, features=14, read_only=True) as dataset:
+            self.assertEqual(dataset.get_category_counts(), [4, 2, 2])
+        with open(file + ".counts", "wb") as fp:
+            fp.write(b"\x01\x00\x00\x00\x00\x00\x00\x00" * 2)
+        with BinaryDs(file, features=14) as dataset:
+            self.assertEqual(dataset.get_category_counts(), [4, 2, 2])
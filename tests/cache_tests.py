@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from src.cache import ExtractionCache
+
+PREFIX = "BCCFLT_"
+
+
+class TestExtractionCache(TestCase):
+    tmpdir: str = None
+
+    @classmethod
+    def setUpClass(self):
+        systmpdir = tempfile.gettempdir()
+        self.tmpdir = tempfile.mkdtemp(prefix=PREFIX, dir=systmpdir)
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name: str, content: bytes) -> str:
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "wb") as fp:
+            fp.write(content)
+        return path
+
+    def test_key(self):
+        cache = ExtractionCache(os.path.join(self.tmpdir, "key"))
+        file1 = self.write("key1", b"\x01\x02\x03")
+        file2 = self.write("key2", b"\x01\x02\x03")
+        file3 = self.write("key3", b"\x01\x02\x04")
+        self.assertEqual(cache.key(file1, "raw"), cache.key(file2, "raw"))
+        self.assertNotEqual(cache.key(file1, "raw"), cache.key(file3, "raw"))
+        self.assertNotEqual(cache.key(file1, "raw"),
+                            cache.key(file1, "encoded"))
+
+    def test_fetch_store(self):
+        cache = ExtractionCache(os.path.join(self.tmpdir, "store"))
+        out_file = os.path.join(self.tmpdir, "store_out.bin")
+        self.assertFalse(cache.fetch("abcdef", out_file))
+        self.write("store_result.bin", b"result")
+        cache.store("abcdef", os.path.join(self.tmpdir, "store_result.bin"))
+        self.write("store_out.bin", b"stale")
+        self.assertTrue(cache.fetch("abcdef", out_file))
+        with open(out_file, "rb") as fp:
+            self.assertEqual(fp.read(), b"result")
+
+    def test_evict(self):
+        cache = ExtractionCache(os.path.join(self.tmpdir, "evict"), 25)
+        result = self.write("evict_result.bin", b"0123456789")
+        for key in ["aa01", "aa02", "bb03"]:
+            cache.store(key, result)
+            path = os.path.join(cache.directory, key[:2], key)
+            # distinct modification times, the first key is the oldest
+            os.utime(path, (time.time(), time.time() - 100))
+            os.remove(result)
+            self.write("evict_result.bin", b"0123456789")
+        cache.fetch("aa01", os.path.join(self.tmpdir, "evict_out.bin"))
+        self.assertEqual(cache.evict(), 1)
+        keys = [os.path.basename(entry[2]) for entry in cache.entries()]
+        self.assertEqual(sorted(keys), ["aa01", "bb03"])
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from src.binaryds import BinaryDs
+from src.compressedds import CompressedDs, compress_dataset
+
+PREFIX = "BCCFLT_"
+
+
+class TestCompressedDs(TestCase):
+    tmpdir: str = None
+    data = [(i % 3, bytes([i % 256, i // 256]) * 7) for i in range(100)]
+
+    @classmethod
+    def setUpClass(self):
+        systmpdir = tempfile.gettempdir()
+        self.tmpdir = tempfile.mkdtemp(prefix=PREFIX, dir=systmpdir)
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_unknown_codec(self):
+        file = os.path.join(self.tmpdir, "unknown.binz")
+        with self.assertRaises(ValueError):
+            CompressedDs(file, codec="rar")
+
+    def test_wrong_features(self):
+        file = os.path.join(self.tmpdir, "wrong_features.binz")
+        with CompressedDs(file, features=14) as dataset:
+            with self.assertRaises(ValueError):
+                dataset.write([(0, b"\x00")])
+        with self.assertRaises(IOError):
+            CompressedDs(file, features=2048).open()
+
+    # Write some blocks with every standard codec, then read them
+    def test_read_write(self):
+        for codec in ["zlib", "lzma", "bz2"]:
+            file = os.path.join(self.tmpdir, f"rw_{codec}.binz")
+            with CompressedDs(file, features=14, codec=codec,
+                              block_examples=16) as dataset:
+                dataset.write(self.data[:50])
+                self.assertEqual(dataset.read(40, 10), self.data[40:50])
+                dataset.write(self.data[50:])
+            with CompressedDs(file, read_only=True) as dataset:
+                self.assertEqual(dataset.codec, codec)
+                self.assertEqual(dataset.get_features(), 14)
+                self.assertEqual(dataset.get_examples_no(), 100)
+                self.assertEqual(dataset.read(0, 100), self.data)
+                self.assertEqual(dataset.read(30, 5), self.data[30:35])
+                labels, data = dataset.read_array(95, 5)
+                self.assertEqual(labels.tolist(), [2, 0, 1, 2, 0])
+                self.assertEqual(bytes(data[4]), self.data[99][1])
+                self.assertEqual(dataset.get_category_counts(), [34, 33, 33])
+                with self.assertRaises(IndexError):
+                    dataset.read(99, 2)
+
+    # Append to an existing file whose last block is not full
+    def test_append(self):
+        file = os.path.join(self.tmpdir, "append.binz")
+        with CompressedDs(file, features=14, block_examples=16) as dataset:
+            dataset.write(self.data[:20])
+        with CompressedDs(file, features=14) as dataset:
+            self.assertEqual(dataset.read(0, 20), self.data[:20])
+            dataset.write(self.data[20:])
+        with CompressedDs(file, read_only=True) as dataset:
+            self.assertEqual(len(dataset.offsets), 8)
+            self.assertEqual(dataset.read(0, 100), self.data)
+
+    def test_compress_dataset(self):
+        file = os.path.join(self.tmpdir, "source.bin")
+        compressed = os.path.join(self.tmpdir, "source.binz")
+        with BinaryDs(file, features=14) as dataset:
+            dataset.write(self.data * 10)
+        with BinaryDs(file, read_only=True) as dataset:
+            compress_dataset(dataset, compressed, block_examples=64)
+        self.assertLess(os.path.getsize(compressed), os.path.getsize(file))
+        with CompressedDs(compressed, read_only=True) as dataset:
+            self.assertEqual(dataset.read(0, 1000), self.data * 10)
+
+    # labels wider than a byte are preserved by the compression
+    def test_wide_labels(self):
+        file = os.path.join(self.tmpdir, "wide.bin")
+        compressed = os.path.join(self.tmpdir, "wide.binz")
+        data = [(300, self.data[0][1]), (65534, self.data[1][1])]
+        with BinaryDs(file, features=14) as dataset:
+            dataset.write(data)
+        with BinaryDs(file, read_only=True) as dataset:
+            compress_dataset(dataset, compressed)
+        with CompressedDs(compressed, read_only=True) as dataset:
+            self.assertEqual(dataset.read(0, 2), data)
+            self.assertEqual(dataset.get_categories(), 65535)
+
+    # labels and data can be given as lists
+    def test_write_array_lists(self):
+        file = os.path.join(self.tmpdir, "lists.binz")
+        labels = [label for label, _ in self.data]
+        rows = [list(data) for _, data in self.data]
+        with CompressedDs(file, features=14) as dataset:
+            dataset.write_array(labels, rows)
+        with CompressedDs(file, read_only=True) as dataset:
+            self.assertEqual(dataset.read(0, len(self.data)), self.data)
@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from src.binaryds import BinaryDs
+from src.datasetview import BinaryDsView, open_split, \
+    split_category_counts, split_exists, stratified_split, write_splits
+
+PREFIX = "BCCFLT_"
+
+
+class TestBinaryDsView(TestCase):
+    tmpdir: str = None
+    data = [(i % 3, bytes([i % 256, i // 256]) * 7) for i in range(100)]
+
+    @classmethod
+    def setUpClass(self):
+        systmpdir = tempfile.gettempdir()
+        self.tmpdir = tempfile.mkdtemp(prefix=PREFIX, dir=systmpdir)
+        self.file = os.path.join(self.tmpdir, "dataset.bin")
+        with BinaryDs(self.file, features=14) as dataset:
+            dataset.write(self.data)
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_range(self):
+        with BinaryDs(self.file, read_only=True) as dataset:
+            view = BinaryDsView(dataset, 20, 50)
+            self.assertEqual(view.get_examples_no(), 30)
+            self.assertEqual(view.get_features(), 14)
+            self.assertEqual(view.read(0, 30), self.data[20:50])
+            labels, data = view.read_array(5, 3)
+            self.assertEqual(labels.tolist(), [x[0] for x in self.data[25:28]])
+            self.assertEqual(bytes(data[2]), self.data[27][1])
+            self.assertEqual(view.get_category_counts(), [10, 10, 10])
+            with self.assertRaises(IndexError):
+                view.read(25, 10)
+            with self.assertRaises(IndexError):
+                BinaryDsView(dataset, 90, 110)
+
+    def test_indices(self):
+        indices = np.array([99, 3, 42, 7])
+        with BinaryDs(self.file, read_only=True) as dataset:
+            view = BinaryDsView(dataset, indices=indices)
+            self.assertEqual(view.get_examples_no(), 4)
+            self.assertEqual(view.read(0, 4), [self.data[i] for i in indices])
+            self.assertEqual(view.read(1, 2), [self.data[3], self.data[42]])
+            self.assertEqual(view.get_category_counts(), [3, 1])
+            self.assertEqual(view.get_categories(), 3)
+            labels, _ = view.read_indices([2, 0])
+            self.assertEqual(labels.tolist(), [0, 0])
+            with self.assertRaises(IndexError):
+                view.read_indices([4])
+
+    def test_open_split(self):
+        splits = {"train": (0, 60), "validate": (60, 80),
+                  "test": np.arange(99, 79, -1)}
+        write_splits(self.tmpdir, splits)
+        self.assertTrue(split_exists(self.tmpdir, "test"))
+        with open_split(self.tmpdir, "train") as train:
+            self.assertEqual(train.read(0, 60), self.data[:60])
+        with open_split(self.tmpdir, "validate") as validate:
+            self.assertEqual(validate.read(0, 20), self.data[60:80])
+        with open_split(self.tmpdir, "test") as test:
+            self.assertEqual(test.read(0, 20), self.data[80:][::-1])
+        os.remove(os.path.join(self.tmpdir, "splits.json"))
+
+    # counts written with the splits are used without reading the labels
+    def test_split_counts(self):
+        labels = np.array([x[0] for x in self.data])
+        splits = {"train": (0, 60), "test": np.array([99, 96, 93])}
+        counts = split_category_counts(labels, splits)
+        self.assertEqual(counts, {"train": [20, 20, 20], "test": [3]})
+        counts["train"] = [1, 2, 3]
+        write_splits(self.tmpdir, splits, counts)
+        with open_split(self.tmpdir, "train") as train:
+            self.assertEqual(train.get_category_counts(), [1, 2, 3])
+        with open_split(self.tmpdir, "test") as test:
+            self.assertEqual(test.get_category_counts(), [3])
+        os.remove(os.path.join(self.tmpdir, "splits.json"))
+
+    # Directories with a file for each split are still supported
+    def test_open_legacy(self):
+        legacy_dir = os.path.join(self.tmpdir, "legacy")
+        os.mkdir(legacy_dir)
+        self.assertFalse(split_exists(legacy_dir, "train"))
+        with BinaryDs(os.path.join(legacy_dir, "train.bin"),
+                      features=14) as dataset:
+            dataset.write(self.data[:10])
+        self.assertTrue(split_exists(legacy_dir, "train"))
+        with open_split(legacy_dir, "train") as train:
+            self.assertEqual(train.read(0, 10), self.data[:10])
+
+    # Groups are never split, categories are split with the given ratios
+    def test_stratified_split(self):
+        labels = np.repeat([0, 1, 2], 1000)
+        groups = np.arange(3000) // 10
+        splits = stratified_split(labels, groups, [0.5, 0.25, 0.25], seed=3)
+        self.assertEqual(sorted(np.concatenate(splits).tolist()),
+                         list(range(3000)))
+        found = [set(groups[x].tolist()) for x in splits]
+        self.assertEqual(found[0] & found[1], set())
+        self.assertEqual(found[0] & found[2], set())
+        self.assertEqual(found[1] & found[2], set())
+        for split, ratio in zip(splits, [0.5, 0.25, 0.25]):
+            counts = np.bincount(labels[split], minlength=3)
+            for count in counts:
+                self.assertAlmostEqual(count / 1000, ratio, delta=0.02)
+        again = stratified_split(labels, groups, [0.5, 0.25, 0.25], seed=3)
+        self.assertEqual([x.tolist() for x in splits],
+                         [x.tolist() for x in again])
+        other = stratified_split(labels, groups, [0.5, 0.25, 0.25], seed=4)
+        self.assertNotEqual(splits[2].tolist(), other[2].tolist())
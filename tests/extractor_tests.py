@@ -1,11 +1,18 @@
 import csv
+import json
 import os
 import shutil
 import tempfile
 from unittest import TestCase
 
-from src.extractor import extract_dot_text, extract_dot_text_to_file, \
-    extract_function_to_file, get_opcode
+import numpy as np
+
+from src.cache import ExtractionCache
+from src.extractor import analyze_functions, extract_cached, \
+    extract_dot_text, extract_dot_text_to_file, extract_function_pooled, \
+    extract_function_to_file, extract_task, get_opcode, get_opcodes, \
+    run_extractor, stream_elements
+from src.manifest import MANIFEST_FILE, ExtractionManifest
 
 PREFIX = "BCCFLT_"
 
@@ -159,6 +166,109 @@ class TestExtractor(TestCase):
             extracted_data = list(fp.read())
         self.assertEqual(extracted_data, self.expected)
 
+    # extract twice the same file, the second time from the cache
+    def test_extract_cached(self):
+        cache = os.path.join(self.tmpdir, "cache")
+        outdir = os.path.join(self.tmpdir, "cached")
+        os.mkdir(outdir)
+        copy = os.path.join(self.tmpdir, "copy")
+        shutil.copyfile(self.file, copy)
+        for _ in range(2):
+            run_extractor([self.file, copy], outdir, False, 2, cache_dir=cache)
+            os.remove(os.path.join(outdir, MANIFEST_FILE))
+            for name in ["tempfile.bin", "copy.bin"]:
+                with open(os.path.join(outdir, name), "rb") as fp:
+                    self.assertEqual(list(fp.read()), self.expected)
+        self.assertEqual(len(os.listdir(cache)), 1)
+        # extracting again without the cache does not write into the entry
+        folder = os.path.join(cache, os.listdir(cache)[0])
+        entry = os.path.join(folder, os.listdir(folder)[0])
+        extracted = os.path.join(outdir, "copy.bin")
+        extract_dot_text_to_file(self.file, extracted)
+        self.assertFalse(os.path.samefile(extracted, entry))
+
+    # a second run extracts only the files missing from the first one
+    def test_extract_resumed(self):
+        outdir = os.path.join(self.tmpdir, "resumed")
+        os.mkdir(outdir)
+        missing = os.path.join(self.tmpdir, "missing")
+        run_extractor([self.file, missing], outdir, False, 2)
+        path = os.path.join(outdir, MANIFEST_FILE)
+        with open(path, "r") as fp:
+            mode = json.loads(fp.readline())["mode"]
+        manifest = ExtractionManifest(path, mode)
+        self.assertTrue(manifest.is_completed(self.file))
+        self.assertEqual(len(manifest.failures()), 1)
+        with open(path, "r") as fp:
+            lines = len(fp.readlines())
+        run_extractor([self.file, missing], outdir, False, 2)
+        with open(path, "r") as fp:
+            self.assertEqual(len(fp.readlines()), lines)
+        run_extractor([self.file, missing], outdir, False, 2, retry=True)
+        with open(path, "r") as fp:
+            self.assertEqual(len(fp.readlines()), lines + 1)
+        shutil.copyfile(self.file, missing)
+        run_extractor([self.file, missing], outdir, False, 2)
+        self.assertTrue(os.path.exists(os.path.join(outdir, "missing.bin")))
+        manifest = ExtractionManifest(path, mode)
+        self.assertEqual(len(manifest.failures()), 0)
+        # outputs removed after the extraction are written again
+        extracted = os.path.join(outdir, "tempfile.bin")
+        os.remove(extracted)
+        run_extractor([self.file, missing], outdir, False, 2)
+        self.assertTrue(os.path.exists(extracted))
+
+    def test_extract_task(self):
+        out_file = os.path.join(self.tmpdir, "task.bin")
+        arg = {"file": self.file, "out_file": out_file}
+        result = extract_task(extract_dot_text_to_file, arg, None, "", 60)
+        self.assertEqual(result["status"], "done")
+        arg["file"] = os.path.join(self.tmpdir, "nonexisting")
+        result = extract_task(extract_dot_text_to_file, arg, None, "", 60)
+        self.assertEqual(result["status"], "failed")
+        self.assertIn("error", result)
+
+    # degraded results, signaled by returning False, are not cached
+    def test_extract_cached_degraded(self):
+        cache = ExtractionCache(os.path.join(self.tmpdir, "degraded"))
+        out_file = os.path.join(self.tmpdir, "degraded.bin")
+
+        def degraded(file, out_file):
+            extract_dot_text_to_file(file, out_file)
+            return False
+
+        self.assertFalse(extract_cached(degraded, cache, "mode", self.file,
+                                        out_file))
+        self.assertTrue(os.path.exists(out_file))
+        self.assertEqual(cache.entries(), [])
+        extract_cached(extract_dot_text_to_file, cache, "mode", self.file,
+                       out_file)
+        self.assertEqual(len(cache.entries()), 1)
+
+    # stream the data of more files than the queue, keeping them on disk
+    def test_stream_elements(self):
+        keep = os.path.join(self.tmpdir, "stream")
+        os.mkdir(keep)
+        files = [self.file] * 10
+        found = list(stream_elements(files, False, 2, keep_dir=keep))
+        self.assertEqual(len(found), 10)
+        for file, elements in found:
+            self.assertEqual(file, self.file)
+            self.assertEqual(elements, [(bytes(self.expected), 0)])
+        with open(os.path.join(keep, "tempfile.bin"), "rb") as fp:
+            self.assertEqual(list(fp.read()), self.expected)
+
+    # files that can not be extracted are skipped without stopping the stream
+    def test_stream_elements_invalid(self):
+        text = os.path.join(self.tmpdir, "notes.txt")
+        with open(text, "w") as fp:
+            fp.write("not a binary")
+        files = [text, self.file, os.path.join(self.tmpdir, "nonexisting")]
+        found = dict(stream_elements(files, False, 2))
+        self.assertEqual(found[text], [])
+        self.assertEqual(found[files[2]], [])
+        self.assertEqual(found[self.file], [(bytes(self.expected), 0)])
+
     def test_get_opcode_x8664(self):
         inputs = ["f30f1efa", "e953ffff", "0f97C1", "490faf", "f2ff", "f20fc7"]
         expected = [bytearray(b"\x0f\x1e"),
@@ -171,6 +281,19 @@ class TestExtractor(TestCase):
             opcode = get_opcode(bytearray.fromhex(inputs[i]))
             self.assertEqual(opcode, expected[i])
 
+    # the batched version gives the same result of the scalar one
+    def test_get_opcodes(self):
+        rng = np.random.default_rng(0)
+        prefixes = [0x0F, 0xF2, 0xF3, 0x26, 0x2E, 0x3E, 0x66, 0x67, 0xF0]
+        values = np.array(prefixes * 20 + list(range(256)), dtype=np.uint8)
+        for _ in range(200):
+            statements = [rng.choice(values, size=rng.integers(0, 7)).tobytes()
+                          for _ in range(rng.integers(0, 50))]
+            offsets = np.cumsum([0] + [len(x) for x in statements])[:-1]
+            expected = b"".join(get_opcode(bytearray(x)) for x in statements)
+            self.assertEqual(get_opcodes(b"".join(statements), offsets),
+                             expected)
+
     def test_extract_function_to_file(self):
         self.assertTrue(os.path.exists(self.file))
         extracted = os.path.join(self.tmpdir, "extracted.csv")
@@ -180,3 +303,30 @@ class TestExtractor(TestCase):
         with open(extracted, "r") as fp:
             read = csv.reader(fp, delimiter=",")
             self.assertEqual(sum(1 for _ in read), 10)
+
+    # the same r2 session is reused, giving the same result of a new one
+    def test_extract_function_pooled(self):
+        self.assertTrue(os.path.exists(self.file))
+        expected = os.path.join(self.tmpdir, "expected.csv")
+        extract_function_to_file(self.file, expected)
+        with open(expected, "r") as fp:
+            expected_data = fp.read()
+        for i in range(3):
+            extracted = os.path.join(self.tmpdir, f"pooled{i}.csv")
+            self.assertTrue(extract_function_pooled(self.file, extracted))
+            with open(extracted, "r") as fp:
+                self.assertEqual(fp.read(), expected_data)
+
+    # cheaper levels find a subset of the functions of the full analysis
+    def test_extract_function_levels(self):
+        with self.assertRaises(ValueError):
+            analyze_functions(None, "aaaa")
+        found = {}
+        for level in ["aa", "aaa"]:
+            extracted = os.path.join(self.tmpdir, f"level_{level}.csv")
+            extract_function_to_file(self.file, extracted, level)
+            with open(extracted, "r") as fp:
+                read = csv.DictReader(fp, delimiter=",")
+                found[level] = {row["offset"] for row in read}
+        self.assertEqual(len(found["aaa"]), 9)
+        self.assertTrue(found["aa"].issubset(found["aaa"]))
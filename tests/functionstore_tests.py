@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from src.functionstore import read_function_store, write_function_store
+
+PREFIX = "BCCFLT_"
+
+
+class TestFunctionStore(TestCase):
+    tmpdir: str = None
+    rows = [[4096, "main", 12, b"\x55\x48\x89\xe5", b"\x55\x89"],
+            [8192, "sym.déjà_vu", 0, b"", b""],
+            [2 ** 40, "fcn.00001000", 3, b"\xc3" * 300, b"\xc3" * 300]]
+
+    @classmethod
+    def setUpClass(self):
+        systmpdir = tempfile.gettempdir()
+        self.tmpdir = tempfile.mkdtemp(prefix=PREFIX, dir=systmpdir)
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_write(self):
+        path = os.path.join(self.tmpdir, "functions.fns")
+        write_function_store(self.rows, path)
+        self.assertEqual(read_function_store(path), self.rows)
+
+    def test_empty(self):
+        path = os.path.join(self.tmpdir, "empty.fns")
+        write_function_store([], path)
+        self.assertEqual(read_function_store(path), [])
+
+    def test_wrong_file(self):
+        path = os.path.join(self.tmpdir, "wrong.fns")
+        with open(path, "w") as fp:
+            fp.write("offset,name,size,raw,opcodes\n")
+        with self.assertRaises(IOError):
+            read_function_store(path)
+        write_function_store(self.rows, path)
+        os.truncate(path, os.path.getsize(path) - 1)
+        with self.assertRaises(IOError):
+            read_function_store(path)
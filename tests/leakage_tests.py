@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from src.binaryds import BinaryDs
+from src.datasetview import open_split, write_splits
+from src.leakage import find_leaks, run_purge_leaks
+
+PREFIX = "BCCFLT_"
+
+
+class TestLeakage(TestCase):
+    tmpdir: str = None
+    data = [(i % 3, bytes([i % 256, i // 256]) * 7) for i in range(100)]
+
+    @classmethod
+    def setUpClass(self):
+        systmpdir = tempfile.gettempdir()
+        self.tmpdir = tempfile.mkdtemp(prefix=PREFIX, dir=systmpdir)
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_find_leaks(self):
+        hashes = [np.array([5, 1], dtype=np.uint64),
+                  np.array([2, 5, 3, 2], dtype=np.uint64),
+                  np.array([3, 4, 1, 7], dtype=np.uint64)]
+        leaks = find_leaks(hashes)
+        self.assertEqual(leaks[0].tolist(), [False, False])
+        self.assertEqual(leaks[1].tolist(), [False, True, False, False])
+        self.assertEqual(leaks[2].tolist(), [True, False, True, False])
+
+    # Leaks between views of the same dataset, removed from the definition
+    def test_purge_views(self):
+        model_dir = os.path.join(self.tmpdir, "views")
+        os.mkdir(model_dir)
+        with BinaryDs(os.path.join(model_dir, "dataset.bin"),
+                      features=14) as dataset:
+            dataset.write(self.data + self.data[10:20])
+        write_splits(model_dir, {"train": np.arange(0, 50),
+                                 "validate": (50, 80),
+                                 "test": np.arange(80, 110)})
+        run_purge_leaks(model_dir, False, 1)
+        with open_split(model_dir, "train") as train:
+            self.assertEqual(train.get_examples_no(), 50)
+            # the hashes are calculated once and stored in the dataset
+            self.assertEqual(len(train.base.get_column("hash")), 110)
+        run_purge_leaks(model_dir, True, 1)
+        with open_split(model_dir, "train") as train:
+            self.assertEqual(train.read(0, 40),
+                             self.data[:10] + self.data[20:50])
+        with open_split(model_dir, "validate") as validate:
+            self.assertEqual(validate.read(0, 30), self.data[50:80])
+        with open_split(model_dir, "test") as test:
+            self.assertEqual(test.get_examples_no(), 30)
+        # the stored counts are updated with the removed examples
+        with open_split(model_dir, "train") as train:
+            self.assertEqual(train.counts, [14, 13, 13])
+
+    # Leaks between separate files, as generated by older versions
+    def test_purge_legacy(self):
+        model_dir = os.path.join(self.tmpdir, "legacy")
+        os.mkdir(model_dir)
+        contents = {"train": self.data[:60], "validate": self.data[55:70],
+                    "test": self.data[65:80] + self.data[:5]}
+        for name, content in contents.items():
+            with BinaryDs(os.path.join(model_dir, name + ".bin"),
+                          features=14) as dataset:
+                dataset.write(content)
+        run_purge_leaks(model_dir, True, 1)
+        with open_split(model_dir, "train") as train:
+            self.assertEqual(train.read(0, 50), self.data[5:55])
+        with open_split(model_dir, "validate") as validate:
+            self.assertEqual(validate.read(0, 10), self.data[55:65])
+        with open_split(model_dir, "test") as test:
+            self.assertEqual(test.get_examples_no(), 20)
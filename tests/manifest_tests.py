@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from src.manifest import ExtractionManifest
+
+PREFIX = "BCCFLT_"
+
+
+class TestManifest(TestCase):
+    tmpdir: str = None
+
+    @classmethod
+    def setUpClass(self):
+        systmpdir = tempfile.gettempdir()
+        self.tmpdir = tempfile.mkdtemp(prefix=PREFIX, dir=systmpdir)
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name: str, content: bytes) -> str:
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "wb") as fp:
+            fp.write(content)
+        return path
+
+    def test_reload(self):
+        path = os.path.join(self.tmpdir, "reload.manifest")
+        done = self.write("done", b"done")
+        failed = self.write("failed", b"failed")
+        manifest = ExtractionManifest(path)
+        manifest.record(done, "timeout")
+        manifest.record(done, "done", time=1.5)
+        manifest.record(failed, "failed", error="error")
+        manifest = ExtractionManifest(path)
+        self.assertTrue(manifest.is_completed(done))
+        self.assertFalse(manifest.is_completed(failed))
+        self.assertTrue(manifest.is_completed(failed, failures=True))
+        self.assertFalse(manifest.is_completed(os.path.join(self.tmpdir,
+                                                            "unknown")))
+        self.assertEqual([x["file"] for x in manifest.failures()],
+                         [os.path.abspath(failed)])
+        self.assertEqual(manifest.failures()[0]["error"], "error")
+
+    # a modified input is extracted again
+    def test_modified(self):
+        path = os.path.join(self.tmpdir, "modified.manifest")
+        file = self.write("modified", b"before")
+        manifest = ExtractionManifest(path)
+        manifest.record(file, "empty")
+        self.assertTrue(manifest.is_completed(file))
+        self.write("modified", b"after the change")
+        self.assertFalse(ExtractionManifest(path).is_completed(file))
+
+    # each type of extraction has its own records, and removed outputs are
+    # extracted again
+    def test_mode_and_output(self):
+        path = os.path.join(self.tmpdir, "mode.manifest")
+        file = self.write("mode", b"data")
+        output = self.write("mode.bin", b"extracted")
+        ExtractionManifest(path, "raw").record(file, "done", output)
+        self.assertTrue(ExtractionManifest(path, "raw").is_completed(file))
+        self.assertFalse(ExtractionManifest(path, "encoded").is_completed(
+            file))
+        os.remove(output)
+        self.assertFalse(ExtractionManifest(path, "raw").is_completed(file))
+
+    # the last line, cut by an interruption, is ignored
+    def test_truncated(self):
+        path = os.path.join(self.tmpdir, "truncated.manifest")
+        file = self.write("truncated", b"data")
+        manifest = ExtractionManifest(path)
+        manifest.record(file, "done")
+        with open(path, "a") as fp:
+            fp.write('{"file": "')
+        manifest = ExtractionManifest(path)
+        self.assertTrue(manifest.is_completed(file))
+        self.assertEqual(len(manifest.records), 1)
@@ -0,0 +1,82 @@
+import os
+import shutil
+import struct
+import tempfile
+from unittest import TestCase
+
+from src.sections import read_text_section
+
+PREFIX = "BCCFLT_"
+
+
+class TestSections(TestCase):
+    tmpdir: str = None
+    text: bytes = bytes(range(40, 90))
+
+    @classmethod
+    def setUpClass(self):
+        systmpdir = tempfile.gettempdir()
+        self.tmpdir = tempfile.mkdtemp(prefix=PREFIX, dir=systmpdir)
+
+    @classmethod
+    def tearDownClass(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name: str, content: bytes) -> str:
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "wb") as fp:
+            fp.write(content)
+        return path
+
+    def test_elf_resource(self):
+        data = read_text_section("./resources/tempfile")
+        self.assertEqual(len(data), 1845)
+        self.assertEqual(data[:4], b"\xf3\x0f\x1e\xfa")
+
+    # 32 bit big endian ELF with sections: null, .text, .shstrtab
+    def test_elf32_big_endian(self):
+        names = b"\x00.text\x00.shstrtab\x00"
+        text_offset = 52
+        names_offset = text_offset + len(self.text)
+        shoff = names_offset + len(names)
+        header = b"\x7fELF\x01\x02\x01" + bytes(9)
+        header += struct.pack(">HHIIIIIHHHHHH", 2, 8, 1, 0, 0, shoff, 0, 52,
+                              0, 0, 40, 3, 2)
+        sections = bytes(40)
+        sections += struct.pack(">IIIIIIIIII", 1, 1, 6, 0x1000, text_offset,
+                                len(self.text), 0, 0, 4, 0)
+        sections += struct.pack(">IIIIIIIIII", 7, 3, 0, 0, names_offset,
+                                len(names), 0, 0, 1, 0)
+        path = self.write("elf32be", header + self.text + names + sections)
+        self.assertEqual(read_text_section(path), self.text)
+
+    def test_pe(self):
+        dos = b"MZ" + bytes(0x3A) + struct.pack("<I", 0x40)
+        coff = b"PE\x00\x00" + struct.pack("<HHIIIHH", 0x8664, 2, 0, 0, 0,
+                                           16, 0)
+        optional = bytes(16)
+        table_end = len(dos) + len(coff) + len(optional) + 80
+        data = struct.pack("<8sIIIIIIHHI", b".data", 8, 0x2000, 8, 0, 0, 0,
+                           0, 0, 0)
+        text = struct.pack("<8sIIIIIIHHI", b".text", len(self.text), 0x1000,
+                           len(self.text), table_end, 0, 0, 0, 0, 0)
+        path = self.write("pe", dos + coff + optional + data + text +
+                          self.text)
+        self.assertEqual(read_text_section(path), self.text)
+
+    def test_macho(self):
+        segment = struct.pack("<II16sQQQQiiII", 0x19, 72 + 80, b"__TEXT", 0,
+                              0x1000, 0, 0x1000, 5, 5, 1, 0)
+        offset = 32 + len(segment) + 80
+        section = struct.pack("<16s16sQQIIIIIIII", b"__text", b"__TEXT",
+                              0x100, len(self.text), offset, 0, 0, 0, 0, 0,
+                              0, 0)
+        header = struct.pack("<IiiIIIII", 0xFEEDFACF, 0x01000007, 3, 2, 1,
+                             len(segment) + 80, 0, 0)
+        path = self.write("macho", header + segment + section + self.text)
+        self.assertEqual(read_text_section(path), self.text)
+
+    def test_unsupported(self):
+        self.assertIsNone(read_text_section(self.write("empty", b"")))
+        self.assertIsNone(read_text_section(self.write("text", b"hello")))
+        self.assertIsNone(read_text_section(self.write("short", b"MZ")))